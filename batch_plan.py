@@ -0,0 +1,101 @@
+"""批量路径规划, 不需要界面
+
+每个病例一个文件夹, 包括 CT 和各个掩膜(文件名见 utils.planning.CASE_FILES), 结果保存在输出目录下同名的文件夹中:
+plan.json 为规划结果、参数和各阶段耗时, 中间结果与界面中 result 目录的内容相同. 所有病例的汇总保存在 summary.json.
+
+    python batch_plan.py cases/ output/ --workers 4 --max-needle-depth 150
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import multiprocessing
+from dataclasses import asdict, fields
+from utils.runtime_config import apply_runtime_config, runtime_diagnostics
+
+
+def plan_case(case_dir, output_dir, params):
+    """规划一个病例, 在进程池的子进程中执行, 结果写入 output_dir/plan.json
+
+    Returns:
+        record: 病例名、是否成功、报错信息、总耗时 -> 'dict'
+    """
+
+    from utils.planning import PlanningInputs, PlanningError, plan_paths
+
+    start = time.perf_counter()
+    record = dict(case=os.path.basename(os.path.normpath(case_dir)), params=asdict(params))
+    try:
+        inputs = PlanningInputs.from_case_dir(case_dir, output_dir, os.path.join(output_dir, 'cache', 'skin'),
+                                              os.path.join(output_dir, 'cache', 'distance'))
+        load_time = time.perf_counter() - start
+        result = plan_paths(inputs, params)
+        result.timings = dict(load=load_time, **result.timings)
+        record.update(success=True, result=result.to_dict())
+    except PlanningError as e:
+        record.update(success=False, error=str(e))
+    record['seconds'] = time.perf_counter() - start
+
+    with open(os.path.join(output_dir, 'plan.json'), 'w', encoding='utf-8') as f:
+        json.dump(record, f, ensure_ascii=False, indent=2)
+    return record
+
+
+def main(argv=None):
+    from utils.planning import PlanningParams
+
+    parser = argparse.ArgumentParser(description="批量路径规划")
+    parser.add_argument('cases_dir', help="病例文件夹所在目录")
+    parser.add_argument('output_dir', help="输出目录")
+    parser.add_argument('--workers', type=int, default=None, help="进程数, 默认使用运行配置 process_workers")
+    for param in fields(PlanningParams):
+        name = '--' + param.name.replace('_', '-')
+        if param.type is bool or param.type == 'bool':
+            parser.add_argument(name, action=argparse.BooleanOptionalAction, default=param.default)
+        else:
+            parser.add_argument(name, type=type(param.default), default=param.default)
+    args = parser.parse_args(argv)
+
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+    from utils.runtime_config import pool_workers, pool_initargs, init_pool_worker
+
+    params = PlanningParams(**{param.name: getattr(args, param.name) for param in fields(PlanningParams)})
+    cases = sorted(name for name in os.listdir(args.cases_dir) if os.path.isdir(os.path.join(args.cases_dir, name)))
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    # spawn 启动子进程, 每个子进程平分 ITK 线程
+    workers = pool_workers(args.workers if args.workers else None)
+    ctx = multiprocessing.get_context('spawn')
+    start = time.perf_counter()
+    records = []
+    with ProcessPoolExecutor(max_workers=workers, mp_context=ctx, initializer=init_pool_worker,
+                             initargs=pool_initargs(workers)) as executor:
+        futures = {}
+        for name in cases:
+            case_output_dir = os.path.join(args.output_dir, name)
+            os.makedirs(case_output_dir, exist_ok=True)
+            futures[executor.submit(plan_case, os.path.join(args.cases_dir, name), case_output_dir, params)] = name
+        for future in as_completed(futures):
+            try:
+                record = future.result()
+            except Exception as e:  # 子进程异常退出等, 不影响其他病例
+                record = dict(case=futures[future], success=False, error=repr(e))
+            print("{}: {}".format(record['case'], "完成" if record['success'] else record['error']))
+            records.append(record)
+
+    records.sort(key=lambda record: record['case'])
+    summary = dict(workers=workers, seconds=time.perf_counter() - start,
+                   succeeded=sum(record['success'] for record in records), cases=records)
+    with open(os.path.join(args.output_dir, 'summary.json'), 'w', encoding='utf-8') as f:
+        json.dump(summary, f, ensure_ascii=False, indent=2)
+    print("{}/{} 个病例规划完成, 用时 {:.1f}s".format(summary['succeeded'], len(records), summary['seconds']))
+    return 0 if summary['succeeded'] == len(records) else 1
+
+
+if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    apply_runtime_config()  # 在导入 numpy 等库之前设置线程数
+    print(runtime_diagnostics())
+    sys.exit(main())
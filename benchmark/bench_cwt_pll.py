@@ -0,0 +1,97 @@
+"""胸壁厚度(cwt)和肺内长度(pll)基准测试: 原 vtkCellLocator 逐条求交 vs 肺掩膜上一次性采样
+
+在合成胸部体模上, 以肿瘤中心为靶向点, 对进针深度内的所有皮肤点计算 cwt 和 pll. 原实现与全分辨率(未降采样)
+的肺表面逐条求交, 计时包括建立 vtkCellLocator; 新实现从肺掩膜读取(mask_union)开始计时. 报告两种方法都
+进入肺的路径上 cwt 的差值, 一般在一个体素以内; 只擦过肺尖等薄层的路径, 掩膜采样和表面求交可能一个经过、
+一个未经过, 差值较大, 单独计数.
+
+运行: python -m benchmark.bench_cwt_pll
+"""
+import os
+import time
+import tempfile
+import numpy as np
+import vtk
+
+from benchmark.phantom import make_phantom, write_case
+from utils.voxel_rays import segments_first_hit
+
+
+def legacy_cwt_pll(lung_polydata, pt_point, ps_array):
+    """原 _get_needle_entry_point 目标性条件三、四的实现(不含归一化), 仅用于对比
+
+    Returns:
+        cwt, pll, hit: 没有交点的路径 hit 为 False
+    """
+
+    locator = vtk.vtkCellLocator()  # Create a locator
+    locator.SetDataSet(lung_polydata)
+    locator.BuildLocator()
+    tol = 1.e-6
+    cwt_list = []  # cwt -> 胸壁厚度
+    pll_list = []  # pll -> 肺内长度
+    hit_list = []
+
+    for i in range(ps_array.shape[0]):
+        coordinate = ps_array[i]
+        t = vtk.mutable(0)
+        pos = np.array([0., 0., 0.])
+        pcoords = np.array([0., 0., 0.])
+        sub_id = vtk.mutable(0)
+        cell_id = vtk.mutable(0)
+        cell = vtk.vtkGenericCell()
+        hit_list.append(bool(locator.IntersectWithLine(coordinate, pt_point, tol, t, pos, pcoords, sub_id, cell_id,
+                                                       cell)))
+        cwt_list.append(np.linalg.norm(coordinate-pos))
+        pll_list.append(np.linalg.norm(pos-pt_point))
+    return np.array(cwt_list), np.array(pll_list), np.array(hit_list)
+
+
+def main(slices=160, size=256, seed=0):
+    from utils.planning import PlanningInputs, PlanningParams, mask_surface, mask_union
+    from utils.skin_cache import skin_point_set
+
+    work_dir = tempfile.mkdtemp()
+    case_dir = os.path.join(work_dir, 'case')
+    phantom = make_phantom(slices, size, seed=seed)
+    write_case(phantom, case_dir)
+    origin = np.array(phantom.ct.GetOrigin())
+
+    inputs = PlanningInputs.from_case_dir(case_dir, os.path.join(work_dir, 'result'))
+    params = PlanningParams()
+    error_tag, ps_array = skin_point_set(inputs.ct_path, inputs.lung_trachea_mask_path,
+                                         os.path.join(work_dir, 'result', 'skin_mask.nii'), inputs.extent,
+                                         inputs.spacing, params.ps_rate, params.face_up)
+    spacing = np.array(inputs.spacing)
+    pt_point = np.array(phantom.tumors[0][0]) - origin
+    depth = np.linalg.norm(ps_array - pt_point, axis=1)
+    candidates = ps_array[depth <= params.max_needle_depth]
+    depth = depth[depth <= params.max_needle_depth]
+
+    lung_polydata = mask_surface(inputs.lung_mask_path)  # 界面中重建肺表面时已经完成, 不计时
+    start = time.perf_counter()
+    legacy_cwt, legacy_pll, legacy_hit = legacy_cwt_pll(lung_polydata, pt_point, candidates)
+    legacy_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    lung_mask = mask_union([inputs.lung_mask_path])
+    load_time = time.perf_counter() - start
+    start = time.perf_counter()
+    lung_entry = segments_first_hit(lung_mask, spacing, candidates, pt_point)
+    cwt = lung_entry * depth
+    pll = (1 - lung_entry) * depth
+    new_time = time.perf_counter() - start
+
+    both = legacy_hit & ~np.isnan(lung_entry)
+    difference = np.abs(legacy_cwt[both] - cwt[both])
+    print("%d candidate paths, lung surface %d cells" % (len(candidates), lung_polydata.GetNumberOfCells()))
+    print("legacy cell locator: %.3fs, mask sampling: %.4fs (+ %.3fs reading the mask once per case), speedup %.0fx"
+          % (legacy_time, new_time, load_time, legacy_time / max(new_time, 1e-9)))
+    print("paths entering the lung: legacy %d, mask %d, both %d" % (legacy_hit.sum(), (~np.isnan(lung_entry)).sum(),
+                                                                     both.sum()))
+    print("cwt difference: median %.2f mm, 99th percentile %.2f mm, %d paths more than one voxel (%.2f mm)"
+          % (np.median(difference), np.percentile(difference, 99), (difference > spacing.max()).sum(), spacing.max()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""约束2(重要组织避障)基准测试: 原 vtkOBBTree 逐条求交 vs utils.voxel_rays 在掩膜上一次性采样
+
+在合成胸部体模上, 以肿瘤中心和肺内随机点为靶向点, 比较各方法保留的皮肤点. 参考结果为 vtkCellLocator
+与同一个(降采样 90% 后的)表面精确求交; vtkOBBTree.IntersectWithLine 在这类表面上会漏掉大量相交的线段,
+与参考结果的差异单独报告. 掩膜采样与参考结果不一致的路径报告它与掩膜边界的距离: 参考结果相交而掩膜采样
+未经过掩膜时为线段到掩膜的最近距离, 反之为线段进入掩膜的最大深度, 都应在一个体素左右.
+
+运行: python -m benchmark.bench_obstacle_free
+"""
+import os
+import time
+import tempfile
+import numpy as np
+import vtk
+from scipy import ndimage
+
+from benchmark.phantom import make_phantom, write_case
+from utils.voxel_rays import segment_samples, sample_nearest, segments_hit
+
+
+def legacy_obstacle_free(po_polydata, pt_point, ps_array):
+    """原 _get_needle_entry_point 约束2 的实现, 返回保留的皮肤点的 mask, 仅用于对比"""
+
+    tree = vtk.vtkOBBTree()
+    tree.SetDataSet(po_polydata)
+    tree.BuildLocator()
+    intersect_points = vtk.vtkPoints()
+
+    keep = np.zeros(ps_array.shape[0], dtype=bool)
+    for i in range(ps_array.shape[0]):
+        coordinate = ps_array[i]
+        tree.IntersectWithLine(coordinate, pt_point, intersect_points, None)
+        if intersect_points.GetNumberOfPoints() == 0:
+            keep[i] = True
+    return keep
+
+
+def exact_obstacle_free(po_polydata, pt_point, ps_array):
+    """vtkCellLocator 逐条精确求交, 作为参考结果"""
+
+    locator = vtk.vtkCellLocator()
+    locator.SetDataSet(po_polydata)
+    locator.BuildLocator()
+    intersect_points = vtk.vtkPoints()
+    cell_ids = vtk.vtkIdList()
+
+    keep = np.zeros(ps_array.shape[0], dtype=bool)
+    for i in range(ps_array.shape[0]):
+        locator.IntersectWithLine(ps_array[i].astype(float), pt_point, 1e-6, intersect_points, cell_ids)
+        keep[i] = intersect_points.GetNumberOfPoints() == 0
+    return keep
+
+
+def _segment_extreme(field, spacing, starts, end, reduce):
+    values = []
+    for _, _, points in segment_samples(starts, end, spacing):
+        values.append(reduce(sample_nearest(field, points), axis=1))
+    return np.concatenate(values) if values else np.zeros(0)
+
+
+def main(slices=160, size=256, targets=8, seed=0):
+    from utils.planning import PlanningInputs, PlanningParams, mask_union, mask_surface
+    from utils.extract_point import extract_po
+    from utils.skin_cache import skin_point_set
+
+    work_dir = tempfile.mkdtemp()
+    case_dir = os.path.join(work_dir, 'case')
+    phantom = make_phantom(slices, size, seed=seed)
+    write_case(phantom, case_dir)
+    origin = np.array(phantom.ct.GetOrigin())
+
+    inputs = PlanningInputs.from_case_dir(case_dir, os.path.join(work_dir, 'result'))
+    params = PlanningParams()
+    error_tag, ps_array = skin_point_set(inputs.ct_path, inputs.lung_trachea_mask_path,
+                                         os.path.join(work_dir, 'result', 'skin_mask.nii'), inputs.extent,
+                                         inputs.spacing, params.ps_rate, params.face_up)
+    po_polydata, _ = extract_po([mask_surface(path) for path in inputs.obstacle_mask_paths])
+    obstacle_mask = mask_union(inputs.obstacle_mask_paths)
+    spacing = np.array(inputs.spacing)
+
+    # 掩膜内外到边界的距离(mm), 用于判断不一致的路径是否只差一个体素左右
+    outside_distance = ndimage.distance_transform_edt(~obstacle_mask, sampling=spacing[::-1]).astype(np.float32)
+    inside_distance = ndimage.distance_transform_edt(obstacle_mask, sampling=spacing[::-1]).astype(np.float32)
+
+    # 靶向点: 肿瘤中心和肺内随机点, 体模坐标转为 vtk_nii_reader 的坐标(原点为 0)
+    rng = np.random.default_rng(seed)
+    lung = np.argwhere(mask_union([inputs.lung_trachea_mask_path]))
+    pt_points = [np.array(center) - origin for center, _ in phantom.tumors]
+    pt_points += [lung[i][::-1] * spacing for i in rng.choice(len(lung), targets - len(pt_points), replace=False)]
+
+    legacy_time = new_time = 0
+    legacy_disagree = disagree = 0
+    worst = 0.
+    total = 0
+    for pt_point in pt_points:
+        depth_mask = np.linalg.norm(ps_array - pt_point, axis=1) <= params.max_needle_depth
+        candidates = ps_array[depth_mask]
+        total += candidates.shape[0]
+
+        start = time.perf_counter()
+        legacy_keep = legacy_obstacle_free(po_polydata, pt_point, candidates)
+        legacy_time += time.perf_counter() - start
+
+        start = time.perf_counter()
+        keep = ~segments_hit(obstacle_mask, spacing, candidates, pt_point)
+        new_time += time.perf_counter() - start
+
+        exact_keep = exact_obstacle_free(po_polydata, pt_point, candidates)
+        legacy_disagree += int((legacy_keep != exact_keep).sum())
+        missed = exact_keep & ~keep  # 经过掩膜, 但未与表面相交
+        grazed = ~exact_keep & keep  # 与表面相交, 但未经过掩膜
+        depth = _segment_extreme(inside_distance, spacing, candidates[missed], pt_point, np.max)
+        gap = _segment_extreme(outside_distance, spacing, candidates[grazed], pt_point, np.min)
+        worst = max([worst, *depth, *gap])
+        disagree += int(missed.sum() + grazed.sum())
+        print("target %s: %d candidates, kept exact %d, legacy OBB %d, voxel %d"
+              % (np.round(pt_point, 1), candidates.shape[0], exact_keep.sum(), legacy_keep.sum(), keep.sum()))
+
+    print("legacy OBB: %.3fs, voxel rays: %.4fs, speedup %.1fx"
+          % (legacy_time, new_time, legacy_time / max(new_time, 1e-9)))
+    print("legacy OBB differs from exact: %d / %d paths" % (legacy_disagree, total))
+    print("voxel rays differ from exact: %d / %d paths, max distance to mask boundary %.2f mm (voxel %.2f mm)"
+          % (disagree, total, worst, spacing.max()))
+
+
+if __name__ == "__main__":
+    main()
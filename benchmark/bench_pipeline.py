@@ -0,0 +1,383 @@
+"""各阶段基准测试: 在合成胸部CT体模上依次运行分割、表面重建、点集提取和路径规划的各个阶段
+
+每个阶段记录耗时和内存(运行前 RSS、运行期间采样得到的峰值 RSS 及其增量), 结果写入 JSON 报告. 后续阶段使用
+体模的真值掩膜作为输入, 耗时不受前一阶段分割质量的影响; 依赖的阶段失败时记为跳过. 整个流程在 spawn 出的
+子进程中运行, --repeat 大于 1 时重复运行, 耗时取中位数, 内存增量取最大值.
+
+优化前后各运行一次, 用 --compare 对比两份报告:
+
+    python -m benchmark.bench_pipeline --output before.json
+    python -m benchmark.bench_pipeline --output after.json --compare before.json
+
+运行: python -m benchmark.bench_pipeline
+"""
+import os
+import sys
+import json
+import time
+import platform
+import tempfile
+import argparse
+import threading
+import statistics
+import multiprocessing
+import numpy as np
+import psutil
+import SimpleITK as sitk
+import vtk
+
+from benchmark.bench_lung_cu_seg import _rss
+from benchmark.phantom import make_phantom, write_case
+
+
+# 采样 RSS 的间隔(s)
+SAMPLE_INTERVAL = 0.005
+
+
+class MemorySampler:
+    """在后台线程中采样当前进程的 RSS, 记录 start 到 stop 之间的峰值
+
+    ru_maxrss 是整个进程的峰值, 不能区分阶段, 所以改为采样; 很短的分配峰值可能采样不到.
+    """
+
+    def __init__(self, interval=SAMPLE_INTERVAL):
+        self.interval = interval
+        self._process = psutil.Process()
+        self._stop = threading.Event()
+        self._thread = None
+        self.peak = 0
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, self._process.memory_info().rss)
+
+    def start(self):
+        self.peak = self._process.memory_info().rss
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, self._process.memory_info().rss)
+        return self.peak
+
+
+# 各阶段, 依次运行: (名称, 依赖的阶段)
+# 函数为 _stage_<名称>, 读写 ctx 中的输入和结果
+STAGES = (
+    ('load_ct', ()),
+    ('lung_cu_seg', ('load_ct',)),
+    ('airways_seg', ('load_ct',)),
+    ('VesselSegThread', ('load_ct',)),
+    ('SkeletonSegThread.run', ('load_ct',)),
+    ('skin_seg', ('load_ct',)),
+    ('marching_cubes', ('skin_seg',)),
+    ('extract_ps', ('marching_cubes',)),
+    ('mask_surface', ()),
+    ('extract_po', ('mask_surface',)),
+    ('obstacle_field', ()),
+    ('lung_mask', ()),
+    ('resample_tumor', ()),
+    ('extract_pt', ('resample_tumor',)),
+    ('get_pt_center', ('extract_pt',)),
+    ('get_needle_entry_point', ('extract_ps', 'obstacle_field', 'lung_mask', 'get_pt_center')),
+    ('eval_tumor_efficacy', ()),
+)
+
+
+def _stage_load_ct(ctx):
+    # CT 由 volume_cache 在会话内保留, 后续分割阶段不再计入解码时间
+    from src.seg import read_image
+    read_image(ctx['paths']['ct'])
+
+
+def _stage_lung_cu_seg(ctx):
+    from src.seg import lung_cu_seg
+    lung_cu_seg(ctx['paths']['ct'])
+
+
+def _stage_airways_seg(ctx):
+    from src.seg import airways_seg
+    airways_seg(ctx['paths']['ct'], os.path.join(ctx['work_dir'], 'airways_mask.nii'), seed=ctx['trachea_seed'])
+
+
+def _stage_VesselSegThread(ctx):
+    from src.seg import VesselSegThread
+    VesselSegThread(ctx['paths']['ct'], ctx['paths']['lung'], os.path.join(ctx['work_dir'], 'vessel_mask.nii')).run()
+
+
+def _stage_SkeletonSegThread_run(ctx):
+    from src.seg import SkeletonSegThread
+    SkeletonSegThread(ctx['paths']['ct'], os.path.join(ctx['work_dir'], 'skeleton_mask.nii')).run()
+
+
+def _stage_skin_seg(ctx):
+    from src.seg import skin_seg
+    ctx['skin_mask_path'] = os.path.join(ctx['work_dir'], 'skin_mask.nii')
+    skin_seg(ctx['paths']['ct'], ctx['paths']['lung_trachea'], ctx['skin_mask_path'])
+
+
+def _stage_marching_cubes(ctx):
+    from utils.reader import vtk_nii_reader
+    from utils.mc import marching_cubes
+    error_tag, skin_image = vtk_nii_reader(ctx['skin_mask_path'])
+    if error_tag:
+        raise RuntimeError(skin_image)
+    ctx['skin_polydata'] = marching_cubes(skin_image)
+
+
+def _stage_extract_ps(ctx):
+    from utils.extract_point import extract_ps
+    from utils.reader import vtk_nii_reader
+    error_tag, ct_image = vtk_nii_reader(ctx['paths']['ct'])
+    if error_tag:
+        raise RuntimeError(ct_image)
+    params = ctx['params']
+    ctx['ps_array'] = extract_ps(ctx['skin_polydata'], ct_image.GetExtent(), ct_image.GetSpacing(), params.ps_rate,
+                                 params.face_up)
+
+
+def _stage_mask_surface(ctx):
+    # 与界面中一样, 由真值掩膜重建肺和重要组织的表面
+    from utils.planning import mask_surface
+    ctx['surfaces'] = {name: mask_surface(ctx['paths'][name]) for name in ('lung', 'trachea', 'vessel', 'skeleton')}
+
+
+def _stage_extract_po(ctx):
+    from utils.extract_point import extract_po
+    surfaces = ctx['surfaces']
+    ctx['po_polydata'], ctx['po_array'] = extract_po([surfaces[name] for name in ('trachea', 'vessel', 'skeleton')])
+
+
+def _stage_obstacle_field(ctx):
+    # 重要组织掩膜的并集和距离场, 不使用磁盘缓存
+    from utils.planning import ObstacleField
+    paths = ctx['paths']
+    ctx['obstacles'] = ObstacleField([paths[name] for name in ('trachea', 'vessel', 'skeleton')], ctx['spacing'])
+    ctx['fallback_obstacles'] = ObstacleField([paths[name] for name in ('trachea', 'skeleton')], ctx['spacing'])
+    for obstacles in (ctx['obstacles'], ctx['fallback_obstacles']):
+        obstacles.distance
+
+
+def _stage_lung_mask(ctx):
+    from utils.planning import mask_union
+    ctx['lung_mask'] = mask_union([ctx['paths']['lung']])
+
+
+def _stage_resample_tumor(ctx):
+    # 与 plan_paths 相同: 重采样到 1mm 后膨胀安全边界
+    from utils.resample import resample_volume
+    from utils.dilate import dilate_image
+    from utils.vtk_bridge import sitk_to_vtk_image
+    tumor = sitk.ReadImage(ctx['paths']['tumor'])
+    ctx['tumor_image'] = sitk_to_vtk_image(dilate_image(resample_volume([1, 1, 1], tumor), kernelsize=5))
+
+
+def _stage_extract_pt(ctx):
+    from utils.extract_point import extract_pt
+    ctx['pt_array'] = extract_pt(ctx['tumor_image'], ctx['params'].pt_sample_spacing)
+
+
+def _stage_get_pt_center(ctx):
+    from utils.kmeans import get_pt_center
+    ctx['pt_centers'], _ = get_pt_center(ctx['pt_array'], 1)
+
+
+def _stage_get_needle_entry_point(ctx):
+    from utils.planning import get_needle_entry_point
+    ctx['entry_point'] = get_needle_entry_point(ctx['obstacles'], ctx['fallback_obstacles'], ctx['pt_centers'][0],
+                                                ctx['ps_array'], ctx['params'].max_needle_depth,
+                                                ctx['lung_mask'], ctx['spacing'])
+
+
+def _stage_eval_tumor_efficacy(ctx):
+    # 术后肿瘤用膨胀一个体素的术前肿瘤代替
+    from utils.eval_tumor_efficacy import eval_tumor_efficacy
+    post_path = os.path.join(ctx['work_dir'], 'tumor_post_mask.nii')
+    sitk.WriteImage(sitk.BinaryDilate(sitk.ReadImage(ctx['paths']['tumor']), [1, 1, 1]), post_path)
+    ctx['efficacy'] = eval_tumor_efficacy(ctx['paths']['tumor'], post_path)
+
+
+def _stage_function(name):
+    return globals()['_stage_' + name.replace('.', '_')]
+
+
+def run_stages(case_dir, work_dir, stages=None):
+    """在当前进程中依次运行各阶段
+
+    Args:
+        case_dir: 体模病例文件夹, 见 benchmark.phantom.write_case -> 'str'
+        work_dir: 各阶段输出的保存目录 -> 'str'
+        stages: 要运行的阶段名称, 为 None 时运行全部阶段; 依赖的阶段会一起运行 -> 'list'
+
+    Returns:
+        records: 阶段名称 => 耗时(seconds)、运行前 RSS(rss_before)、峰值 RSS(peak_rss)、增量(peak_delta),
+                 字节; 失败时为报错信息(error), 依赖的阶段失败时为 skipped -> 'dict'
+    """
+
+    from utils.planning import CASE_FILES, PlanningParams, find_case_file
+
+    with open(os.path.join(case_dir, 'phantom.json'), encoding='utf-8') as f:
+        description = json.load(f)
+    paths = {name: find_case_file(case_dir, names) for name, names in CASE_FILES.items()}
+    ctx = dict(paths=paths, work_dir=work_dir, trachea_seed=tuple(description['trachea_seed']),
+               spacing=tuple(description['spacing']), params=PlanningParams())
+
+    selected = _with_dependencies(stages)
+    sampler = MemorySampler()
+    records = {}
+    for name, dependencies in STAGES:
+        if name not in selected:
+            continue
+        failed = [dep for dep in dependencies if 'seconds' not in records.get(dep, {})]
+        if failed:
+            records[name] = dict(skipped="依赖的阶段未完成: {}".format(', '.join(failed)))
+            continue
+
+        before = _rss()
+        sampler.start()
+        start = time.perf_counter()
+        try:
+            _stage_function(name)(ctx)
+        except Exception as e:  # 记录报错, 继续运行不依赖它的阶段
+            sampler.stop()
+            records[name] = dict(error=repr(e))
+            continue
+        elapsed = time.perf_counter() - start
+        peak = sampler.stop()
+        records[name] = dict(seconds=elapsed, rss_before=before, peak_rss=peak, peak_delta=peak - before)
+    return records
+
+
+def _with_dependencies(stages):
+    if stages is None:
+        return {name for name, _ in STAGES}
+    dependencies = dict(STAGES)
+    unknown = set(stages) - set(dependencies)
+    if unknown:
+        raise ValueError("unknown stages: {}".format(', '.join(sorted(unknown))))
+    selected = set()
+    pending = list(stages)
+    while pending:
+        name = pending.pop()
+        if name not in selected:
+            selected.add(name)
+            pending += dependencies[name]
+    return selected
+
+
+def _run(case_dir, work_dir, stages, queue):
+    from utils.runtime_config import apply_runtime_config
+    apply_runtime_config()
+    queue.put(run_stages(case_dir, work_dir, stages))
+
+
+def measure_in_process(case_dir, work_dir, stages=None):
+    """在 spawn 出的子进程中运行 run_stages, 不受父进程中体模数组的影响"""
+
+    ctx = multiprocessing.get_context("spawn")
+    queue = ctx.Queue()
+    process = ctx.Process(target=_run, args=(case_dir, work_dir, stages, queue))
+    process.start()
+    records = queue.get()
+    process.join()
+    return records
+
+
+def summarize(runs):
+    """合并多次运行的结果: 耗时取中位数, 内存取最大值, 任何一次失败都记为失败"""
+
+    summary = {}
+    for name, _ in STAGES:
+        records = [records[name] for records in runs if name in records]
+        if not records:
+            continue
+        failed = [record for record in records if 'seconds' not in record]
+        if failed:
+            summary[name] = failed[0]
+            continue
+        seconds = [record['seconds'] for record in records]
+        summary[name] = dict(seconds=statistics.median(seconds), runs=seconds,
+                             rss_before=max(record['rss_before'] for record in records),
+                             peak_rss=max(record['peak_rss'] for record in records),
+                             peak_delta=max(record['peak_delta'] for record in records))
+    return summary
+
+
+def environment():
+    """报告中的运行环境, 对比两份报告时确认是同一台机器和相同的配置"""
+
+    from utils.runtime_config import cpu_count, runtime_diagnostics
+    return dict(python=sys.version.split()[0], platform=platform.platform(), cpu_count=cpu_count(),
+                memory=psutil.virtual_memory().total, numpy=np.__version__, simpleitk=sitk.Version_VersionString(),
+                vtk=vtk.vtkVersion.GetVTKVersion(), runtime=runtime_diagnostics())
+
+
+def compare(report, baseline):
+    """打印两份报告中各阶段的耗时和内存增量对比"""
+
+    print("%-24s %10s %10s %8s %12s %12s" % ("stage", "before(s)", "after(s)", "speedup", "before(MB)", "after(MB)"))
+    for name, _ in STAGES:
+        before = baseline['stages'].get(name, {})
+        after = report['stages'].get(name, {})
+        if 'seconds' not in before or 'seconds' not in after:
+            continue
+        print("%-24s %10.3f %10.3f %7.2fx %12.1f %12.1f"
+              % (name, before['seconds'], after['seconds'], before['seconds'] / max(after['seconds'], 1e-9),
+                 before['peak_delta'] / 2 ** 20, after['peak_delta'] / 2 ** 20))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="各阶段基准测试")
+    parser.add_argument('--slices', type=int, default=160)
+    parser.add_argument('--size', type=int, default=256)
+    parser.add_argument('--tumors', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=1, help="重复次数, 每次在新的子进程中运行")
+    parser.add_argument('--stages', default=None, help="逗号分隔的阶段名称, 默认运行全部阶段")
+    parser.add_argument('--output', default='bench_pipeline.json', help="JSON 报告路径")
+    parser.add_argument('--compare', default=None, help="对比的 JSON 报告, 例如优化前的结果")
+    args = parser.parse_args(argv)
+
+    stages = args.stages.split(',') if args.stages else None
+    _with_dependencies(stages)  # 先检查阶段名称
+
+    work_dir = tempfile.mkdtemp()
+    case_dir = os.path.join(work_dir, 'case')
+    phantom = make_phantom(args.slices, args.size, n_tumors=args.tumors, seed=args.seed)
+    write_case(phantom, case_dir)
+    print("phantom:", phantom.ct.GetSize(), "spacing %.2f x %.2f x %.2f mm" % phantom.ct.GetSpacing())
+    del phantom
+
+    runs = []
+    for i in range(args.repeat):
+        run_dir = os.path.join(work_dir, 'run_%d' % i)
+        os.makedirs(run_dir)
+        runs.append(measure_in_process(case_dir, run_dir, stages))
+
+    with open(os.path.join(case_dir, 'phantom.json'), encoding='utf-8') as f:
+        description = json.load(f)
+    report = dict(created=time.strftime('%Y-%m-%d %H:%M:%S'), phantom=dict(description, seed=args.seed),
+                  repeat=args.repeat, environment=environment(), stages=summarize(runs))
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+    for name, record in report['stages'].items():
+        if 'seconds' in record:
+            print("%-24s %8.3fs  peak RSS %8.1f MB  +%.1f MB"
+                  % (name, record['seconds'], record['peak_rss'] / 2 ** 20, record['peak_delta'] / 2 ** 20))
+        else:
+            print("%-24s %s" % (name, record.get('error', record.get('skipped'))))
+    print("report:", args.output)
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            compare(report, json.load(f))
+
+
+if __name__ == "__main__":
+    from utils.runtime_config import apply_runtime_config
+    apply_runtime_config()
+    main()
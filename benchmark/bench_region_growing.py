@@ -0,0 +1,131 @@
+"""区域生长基准测试: 逐点队列实现 vs utils.region_grow 按层批量实现
+
+分别在灰度均匀的管道和灰度沿管道渐变(区域均值随生长变化)的管道上测试. 使用原实现的偏移表
+(有重复、缺少 3 个邻域点)时, 两种实现的生长结果应完全相同; 同时报告默认的完整26邻域偏移表
+与原实现相差的体素数. 图像大小为 128^3 和 512x512xN(CT 的层大小), 安装了 numba 时使用编译的逐点队列,
+编译耗时单独报告.
+
+运行: python -m benchmark.bench_region_growing
+"""
+import time
+import numpy as np
+
+from utils.region_grow import numba, region_growing
+
+
+# 原实现的偏移表, (-1, 0, -1) 重复出现, 缺少 (-1, 1, 1), (0, 1, 1), (1, -1, 1)
+LEGACY_NEXT26 = [[-1, -1, -1], [-1, 0, -1], [-1, 1, -1],
+                 [-1, 1, 0], [-1, -1, 0], [-1, -1, 1],
+                 [-1, 0, 1], [-1, 0, 0], [-1, 0, -1],
+                 [0, -1, -1], [0, 0, -1], [0, 1, -1],
+                 [0, 1, 0], [-1, 0, -1],
+                 [0, -1, 0], [0, -1, 1], [-1, 0, -1],
+                 [0, 0, 1], [1, 1, 1], [1, 1, -1],
+                 [1, 1, 0], [1, 0, 1], [1, 0, -1],
+                 [1, -1, 0], [1, 0, 0], [1, -1, -1]]
+
+
+def legacy_region_growing(grayImg, seed, threshold):
+    """原 src.seg.regionGrowing 的逐点队列实现, 仅用于对比"""
+
+    [maxX, maxY, maxZ] = grayImg.shape[0:3]
+
+    pointQueue = []
+    pointQueue.append((seed[0], seed[1], seed[2]))
+    outImg = np.zeros_like(grayImg)
+    outImg[seed[0], seed[1], seed[2]] = 1
+
+    pointsNum = 1
+    pointsMean = float(grayImg[seed[0], seed[1], seed[2]])
+
+    Next26 = LEGACY_NEXT26
+
+    while(len(pointQueue) > 0):
+        growSeed = pointQueue[0]
+        del pointQueue[0]
+
+        for differ in Next26:
+            growPointx = growSeed[0] + differ[0]
+            growPointy = growSeed[1] + differ[1]
+            growPointz = growSeed[2] + differ[2]
+
+            if((growPointx < 0) or (growPointx > maxX - 1) or
+               (growPointy < 0) or (growPointy > maxY - 1) or (growPointz < 0) or (growPointz > maxZ - 1)):
+                continue
+
+            if(outImg[growPointx, growPointy, growPointz] == 1):
+                continue
+
+            data = grayImg[growPointx, growPointy, growPointz]
+            if(abs(data - pointsMean) < threshold):
+                pointsNum += 1
+                pointsMean = (pointsMean * (pointsNum - 1) + data) / pointsNum
+                outImg[growPointx, growPointy, growPointz] = 1
+                pointQueue.append([growPointx, growPointy, growPointz])
+
+    return outImg, pointsNum
+
+
+def make_airway_volume(size=128, seed=0, gradient=0, slices=None):
+    """生成带分叉管道(气管)的合成CT, 返回 xyz 顺序数组和种子点
+
+    gradient 为管道内灰度沿 z 轴每层的变化量, 不为 0 时区域均值随生长变化; slices 为层数, 默认与 size 相同
+    """
+
+    slices = size if slices is None else slices
+    rng = np.random.default_rng(seed)
+    volume = rng.normal(40, 15, (slices, size, size)).astype(np.int16)  # 软组织
+    z, y, x = np.ogrid[0:slices, 0:size, 0:size]
+    center = size // 2
+    middle = slices // 2
+    radius = size // 16
+
+    # 主气管(沿z轴)和左右两条支气管
+    trachea = ((x - center) ** 2 + (y - center) ** 2 < radius ** 2) & (z >= middle)
+    t = np.clip((middle - z) / middle, 0, 1)
+    left = ((x - center + t * size / 3) ** 2 + (y - center) ** 2 < (radius * 0.7) ** 2) & (z < middle)
+    right = ((x - center - t * size / 3) ** 2 + (y - center) ** 2 < (radius * 0.7) ** 2) & (z < middle)
+    airway = trachea | left | right
+    depth = np.broadcast_to(slices - z, airway.shape)[airway]
+    volume[airway] = (rng.normal(-950, 20, depth.size) + gradient * depth).astype(np.int16)
+
+    volume_T = volume.transpose((2, 1, 0))  # zyx => xyz, 与 airways_seg 一致
+    return volume_T, (center, center, slices - 4)
+
+
+def compare(volume_T, seed, threshold):
+    start = time.perf_counter()
+    new_mask, new_num = region_growing(volume_T, seed, threshold)
+    new_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    old_mask, old_num = legacy_region_growing(volume_T, seed, threshold)
+    old_time = time.perf_counter() - start
+
+    same_mask, same_num = region_growing(volume_T, seed, threshold, offsets=LEGACY_NEXT26)
+
+    print("legacy: %.3fs, pointsNum=%d" % (old_time, old_num))
+    print("region_growing: %.3fs, pointsNum=%d" % (new_time, new_num))
+    print("speedup: %.1fx" % (old_time / new_time))
+    print("same mask and pointsNum with the legacy offset table:",
+          bool(np.array_equal(old_mask != 0, same_mask != 0)) and same_num == old_num)
+    print("voxels differing with the full 26-neighbour table:", int(np.count_nonzero((old_mask != 0) != (new_mask != 0))))
+
+
+def main(size=128, threshold=150, slices=128):
+    # 安装了 numba 时第一次调用需要编译(或读取编译缓存), 先在小图像上调用一次, 不计入耗时
+    start = time.perf_counter()
+    region_growing(*make_airway_volume(16), threshold)
+    print("warm-up (numba %s): %.2fs" % ("enabled" if numba is not None else "not installed",
+                                         time.perf_counter() - start))
+
+    # 小图像和 512x512 的 CT 层大小, 目标加速比 50x
+    for volume_size, volume_slices in ((size, size), (512, slices)):
+        for gradient in (0, 2):
+            volume_T, seed = make_airway_volume(volume_size, gradient=gradient, slices=volume_slices)
+            print("volume:", volume_T.shape, "seed:", seed, "gradient:", gradient)
+            compare(volume_T, seed, threshold)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+"""皮肤分割基准测试: 原 float32 + Sobel 实现 vs src.seg.skin_seg uint8 膨胀/腐蚀实现
+
+每个实现在单独的子进程中运行, 报告耗时、峰值内存(RSS), 以及两者皮肤掩膜的差异体素数.
+
+运行: python -m benchmark.bench_skin_seg
+"""
+import os
+import time
+import tempfile
+import multiprocessing
+import numpy as np
+import SimpleITK as sitk
+
+from benchmark.bench_lung_cu_seg import make_chest_ct, _rss, _peak_rss
+from utils.connected_component import keep_largest_components
+
+
+def window_transform(ct_array, windowWidth, windowCenter, normal=False):
+    """
+    return: trucated image according to window center and window width
+    and normalized to [0,1]
+    """
+    minWindow = float(windowCenter) - 0.5 * float(windowWidth)
+    newimg = (ct_array - minWindow) / float(windowWidth)
+    newimg[newimg < 0] = 0
+    newimg[newimg > 1] = 1
+    if not normal:
+        newimg = (newimg * 255).astype('float32')
+    return newimg
+
+
+def legacy_skin_seg(ct_nii_path, lung_mask_path, skin_mask_path):
+    """原 src.seg.skin_seg 的实现, 仅用于对比"""
+
+    image = sitk.ReadImage(ct_nii_path, sitk.sitkFloat32)
+
+    origin = image.GetOrigin()
+    spacing = image.GetSpacing()
+    direction = image.GetDirection()
+
+    # 肺窗/二值处理
+    array = sitk.GetArrayFromImage(image)
+    array[array > 0] = 255
+    array = window_transform(array, 400, -200, False)
+    array[array > 0] = 255
+    image1 = sitk.GetImageFromArray(array)
+
+    # 提取最大连通量
+    outmasksitk = keep_largest_components(image1)
+
+    # 开运算，去掉小白点
+    kernelsize = (5, 5, 5)
+    image1 = sitk.BinaryMorphologicalOpening(outmasksitk != 0, kernelsize)
+
+    # 对肺掩膜做一个闭运算,然后填充
+    lung_mask_sitk = sitk.ReadImage(lung_mask_path)
+    lung_mask_sitk_1 = sitk.BinaryDilate(lung_mask_sitk != 0, (5, 5, 5))
+    mask = sitk.GetArrayFromImage(lung_mask_sitk_1)
+
+    image4_array = sitk.GetArrayFromImage(image1)
+    image4_array[mask == 1] = 1
+
+    image1 = sitk.GetImageFromArray(image4_array)
+    image1 = sitk.BinaryDilate(image1 != 0, (5, 5, 5))
+
+    ## sobel 算子提取边界
+    image1 = sitk.Cast(image1, sitk.sitkFloat32)
+
+    sobel_op = sitk.SobelEdgeDetectionImageFilter()
+    image1 = sobel_op.Execute(image1)
+    image1 = sitk.Cast(image1, sitk.sitkInt16)
+
+    # 二值化皮肤mask
+    sobel_array = sitk.GetArrayFromImage(image1)
+    outmask = sobel_array.copy()
+    outmask[sobel_array != 0] = 1
+
+    image1 = sitk.GetImageFromArray(outmask)
+
+    image1.SetOrigin(origin)
+    image1.SetSpacing(spacing)
+    image1.SetDirection(direction)
+    sitk.WriteImage(image1, skin_mask_path)
+
+
+def _run(name, ct_path, lung_path, skin_path, queue):
+    if name == "legacy":
+        func = legacy_skin_seg
+    else:
+        from src.seg import skin_seg as func
+
+    before = _rss()
+    start = time.perf_counter()
+    func(ct_path, lung_path, skin_path)
+    elapsed = time.perf_counter() - start
+    queue.put((elapsed, before, _peak_rss()))
+
+
+def measure_in_process(name, ct_path, lung_path, skin_path):
+    """在子进程中运行, 返回 (耗时, 运行前RSS, 峰值RSS)"""
+
+    ctx = multiprocessing.get_context("spawn")
+    queue = ctx.Queue()
+    process = ctx.Process(target=_run, args=(name, ct_path, lung_path, skin_path, queue))
+    process.start()
+    result = queue.get()
+    process.join()
+    return result
+
+
+def main(slices=200, size=256):
+    from src.seg import lung_cu_seg
+
+    volume = make_chest_ct(slices, size)
+    voxels = volume.size
+    print("volume:", volume.shape)
+
+    work_dir = tempfile.mkdtemp()
+    ct_path = os.path.join(work_dir, "ct.nii.gz")
+    lung_path = os.path.join(work_dir, "lung.nii.gz")
+    image = sitk.GetImageFromArray(volume)
+    image.SetSpacing((0.8, 0.8, 1.0))
+    sitk.WriteImage(image, ct_path)
+    sitk.WriteImage(lung_cu_seg(ct_path), lung_path)
+
+    masks = {}
+    for name in ("legacy", "skin_seg"):
+        skin_path = os.path.join(work_dir, name + ".nii.gz")
+        elapsed, before, peak = measure_in_process(name, ct_path, lung_path, skin_path)
+        extra = peak - before
+        print("%s: %.2fs, peak RSS %.1f MB, +%.1f MB over baseline (%.1f bytes/voxel)"
+              % (name, elapsed, peak / 2 ** 20, extra / 2 ** 20, extra / voxels))
+        masks[name] = sitk.GetArrayFromImage(sitk.ReadImage(skin_path)) != 0
+
+    diff = int(np.count_nonzero(masks["legacy"] != masks["skin_seg"]))
+    print("skin voxels: legacy %d, skin_seg %d, different %d"
+          % (np.count_nonzero(masks["legacy"]), np.count_nonzero(masks["skin_seg"]), diff))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+"""中间结果存储基准测试: .nii.gz vs .nii vs .npy(+JSON 几何信息)
+
+对 CT 大小的 int16 图像和 uint8 掩膜, 报告各格式的写入、完整读取耗时和文件大小, 以及 .npy 用
+memmap 只读取一层的耗时.
+
+运行: python -m benchmark.bench_storage
+"""
+import os
+import time
+import tempfile
+import numpy as np
+import SimpleITK as sitk
+
+from benchmark.bench_lung_cu_seg import make_chest_ct
+from utils.storage import INTERMEDIATE_FORMATS, intermediate_path, write_image, read_image, read_array
+
+
+def main(slices=300, size=512):
+    volume = make_chest_ct(slices, size)
+    ct = sitk.GetImageFromArray(volume)
+    ct.SetSpacing((0.7, 0.7, 1.0))
+    mask = sitk.Cast(ct < -700, sitk.sitkUInt8)
+    print("volume:", volume.shape)
+
+    work_dir = tempfile.mkdtemp()
+    for name, image in (("ct int16", ct), ("mask uint8", mask)):
+        for fmt in INTERMEDIATE_FORMATS:
+            path = intermediate_path(work_dir, name.split()[0], fmt)
+
+            start = time.perf_counter()
+            write_image(image, path)
+            write_time = time.perf_counter() - start
+
+            start = time.perf_counter()
+            read_image(path)
+            read_time = time.perf_counter() - start
+
+            start = time.perf_counter()
+            array, _ = read_array(path)
+            np.asarray(array[slices // 2])
+            slice_time = time.perf_counter() - start
+
+            print("%s %-6s: write %.2fs, read %.2fs, one slice %.3fs, %.1f MB"
+                  % (name, fmt, write_time, read_time, slice_time, os.path.getsize(path) / 2 ** 20))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""阈值搜索基准测试: 逐阈值重新生长 vs utils.region_grow.threshold_sweep 一次遍历
+
+原实现(regionGrowing_v2 找阈值, 再用 regionGrowing 在该阈值下生长)与 threshold_sweep 都使用原实现的
+偏移表, 比较选出的阈值和掩膜的 Dice. threshold_sweep 的区域均值按波更新, 且阈值 t 的区域在阈值 t - 1
+的区域上继续生长, 结果与原实现接近但不保证相同. 分别在灰度均匀的气管和灰度沿气管渐变的气管上测试.
+
+运行: python -m benchmark.bench_threshold_sweep
+"""
+import io
+import time
+import contextlib
+import numpy as np
+
+from utils.region_grow import threshold_sweep
+from benchmark.bench_region_growing import LEGACY_NEXT26, legacy_region_growing
+
+
+def legacy_threshold_search(grayImg, seed, pointsnum_min=20000, max_points=100000):
+    """原 src.seg.regionGrowing_v2 的阈值搜索方式, 每个阈值都从种子点重新生长, 仅用于对比"""
+
+    threshold = 0
+    old_point_num = 1
+    seg_start = 0
+    curve = []
+    while True:
+        _, pointsNum = legacy_region_growing(grayImg, seed, threshold)
+        curve.append(pointsNum)
+        Lt = (pointsNum - old_point_num) / pointsNum
+        if (Lt > 0.1 and seg_start == 1 and old_point_num > pointsnum_min) or pointsNum > max_points:
+            break
+        threshold += 1
+        old_point_num = pointsNum
+        if Lt > 0.9:
+            seg_start = 1
+
+    return threshold - 1, curve
+
+
+def make_lung_airway_volume(size=64, seed=0, gradient=0):
+    """生成肺实质(-850HU)包围气管(-980HU)的合成CT, 阈值过大时气管生长会泄漏到肺实质
+
+    gradient 为灰度沿 z 轴每层的变化量, 不为 0 时区域均值随生长变化
+    """
+
+    rng = np.random.default_rng(seed)
+    volume = rng.normal(-850, 30, (size, size, size))
+    z, y, x = np.mgrid[0:size, 0:size, 0:size]
+    center = size // 2
+    radius = max(size // 12, 2)
+    trachea = (x - center) ** 2 + (y - center) ** 2 < radius ** 2
+    volume[trachea] = rng.normal(-980, 8, int(trachea.sum()))
+    volume += gradient * z
+    volume = volume.astype(np.int16)
+
+    return volume.transpose((2, 1, 0)), (center, center, size // 2)
+
+
+def compare(volume_T, seed, max_points, pointsnum_min):
+    start = time.perf_counter()
+    new_threshold, new_mask, new_num, new_curve = threshold_sweep(volume_T, seed, max_points=max_points,
+                                                                  pointsnum_min=pointsnum_min, offsets=LEGACY_NEXT26)
+    new_time = time.perf_counter() - start
+
+    with contextlib.redirect_stdout(io.StringIO()):  # 原实现输出每个阈值的生长点数
+        start = time.perf_counter()
+        old_threshold, old_curve = legacy_threshold_search(volume_T, seed, pointsnum_min=pointsnum_min,
+                                                           max_points=max_points)
+        old_mask, old_num = legacy_region_growing(volume_T, seed, old_threshold)
+        old_time = time.perf_counter() - start
+
+    overlap = np.count_nonzero((old_mask != 0) & (new_mask != 0))
+    print("legacy: %.3fs, threshold=%d, pointsNum=%d, growths=%d"
+          % (old_time, old_threshold, old_num, len(old_curve) + 1))
+    print("threshold_sweep: %.3fs, threshold=%d, pointsNum=%d" % (new_time, new_threshold, new_num))
+    print("speedup: %.1fx" % (old_time / new_time))
+    print("same threshold:", new_threshold == old_threshold,
+          "mask dice: %.4f" % (2 * overlap / (old_num + new_num)))
+
+
+def main(size=64, max_points=30000, pointsnum_min=3000):
+    for gradient in (0, 1):
+        volume_T, seed = make_lung_airway_volume(size, gradient=gradient)
+        print("volume:", volume_T.shape, "seed:", seed, "gradient:", gradient)
+        compare(volume_T, seed, max_points, pointsnum_min)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+"""血管分割基准测试: 整幅图像 ITK 多尺度 Hessian vs utils.vesselness 肺包围盒内分块计算
+
+比较肺(腐蚀后)内部的血管掩膜是否一致: 体模在肺的包围盒之外有一根比血管亮得多的细管(例如床边的导线),
+拉伸范围必须是整幅图像测度的最值才能与原实现一致. 同时报告增量高斯尺度空间多尺度方法各尺度的耗时和内存.
+
+运行: python -m benchmark.bench_vesselness
+"""
+import os
+import time
+import tempfile
+import itk
+import numpy as np
+import SimpleITK as sitk
+
+from benchmark.bench_lung_cu_seg import make_chest_ct
+from utils.vesselness import vesselness_mask, hessian_objectness, scale_space_objectness
+
+
+def legacy_vessle_segment(real_lung_path, vessel_mask_path):
+    """原 src.seg.VesselSegThread.vessle_segment 的实现, 仅用于对比"""
+
+    sigma_minimum = 2.
+    sigma_maximum = 2.
+    number_sigma_steps = 8
+    lower_threshold = 40
+
+    input_image = itk.imread(real_lung_path, itk.F)
+    image_type = type(input_image)
+    dimension = input_image.GetImageDimension()
+    hessian_pixel_type = itk.SymmetricSecondRankTensor[itk.D, dimension]
+    hessian_image_type = itk.Image[hessian_pixel_type, dimension]
+    objectness_filter = itk.HessianToObjectnessMeasureImageFilter[hessian_image_type, image_type].New()
+    objectness_filter.SetBrightObject(True)
+    objectness_filter.SetScaleObjectnessMeasure(True)
+    objectness_filter.SetAlpha(0.5)
+    objectness_filter.SetBeta(1.0)
+    objectness_filter.SetGamma(5.0)
+    multi_scale_filter = itk.MultiScaleHessianBasedMeasureImageFilter[image_type, hessian_image_type, image_type].New()
+    multi_scale_filter.SetInput(input_image)
+    multi_scale_filter.SetHessianToMeasureFilter(objectness_filter)
+    multi_scale_filter.SetSigmaStepMethodToLogarithmic()
+    multi_scale_filter.SetSigmaMinimum(sigma_minimum)
+    multi_scale_filter.SetSigmaMaximum(sigma_maximum)
+    multi_scale_filter.SetNumberOfSigmaSteps(number_sigma_steps)
+
+    output_pixel_type = itk.UC
+    output_image_type = itk.Image[output_pixel_type, dimension]
+
+    rescale_filter = itk.RescaleIntensityImageFilter[image_type, output_image_type].New()
+    rescale_filter.SetInput(multi_scale_filter)
+
+    threshold_filter = itk.BinaryThresholdImageFilter[output_image_type, output_image_type].New()
+    threshold_filter.SetInput(rescale_filter.GetOutput())
+    threshold_filter.SetLowerThreshold(lower_threshold)
+    threshold_filter.SetUpperThreshold(255)
+    threshold_filter.SetOutsideValue(0)
+    threshold_filter.SetInsideValue(1)
+
+    itk.imwrite(threshold_filter.GetOutput(), vessel_mask_path)
+
+
+def make_vessel_ct(slices=160, size=192, vessels=40, seed=0):
+    """在合成胸部CT的肺内加入随机方向的亮管道(血管), 返回CT数组和肺掩膜数组, zyx 顺序"""
+
+    rng = np.random.default_rng(seed)
+    volume = make_chest_ct(slices, size, seed)
+    lung = volume < -700
+    lung[:, int(size * 0.8):] = False  # 去掉床板内的空气
+    z, y, x = np.mgrid[0:slices, 0:size, 0:size].astype(np.float32)
+
+    lung_index = np.argwhere(lung)
+    for _ in range(vessels):
+        center = lung_index[rng.integers(len(lung_index))].astype(np.float32)
+        direction = rng.normal(size=3).astype(np.float32)
+        direction /= np.linalg.norm(direction)
+        radius = rng.uniform(1.0, 3.0)
+        # 到直线的距离
+        d = np.stack([z - center[0], y - center[1], x - center[2]])
+        t = np.tensordot(direction, d, axes=1)
+        dist2 = (d ** 2).sum(axis=0) - t ** 2
+        tube = (dist2 < radius ** 2) & (np.abs(t) < size / 4) & lung
+        volume[tube] = 40
+
+    # 肺的包围盒之外(身体下方的空气中)沿 z 轴的亮细管, 血管性测度高于肺内的血管
+    rod = (y - size * 0.95) ** 2 + (x - size / 2) ** 2 < 2 ** 2
+    volume[rod] = 3000
+    return volume, lung.astype(np.uint8)
+
+
+def main(slices=160, size=192):
+    volume, lung = make_vessel_ct(slices, size)
+    spacing = (0.8, 0.8, 1.0)
+    image = sitk.GetImageFromArray(volume)
+    image.SetSpacing(spacing)
+    lung_image = sitk.GetImageFromArray(lung)
+    lung_image.CopyInformation(image)
+    lung_image = sitk.BinaryErode(lung_image != 0, [4, 4, 4])
+    print("volume:", volume.shape)
+
+    work_dir = tempfile.mkdtemp()
+    ct_path = os.path.join(work_dir, "ct.nii.gz")
+    legacy_path = os.path.join(work_dir, "vessel.nii.gz")
+    sitk.WriteImage(image, ct_path)
+
+    start = time.perf_counter()
+    legacy_vessle_segment(ct_path, legacy_path)
+    legacy_time = time.perf_counter() - start
+    legacy = sitk.GetArrayFromImage(sitk.ReadImage(legacy_path))
+
+    start = time.perf_counter()
+    tiled = sitk.GetArrayFromImage(vesselness_mask(image, lung_image))
+    tiled_time = time.perf_counter() - start
+
+    inside = sitk.GetArrayViewFromImage(lung_image) != 0
+    diff = int(np.count_nonzero(legacy[inside] != tiled[inside]))
+    print("legacy full volume: %.2fs" % legacy_time)
+    print("streamed slabs: %.2fs" % tiled_time)
+    print("vessel voxels in lung: legacy %d, streamed %d (different %d)"
+          % (np.count_nonzero(legacy[inside]), np.count_nonzero(tiled[inside]), diff))
+
+    # 多尺度: ITK 单尺度(当前设置) vs 尺度空间 5 个尺度
+    start = time.perf_counter()
+    hessian_objectness(volume, spacing, 2., 2., 1)
+    single_time = time.perf_counter() - start
+
+    report = []
+    start = time.perf_counter()
+    scale_space_objectness(volume, spacing, 1., 4., 5, report=report)
+    multi_time = time.perf_counter() - start
+
+    print("itk single scale: %.2fs" % single_time)
+    print("scale space 5 scales: %.2fs" % multi_time)
+    for scale in report:
+        print("  sigma %.2f (residual %.2f): %.2fs, %.1f MB"
+              % (scale['sigma'], scale['residual_sigma'], scale['seconds'], scale['bytes'] / 2 ** 20))
+    multi_mask = sitk.GetArrayFromImage(vesselness_mask(image, lung_image, 1., 4., 5, method='scale_space'))
+    print("vessel voxels in lung: multi scale %d" % np.count_nonzero(multi_mask[inside]))
+
+
+if __name__ == "__main__":
+    main()
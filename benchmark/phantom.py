@@ -0,0 +1,345 @@
+"""合成胸部CT体模, 用于各阶段的基准测试和批量规划
+
+体模包括: 椭球形身体(皮肤、皮下脂肪、软组织)、左右肺、分叉的气管树(管壁+空气管腔)、肺内分叉的血管树、
+肋骨和脊柱、球形肿瘤. CT值取典型值, 见 HU. 同时给出各结构的真值掩膜, 后续阶段可以直接使用真值作为输入,
+耗时不受前一阶段分割质量的影响. 病例文件夹中的文件名与 utils.planning.CASE_FILES 一致, 可以直接用于
+batch_plan.py.
+
+坐标以毫米为单位, 原点在体模中心, 方向矩阵为单位矩阵; 数组为 zyx 顺序, y 较小的一侧为身体前方
+(仰卧, 与 extract_ps 的 face_up 一致).
+
+运行: python -m benchmark.phantom cases/ --cases 3
+"""
+import os
+import json
+import argparse
+from dataclasses import dataclass, field
+import numpy as np
+import SimpleITK as sitk
+
+from utils.planning import CASE_FILES
+from utils.storage import intermediate_path, write_image
+
+
+# 各组织的CT值(HU)
+HU = {
+    'air': -1000,
+    'lung': -850,  # 肺实质
+    'fat': -100,  # 皮下脂肪
+    'soft_tissue': 40,  # 肌肉、纵隔
+    'skin': 30,
+    'blood': 40,  # 血管(平扫)
+    'tumor': 35,
+    'airway_wall': 50,
+    'cancellous_bone': 300,
+    'cortical_bone': 700,
+}
+
+SKIN_THICKNESS = 2.  # 皮肤厚度(mm)
+FAT_THICKNESS = 10.  # 皮下脂肪厚度(mm)
+RIB_RADIUS = 4.  # 肋骨半径(mm)
+RIB_INTERVAL = 22.  # 肋骨间距(mm)
+SPINE_RADIUS = 16.  # 椎体半径(mm)
+CORTICAL_THICKNESS = 1.5  # 骨皮质厚度(mm)
+NOISE_HU = 12.  # 高斯噪声标准差(HU)
+
+
+@dataclass
+class Phantom:
+    """合成胸部CT及真值"""
+
+    ct: object  # CT图像, int16 -> 'SimpleITK.Image'
+    masks: dict  # 真值掩膜, uint8, 键为 CASE_FILES 中的名称及 'body' -> 'dict'
+    trachea_seed: tuple  # 气管种子点(体素索引, xyz), airways_seg 的输入
+    tumors: list = field(default_factory=list)  # 每个肿瘤的 (中心(mm, xyz), 半径(mm))
+
+    def to_dict(self):
+        """体模的描述信息, 可以保存为 JSON"""
+
+        return dict(size=self.ct.GetSize(), spacing=self.ct.GetSpacing(), origin=self.ct.GetOrigin(),
+                    trachea_seed=[int(i) for i in self.trachea_seed],
+                    tumors=[dict(center=[float(c) for c in center], radius=float(radius))
+                            for center, radius in self.tumors])
+
+
+class _Grid:
+    """体素中心的物理坐标(mm), 原点在体模中心"""
+
+    def __init__(self, shape, spacing):
+        self.shape = shape  # zyx
+        self.spacing = spacing  # xyz
+        self.origin = tuple(-(n - 1) / 2 * s for n, s in zip(shape[::-1], spacing))  # xyz
+        self.z = self.axis(0)[:, None, None]
+        self.y = self.axis(1)[None, :, None]
+        self.x = self.axis(2)[None, None, :]
+
+    def axis(self, dim, start=0, stop=None):
+        """第 dim 维(zyx)索引 start:stop 的物理坐标"""
+
+        stop = self.shape[dim] if stop is None else stop
+        xyz = 2 - dim
+        return (np.arange(start, stop, dtype=np.float32) * self.spacing[xyz] + self.origin[xyz]).astype(np.float32)
+
+    def index(self, point):
+        """物理坐标(xyz)对应的体素索引(xyz)"""
+
+        return tuple(int(round((point[i] - self.origin[i]) / self.spacing[i])) for i in range(3))
+
+    def bbox(self, lower, upper):
+        """物理坐标范围对应的 zyx 切片, 超出图像的部分裁掉, 范围为空时返回 None"""
+
+        slices = []
+        for dim in range(3):
+            xyz = 2 - dim
+            start = max(int(np.floor((lower[xyz] - self.origin[xyz]) / self.spacing[xyz])), 0)
+            stop = min(int(np.ceil((upper[xyz] - self.origin[xyz]) / self.spacing[xyz])) + 1, self.shape[dim])
+            if start >= stop:
+                return None
+            slices.append(slice(start, stop))
+        return tuple(slices)
+
+
+def _ellipsoid(grid, center, radii):
+    """椭球内部的体素, center/radii 为 xyz(mm)"""
+
+    return (((grid.x - center[0]) / radii[0]) ** 2 + ((grid.y - center[1]) / radii[1]) ** 2
+            + ((grid.z - center[2]) / radii[2]) ** 2) < 1
+
+
+def _draw_tube(grid, mask, p0, p1, r0, r1):
+    """在 mask 中画一段圆台(两端半径 r0、r1 的管), 只计算包围盒内的体素"""
+
+    p0 = np.asarray(p0, dtype=np.float32)
+    p1 = np.asarray(p1, dtype=np.float32)
+    margin = max(r0, r1)
+    box = grid.bbox(np.minimum(p0, p1) - margin, np.maximum(p0, p1) + margin)
+    if box is None:
+        return
+
+    z = grid.axis(0, box[0].start, box[0].stop)[:, None, None]
+    y = grid.axis(1, box[1].start, box[1].stop)[None, :, None]
+    x = grid.axis(2, box[2].start, box[2].stop)[None, None, :]
+    d = p1 - p0
+    length2 = max(float(d @ d), 1e-6)
+    t = np.clip(((x - p0[0]) * d[0] + (y - p0[1]) * d[1] + (z - p0[2]) * d[2]) / length2, 0, 1)
+    dist2 = (x - p0[0] - t * d[0]) ** 2 + (y - p0[1] - t * d[1]) ** 2 + (z - p0[2] - t * d[2]) ** 2
+    mask[box] |= dist2 < (r0 + (r1 - r0) * t) ** 2
+
+
+def _branches(rng, start, direction, length, radius, depth, spread, taper=0.7, min_radius=1.):
+    """分叉的管状树, 每一段分成两支, 返回 (起点, 终点, 起点半径, 终点半径) 列表
+
+    Args:
+        rng: 随机数生成器 -> 'numpy.random.Generator'
+        start: 根的起点(mm, xyz) -> 'numpy.ndarray'
+        direction: 根的方向 -> 'numpy.ndarray'
+        length: 根的长度(mm), 每一代乘 0.8 -> 'float'
+        radius: 根的半径(mm), 每一代乘 taper -> 'float'
+        depth: 分叉的代数 -> 'int'
+        spread: 子支与父支的夹角(度) -> 'float'
+    """
+
+    segments = []
+    stack = [(np.asarray(start, dtype=float), np.asarray(direction, dtype=float), length, radius, depth)]
+    while stack:
+        p, d, l, r, k = stack.pop()
+        d = d / np.linalg.norm(d)
+        end = p + d * l
+        segments.append((p, end, r, max(r * taper, min_radius)))
+        if k == 0 or r * taper < min_radius:
+            continue
+        # 在随机的分叉平面内向两侧各转 spread 度
+        normal = np.cross(d, rng.normal(size=3))
+        normal /= np.linalg.norm(normal)
+        angle = np.radians(spread * rng.uniform(0.8, 1.2))
+        for sign in (1, -1):
+            stack.append((end, np.cos(angle) * d + sign * np.sin(angle) * normal, l * 0.8, r * taper, k - 1))
+    return segments
+
+
+def make_phantom(slices=160, size=256, fov=350., slice_thickness=1.25, n_tumors=1, seed=0):
+    """生成合成胸部CT及真值掩膜
+
+    Args:
+        slices: 层数 -> 'int'
+        size: 每层的行数和列数 -> 'int'
+        fov: 视野(mm), 层内体素间距为 fov / size -> 'float'
+        slice_thickness: 层间距(mm) -> 'float'
+        n_tumors: 肿瘤个数 -> 'int'
+        seed: 随机种子, 相同参数和种子生成相同的体模 -> 'int'
+
+    Returns:
+        phantom: 体模 -> 'Phantom'
+    """
+
+    rng = np.random.default_rng(seed)
+    pixel = fov / size
+    grid = _Grid((slices, size, size), (pixel, pixel, slice_thickness))
+    half_z = (slices - 1) / 2 * slice_thickness
+
+    # 身体: z 方向较长的椭球, 两端的层截面略小; 外层皮肤, 其次皮下脂肪
+    body_radii = np.array([0.42 * fov, 0.3 * fov, 2.2 * half_z])
+    body = _ellipsoid(grid, (0, 0, 0), body_radii)
+    subcutaneous = _ellipsoid(grid, (0, 0, 0), body_radii - SKIN_THICKNESS)
+    muscle = _ellipsoid(grid, (0, 0, 0), body_radii - SKIN_THICKNESS - FAT_THICKNESS)
+    volume = np.full(grid.shape, HU['air'], dtype=np.int16)
+    volume[body] = HU['skin']
+    volume[subcutaneous] = HU['fat']
+    volume[muscle] = HU['soft_tissue']
+    del subcutaneous, muscle
+
+    # 左右肺, 位于中心偏下(足侧)
+    lung_center_x = 0.2 * fov
+    lung_center_z = -0.05 * half_z
+    lung_radii = (0.13 * fov, 0.2 * fov, 0.85 * half_z)
+    lung = _ellipsoid(grid, (-lung_center_x, 0, lung_center_z), lung_radii)
+    lung |= _ellipsoid(grid, (lung_center_x, 0, lung_center_z), lung_radii)
+    volume[lung] = HU['lung']
+
+    # 气管树: 气管从顶层进入, 在隆突处分成左右主支气管, 再在肺内逐级分叉
+    carina = np.array([0, 0, lung_center_z + 0.35 * lung_radii[2]])
+    central = [(np.array([0, 0, half_z + 5]), carina, 8., 8.)]
+    peripheral = []
+    for side in (-1, 1):
+        bronchus_end = carina + np.array([side * 0.5 * lung_center_x, 0, -15])
+        central.append((carina, bronchus_end, 6., 5.))
+        direction = np.array([side * lung_center_x, 0, lung_center_z]) - bronchus_end
+        peripheral += _branches(rng, bronchus_end, direction, 0.15 * fov, 4.5, 3, 30)
+    airway_wall = np.zeros(grid.shape, dtype=bool)
+    airway = np.zeros(grid.shape, dtype=bool)
+    peripheral_wall = np.zeros(grid.shape, dtype=bool)
+    peripheral_airway = np.zeros(grid.shape, dtype=bool)
+    for segments, wall, lumen in ((central, airway_wall, airway),
+                                  (peripheral, peripheral_wall, peripheral_airway)):
+        for p0, p1, r0, r1 in segments:
+            _draw_tube(grid, wall, p0, p1, r0 + max(1., 0.25 * r0), r1 + max(1., 0.25 * r1))
+            _draw_tube(grid, lumen, p0, p1, r0, r1)
+    airway_wall |= peripheral_wall & lung  # 肺外的细支气管去掉
+    airway |= peripheral_airway & lung
+    del peripheral_wall, peripheral_airway
+    volume[airway_wall] = HU['airway_wall']
+    volume[airway] = HU['air']
+
+    # 血管树: 每侧从肺门向上叶和下叶各长一棵, 只保留肺内的部分
+    vessel = np.zeros(grid.shape, dtype=bool)
+    for side in (-1, 1):
+        hilum = carina + np.array([side * 0.15 * fov, 0.03 * fov, -10])
+        for target_z in (lung_center_z + 0.5 * lung_radii[2], lung_center_z - 0.5 * lung_radii[2]):
+            direction = np.array([side * lung_center_x, 0, target_z]) - hilum
+            for p0, p1, r0, r1 in _branches(rng, hilum, direction, 0.12 * fov, 5., 4, 35, taper=0.75):
+                _draw_tube(grid, vessel, p0, p1, r0, r1)
+    vessel &= lung & ~airway_wall
+    volume[vessel] = HU['blood']
+    del airway_wall
+
+    # 肿瘤: 肺内前方(y < 0)的球, 进针路径可以从前胸壁进入
+    tumor = np.zeros(grid.shape, dtype=bool)
+    tumors = []
+    for _ in range(n_tumors):
+        side = rng.choice((-1, 1))
+        radius = rng.uniform(8, 14)
+        offset = rng.uniform(-0.35, 0.35, size=3) * lung_radii
+        offset[1] = -abs(offset[1])
+        center = np.array([side * lung_center_x, 0, lung_center_z]) + offset
+        tumor |= _ellipsoid(grid, center, (radius, radius, radius))
+        tumors.append((tuple(center), radius))
+    volume[tumor] = HU['tumor']
+
+    # 脊柱: 身体后方沿 z 轴的圆柱, 骨皮质包围松质骨
+    spine_y = 0.72 * body_radii[1]
+    spine_dist = np.sqrt(grid.x ** 2 + (grid.y - spine_y) ** 2)
+    skeleton = np.broadcast_to(spine_dist < SPINE_RADIUS, grid.shape).copy()
+    cortical = np.broadcast_to((spine_dist >= SPINE_RADIUS - CORTICAL_THICKNESS) & (spine_dist < SPINE_RADIUS),
+                               grid.shape).copy()
+    del spine_dist
+
+    # 肋骨: 沿胸壁内侧椭圆的管, 前方低于后方, 胸骨处断开
+    rib_radii = body_radii[:2] - SKIN_THICKNESS - FAT_THICKNESS - RIB_RADIUS
+    rib_tilt = 10.
+    top = lung_center_z + lung_radii[2]
+    for rib_z in np.arange(top, lung_center_z - lung_radii[2], -RIB_INTERVAL):
+        box = grid.bbox((-body_radii[0], -body_radii[1], rib_z - rib_tilt - RIB_RADIUS),
+                        (body_radii[0], body_radii[1], rib_z + rib_tilt + RIB_RADIUS))
+        if box is None:
+            continue
+        z = grid.axis(0, box[0].start, box[0].stop)[:, None, None]
+        y = grid.axis(1, box[1].start, box[1].stop)[None, :, None]
+        x = grid.axis(2, box[2].start, box[2].stop)[None, None, :]
+        scale = np.sqrt(np.clip(1 - (z / body_radii[2]) ** 2, 0, 1))  # 身体截面随 z 缩小
+        u = x / (rib_radii[0] * scale)
+        v = y / (rib_radii[1] * scale)
+        rho = np.sqrt(u ** 2 + v ** 2)
+        theta = np.arctan2(v, u)
+        local_radius = np.sqrt((rib_radii[0] * scale * np.cos(theta)) ** 2 + (rib_radii[1] * scale * np.sin(theta)) ** 2)
+        dist = np.sqrt(((rho - 1) * local_radius) ** 2 + (z - (rib_z + rib_tilt * np.sin(theta))) ** 2)
+        rib = (dist < RIB_RADIUS) & ~((np.abs(x) < 20) & (y < 0))
+        skeleton[box] |= rib
+        cortical[box] |= rib & (dist >= RIB_RADIUS - CORTICAL_THICKNESS)
+    volume[skeleton] = HU['cancellous_bone']
+    volume[cortical] = HU['cortical_bone']
+    del cortical
+
+    noise = rng.standard_normal(grid.shape, dtype=np.float32) * NOISE_HU
+    volume += noise.astype(np.int16)
+    del noise
+
+    lung &= ~airway
+    masks = dict(body=body, lung=lung, trachea=airway, vessel=vessel, skeleton=skeleton, tumor=tumor,
+                 lung_trachea=lung | airway)
+
+    ct = _to_image(volume, grid)
+    masks = {name: _to_image(mask.astype(np.uint8), grid) for name, mask in masks.items()}
+    trachea_seed = grid.index((0, 0, half_z - 5))
+    return Phantom(ct=ct, masks=masks, trachea_seed=trachea_seed, tumors=tumors)
+
+
+def _to_image(array, grid):
+    image = sitk.GetImageFromArray(array)
+    image.SetSpacing(grid.spacing)
+    image.SetOrigin(grid.origin)
+    return image
+
+
+def write_case(phantom, case_dir, fmt='nii.gz'):
+    """把体模写为病例文件夹, 文件名见 utils.planning.CASE_FILES, 描述信息写入 phantom.json
+
+    Args:
+        phantom: 体模 -> 'Phantom'
+        case_dir: 病例文件夹 -> 'str'
+        fmt: 文件格式, 见 utils.storage.INTERMEDIATE_FORMATS -> 'str'
+
+    Returns:
+        paths: 各文件路径, 键为 'ct' 和 phantom.masks 的键 -> 'dict'
+    """
+
+    os.makedirs(case_dir, exist_ok=True)
+    paths = {'ct': intermediate_path(case_dir, CASE_FILES['ct'][0], fmt)}
+    write_image(phantom.ct, paths['ct'])
+    for name, mask in phantom.masks.items():
+        file_name = CASE_FILES[name][0] if name in CASE_FILES else name + '_mask'
+        paths[name] = intermediate_path(case_dir, file_name, fmt)
+        write_image(mask, paths[name])
+    with open(os.path.join(case_dir, 'phantom.json'), 'w', encoding='utf-8') as f:
+        json.dump(phantom.to_dict(), f, indent=2)
+    return paths
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="生成合成胸部CT病例")
+    parser.add_argument('output_dir', help="输出目录, 每个病例一个文件夹")
+    parser.add_argument('--cases', type=int, default=1, help="病例数, 第 i 个病例的随机种子为 seed + i")
+    parser.add_argument('--slices', type=int, default=160)
+    parser.add_argument('--size', type=int, default=256)
+    parser.add_argument('--tumors', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    for i in range(args.cases):
+        phantom = make_phantom(args.slices, args.size, n_tumors=args.tumors, seed=args.seed + i)
+        case_dir = os.path.join(args.output_dir, 'phantom_{:03d}'.format(i))
+        write_case(phantom, case_dir)
+        print(case_dir, phantom.ct.GetSize())
+
+
+if __name__ == "__main__":
+    main()
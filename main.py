@@ -1,15 +1,24 @@
 import sys
-from PyQt5.QtWidgets import QApplication
-from qdarkstyle import load_stylesheet
-from src.main_window import MainWindow
 import multiprocessing
+from utils.runtime_config import apply_runtime_config, runtime_diagnostics
 
 if __name__ == "__main__":
     multiprocessing.freeze_support()
+    apply_runtime_config()  # 在导入 numpy 等库之前设置线程数
+    print(runtime_diagnostics())
+
+    from PyQt5.QtWidgets import QApplication
+    from qdarkstyle import load_stylesheet
+    from src.main_window import MainWindow
+
     app = QApplication(sys.argv)
     main_window = MainWindow()
     main_window.setWindowTitle("肺肿瘤消融规划系统")
     app.setStyleSheet(load_stylesheet(qt_api='pyqt5'))
 
     main_window.showMaximized()
-    sys.exit(app.exec_())
+    exit_code = app.exec_()
+
+    from utils.volume_cache import volume_cache
+    print(volume_cache.report())
+    sys.exit(exit_code)
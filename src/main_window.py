@@ -5,11 +5,10 @@ import numpy as np
 import SimpleITK as sitk
 import shutil
 
-from shutil import copy as copy_file
 from PyQt5 import QtWidgets, QtCore
 from PyQt5.QtGui import QIntValidator
 
-from PyQt5.QtWidgets import QMainWindow, QFileDialog, QErrorMessage, QMessageBox, QLabel
+from PyQt5.QtWidgets import QMainWindow, QFileDialog, QErrorMessage, QMessageBox, QLabel, QInputDialog
 from vtkmodules.qt.QVTKRenderWindowInteractor import QVTKRenderWindowInteractor
 
 from src.mouse_interactor_style import MouseInteractorStyle1, MouseInteractorStyle2, MouseInteractorStyle3
@@ -18,12 +17,25 @@ from src.seg import VesselSegThread, SkeletonSegThread
 sys.path.append('..')
 from ui.ui import Ui_MainWindow
 from utils.path_design import AutoPathPlanThread, LargeAutoPathPlanThread
-from utils.dcm2nii import dcm2nii
+from utils.dcm2nii import DicomImportThread
+from utils.dicom_index import DicomScanThread, series_label
 from utils.reader import vtk_nii_reader
 from utils.power_time import solve_equation, solve_equation_v2
 from utils.eval_tumor_efficacy import eval_tumor_efficacy
+from utils.runtime_config import runtime_config
+from utils.volume_cache import volume_cache
+from utils.storage import intermediate_path, link_file, clear_dir_async
 from nnunet.inference.predict import predict_from_folder
 
+def mask_file_filter():
+    """导入掩膜的文件对话框过滤条件, 中间结果格式为 npy 时也可以导入 .npy 文件"""
+
+    patterns = "*.nii *.nii.gz"
+    if runtime_config('intermediate_format') == 'npy':
+        patterns += " *.npy"
+    return "Image Files ({})".format(patterns)
+
+
 # # 将vtk报错信息输出到日志文件，避免弹出窗口
 # err_out = vtk.vtkFileOutputWindow()
 # err_out.SetFileName(os.path.join("log", "VTK_error.txt"))
@@ -34,6 +46,8 @@ from nnunet.inference.predict import predict_from_folder
 class MainWindow(QMainWindow, Ui_MainWindow):
     """主窗口"""
 
+    nnunet_input_signal = QtCore.pyqtSignal(object)  # CT复制到 mid_result 完成, 参数是复制任务
+
     def __init__(self, parent=None):
         super(MainWindow, self).__init__(parent)
 
@@ -48,7 +62,12 @@ class MainWindow(QMainWindow, Ui_MainWindow):
         self.lung_tag = False
 
         self.Po_list = []
+        self.Po_mask_list = []  # Po_list 中各表面对应的掩膜路径, 路径规划的避障检查使用
         self.info_list = ["", "", "", "", "", ""]
+        self.nnunet_input_future = None  # 无法链接CT时后台复制到 mid_result 的任务
+        self.nnunet_input_callbacks = []  # 等待复制完成后调用的任务
+        # 复制完成的信号在复制线程中发送, 用队列连接在主线程中处理
+        self.nnunet_input_signal.connect(self._nnunet_input_done, QtCore.Qt.QueuedConnection)
 
         os.makedirs(os.path.join(self.cwd, 'result'), exist_ok=True)
         os.makedirs(os.path.join(self.cwd, 'mid_result'), exist_ok=True)
@@ -188,24 +207,22 @@ class MainWindow(QMainWindow, Ui_MainWindow):
         
         # 清空Po_list
         self.Po_list = []
-
+        self.Po_mask_list = []
+
+        # 上次还没复制完的CT先取消或等待完成, 避免写入新病例的 mid_result
+        if self.nnunet_input_future is not None and not self.nnunet_input_future.cancel():
+            try:
+                self.nnunet_input_future.result()
+            except OSError:
+                pass
+        self.nnunet_input_future = None
+        self.nnunet_input_callbacks = []
+
+        # 目录改名后在后台删除, 不阻塞下一次导入
         nii_dir = os.path.join(self.cwd, 'mid_result')
         seg_dir = os.path.join(self.cwd, 'result')
-        for root, dirs, files in os.walk(nii_dir, topdown=False):
-            for name in files:
-                os.remove(os.path.join(root, name))
-            for name in dirs:
-                for sub_name in os.listdir(os.path.join(root, name)):
-                    os.remove(os.path.join(root, name, sub_name))
-                os.rmdir(os.path.join(root, name))
-
-        for root, dirs, files in os.walk(seg_dir, topdown=False):
-            for name in files:
-                os.remove(os.path.join(root, name))
-            for name in dirs:
-                for sub_name in os.listdir(os.path.join(root, name)):
-                    os.remove(os.path.join(root, name, sub_name))
-                os.rmdir(os.path.join(root, name))
+        clear_dir_async(nii_dir)
+        clear_dir_async(seg_dir)
 
         # 清空view
         self.vtk_view1.Finalize()
@@ -236,21 +253,35 @@ class MainWindow(QMainWindow, Ui_MainWindow):
             ct_nii_dir = os.path.join(self.cwd, 'mid_result')
             self.ct_nii_path = os.path.join(ct_nii_dir, "nii_0000.nii.gz")
 
-            dcm2nii(self.ct_dicom_path, ct_nii_dir)
+            # 在线程中扫描文件头(有索引时只读取新增的文件), 选择序列后再导入
+            self.import_btn.setEnabled(False)
+            self.dicom_scan_thread = DicomScanThread(self.ct_dicom_path, os.path.join(self.cwd, 'cache', 'dicom'))
+            self.dicom_scan_thread.progress_signal.connect(self._dicom_scan_progress)
+            self.dicom_scan_thread.finish_signal.connect(self._dicom_scanned)
+            self.dicom_scan_thread.start()
+            return
 
         elif mb.clickedButton() == nii_btn:
             self.ct_nii_path, _type = QFileDialog.getOpenFileNames(
-                self, "请选择.nii.gz文件", self.cwd, "nii Files (*.nii.gz)")
+                self, "请选择.nii/.nii.gz文件", self.cwd, "nii Files (*.nii *.nii.gz)")
             if self.ct_nii_path == []:  # 没选择时返回
                 return
             
             # 删除上次保留的文件
             self._clear()
             self.ct_nii_path = self.ct_nii_path[0]  # 取路径
-           
+
+            # 直接读取原文件, nnU-Net 需要的 mid_result/nii_0000.nii.gz 用链接代替复制
+            # (未压缩的 .nii 也链接为 .nii.gz, ITK 读取时自动识别是否压缩)
             ct_nii_dir = os.path.join(self.cwd, 'mid_result')
-            copy_file(self.ct_nii_path, os.path.join(ct_nii_dir, "nii_0000.nii.gz"))  # 复制文件
-            self.ct_nii_path = os.path.join(ct_nii_dir, "nii_0000.nii.gz")
+            try:
+                self.nnunet_input_future = link_file(self.ct_nii_path, os.path.join(ct_nii_dir, "nii_0000.nii.gz"))
+            except OSError as e:
+                error_message = QErrorMessage(self)
+                error_message.setWindowTitle("错误提示")
+                error_message.showMessage(str(e))
+                error_message.exec_()
+                return
 
         else:
             return
@@ -270,15 +301,86 @@ class MainWindow(QMainWindow, Ui_MainWindow):
             self.import_path_edit.setText(str(self.ct_nii_path))
             self._key_enable()
 
+    def _dicom_scan_progress(self, percent):
+        """槽函数:DICOM文件头扫描进度"""
+
+        self.info.setText("正在扫描DICOM... {}%".format(percent))
+
+    def _dicom_scanned(self, result):
+        """槽函数:DICOM文件夹扫描完成, 有多个序列时选择要导入的序列"""
+
+        index, series = result
+        if not series:
+            self._dicom_import_error("没有找到DICOM序列: {}".format(self.ct_dicom_path))
+            return
+
+        selected = series[0]
+        if len(series) > 1:
+            labels = [series_label(info) for info in series]
+            default = max(range(len(series)), key=lambda i: series[i]['slices'])  # 默认选择层数最多的序列
+            label, ok = QInputDialog.getItem(self, "选择序列", "请选择要导入的DICOM序列:", labels, default, False)
+            if not ok:
+                self.import_btn.setEnabled(True)
+                self.info.setText("  ".join(self.info_list))
+                return
+            selected = series[labels.index(label)]
+
+        # 在线程中并行解码, 解码完成后先显示, 写完nii文件后再使能分割按键
+        ct_nii_dir = os.path.join(self.cwd, 'mid_result')
+        self.dicom_import_thread = DicomImportThread(self.ct_dicom_path, ct_nii_dir,
+                                                     index.file_names(selected['series_uid']))
+        self.dicom_import_thread.progress_signal.connect(self._dicom_import_progress)
+        self.dicom_import_thread.loaded_signal.connect(self._dicom_loaded)
+        self.dicom_import_thread.finish_signal.connect(self._dicom_import_finished)
+        self.dicom_import_thread.error_signal.connect(self._dicom_import_error)
+        self.dicom_import_thread.start()
+
+    def _dicom_import_progress(self, percent):
+        """槽函数:DICOM解码进度"""
+
+        self.info.setText("正在导入DICOM... {}%".format(percent))
+
+    def _dicom_loaded(self, reader_output):
+        """槽函数:DICOM解码完成, 显示CT, nii文件写完之前不能分割"""
+
+        self.reader_output = reader_output
+        self._key_enable()
+        self._seg_btn_enable(False)
+        self.info.setText("正在保存CT...")
+
+    def _dicom_import_finished(self, ct_nii_path):
+        """槽函数:nii文件写完"""
+
+        self.ct_nii_path = ct_nii_path
+        self.import_path_edit.setText(str(self.ct_nii_path))
+        self._seg_btn_enable(True)
+        self.import_btn.setEnabled(True)
+        self.info.setText("  ".join(self.info_list))
+
+    def _dicom_import_error(self, message):
+        """槽函数:DICOM导入出错"""
+
+        self.import_btn.setEnabled(True)
+        self.info.setText("  ".join(self.info_list))
+        error_message = QErrorMessage(self)
+        error_message.setWindowTitle("错误提示")
+        error_message.showMessage(message)
+        error_message.exec_()
+
+    def _seg_btn_enable(self, enable):
+        """分割和规划按键使能"""
+
+        self.lung_trachea_seg_btn.setEnabled(enable)
+        self.vessel_seg_btn.setEnabled(enable)
+        self.skeleton_seg_btn.setEnabled(enable)
+        self.tumor_seg_btn.setEnabled(enable)
+        self.auto_path_btn.setEnabled(enable)
+
     def _key_enable(self):
         """按键使能, 如果导入dicom格式, 则接收转化后的nii路径, 如果是nii格式, 则直接接收"""
 
         # 按键使能
-        self.lung_trachea_seg_btn.setEnabled(True)
-        self.vessel_seg_btn.setEnabled(True)
-        self.skeleton_seg_btn.setEnabled(True)
-        self.tumor_seg_btn.setEnabled(True)
-        self.auto_path_btn.setEnabled(True)
+        self._seg_btn_enable(True)
 
 
         self.lung_tag = False
@@ -850,31 +952,29 @@ class MainWindow(QMainWindow, Ui_MainWindow):
         # 判断返回结果处理相应事项
         if mb.clickedButton() == import_btn:
             self.lung_mask_path, _type = QFileDialog.getOpenFileNames(
-                self, "请导入肺掩膜", self.cwd, "nii Files (*.nii.gz)")
+                self, "请导入肺掩膜", self.cwd, mask_file_filter())
             if self.lung_mask_path == []:  # 没选择时返回
                 return
             self.lung_mask_path = self.lung_mask_path[0]  # 取路径
 
             self.trachea_mask_path, _type = QFileDialog.getOpenFileNames(
-                self, "请导入气管掩膜", self.cwd, "nii Files (*.nii.gz)")
+                self, "请导入气管掩膜", self.cwd, mask_file_filter())
 
             if self.trachea_mask_path == []:  # 没选择时返回
                 return
 
             self.trachea_mask_path = self.trachea_mask_path[0]
 
-            self.lung_trachea_mask_path = os.path.join(self.cwd, 'result', 'lung_trachea_mask.nii.gz')
-            lung_mask_img = sitk.ReadImage(self.lung_mask_path)
-            trachea_mask_img = sitk.ReadImage(self.trachea_mask_path)
-            lung_mask_img = sitk.Cast(lung_mask_img, sitk.sitkUInt8)
-            trachea_mask_img = sitk.Cast(trachea_mask_img, sitk.sitkUInt8)
+            self.lung_trachea_mask_path = intermediate_path(os.path.join(self.cwd, 'result'), 'lung_trachea_mask')
+            lung_mask_img = volume_cache.read_image(self.lung_mask_path, sitk.sitkUInt8)
+            trachea_mask_img = volume_cache.read_image(self.trachea_mask_path, sitk.sitkUInt8)
 
             if lung_mask_img.GetSize() != trachea_mask_img.GetSize():
                 QtWidgets.QMessageBox.warning(self, '警告', '肺掩膜和气管掩膜不匹配', QtWidgets.QMessageBox.Yes)
                 return
 
             merged_mask = sitk.Maximum(lung_mask_img, trachea_mask_img)
-            sitk.WriteImage(merged_mask, self.lung_trachea_mask_path)
+            volume_cache.write_image(merged_mask, self.lung_trachea_mask_path)
 
             self.lung_trachea_seg_btn.setEnabled(False)
             self.info_list[0] = "正在进行肺和气管分割..."
@@ -928,6 +1028,7 @@ class MainWindow(QMainWindow, Ui_MainWindow):
             self.info.setText("  ".join(self.info_list))
             return
         self.Po_list.append(self.trachea_polydata)
+        self.Po_mask_list.append(self.trachea_mask_path)
 
         self.lung_slider.valueChanged.connect(self._set_lung_opacity)
 
@@ -966,7 +1067,7 @@ class MainWindow(QMainWindow, Ui_MainWindow):
         # 判断返回结果处理相应事项
         if mb.clickedButton() == import_btn:
             self.vessel_mask_path, _type = QFileDialog.getOpenFileNames(
-                self, "请导入血管掩膜", self.cwd, "nii Files (*.nii.gz)")
+                self, "请导入血管掩膜", self.cwd, mask_file_filter())
             if self.vessel_mask_path == []:  # 没选择时返回
                 return
             
@@ -984,9 +1085,11 @@ class MainWindow(QMainWindow, Ui_MainWindow):
             self.vessel_seg_btn.setEnabled(False)
             self.info_list[1] = "正在进行血管分割..."
             self.info.setText("  ".join(self.info_list))
-            self.vessel_mask_path = os.path.join(self.cwd, 'result', 'vessel_mask.nii.gz')
+            self.vessel_mask_path = intermediate_path(os.path.join(self.cwd, 'result'), 'vessel_mask')
 
-            self.vessel_seg_thread = VesselSegThread(self.ct_nii_path, self.lung_mask_path, self.vessel_mask_path)
+            # 多尺度血管分割的结果与原实现不同, 由运行配置 vessel_multi_scale 开启
+            self.vessel_seg_thread = VesselSegThread(self.ct_nii_path, self.lung_mask_path, self.vessel_mask_path,
+                                                     multi_scale=bool(runtime_config('vessel_multi_scale')))
             self.vessel_seg_thread.finish_signal.connect(self._vessel_rebuild)
             self.vessel_seg_thread.start()
 
@@ -1008,6 +1111,7 @@ class MainWindow(QMainWindow, Ui_MainWindow):
             self.info.setText("  ".join(self.info_list))
             return
         self.Po_list.append(self.vessel_polydata)
+        self.Po_mask_list.append(self.vessel_mask_path)
 
         self.vessel_slider.valueChanged.connect(self._set_vessel_opacity)
         self.vessel_slider.setValue(100)
@@ -1037,7 +1141,7 @@ class MainWindow(QMainWindow, Ui_MainWindow):
         # 判断返回结果处理相应事项
         if mb.clickedButton() == import_btn:
             self.skeleton_mask_path, _type = QFileDialog.getOpenFileNames(
-                self, "请导入骨骼掩膜", self.cwd, "nii Files (*.nii.gz)")
+                self, "请导入骨骼掩膜", self.cwd, mask_file_filter())
             if self.skeleton_mask_path == []:  # 没选择时返回
                 return
             
@@ -1052,7 +1156,7 @@ class MainWindow(QMainWindow, Ui_MainWindow):
             self.info_list[2] = "正在进行骨骼分割..."
             self.info.setText("  ".join(self.info_list))
 
-            self.skeleton_mask_path = os.path.join(self.cwd, 'result', 'skeleton_mask.nii.gz')
+            self.skeleton_mask_path = intermediate_path(os.path.join(self.cwd, 'result'), 'skeleton_mask')
 
             self.skeleton_seg_thread = SkeletonSegThread(self.ct_nii_path, self.skeleton_mask_path)
             self.skeleton_seg_thread.finish_signal.connect(self._skeleton_rebuild)
@@ -1076,6 +1180,7 @@ class MainWindow(QMainWindow, Ui_MainWindow):
             self.info.setText("  ".join(self.info_list))
             return
         self.Po_list.append(self.skeleton_polydata)
+        self.Po_mask_list.append(self.skeleton_mask_path)
 
         self.skeleton_slider.valueChanged.connect(self._set_skeleton_opacity)
         self.skeleton_slider.setValue(100)
@@ -1090,6 +1195,45 @@ class MainWindow(QMainWindow, Ui_MainWindow):
         self.skeleton_actor.GetProperty().SetOpacity(self.skeleton_slider.value() / 100)
         self.vtk_view4.GetRenderWindow().Render()
 
+    def _after_nnunet_input(self, callback):
+        """CT复制到 mid_result 后在主线程中调用 callback, CT以链接导入或已复制完成时直接调用
+
+        不在主线程中等待复制: 复制任务完成时(在复制线程中)发送 nnunet_input_signal, 以队列连接在主线程中
+        调用 _nnunet_input_done.
+        """
+
+        future = self.nnunet_input_future
+        if future is None:
+            callback()
+            return
+
+        self.nnunet_input_callbacks.append(callback)
+        if len(self.nnunet_input_callbacks) == 1:
+            self.info.setText("正在复制CT...")
+            future.add_done_callback(self.nnunet_input_signal.emit)
+
+    def _nnunet_input_done(self, future):
+        """槽函数:CT复制完成, 依次调用等待的任务"""
+
+        if future is not self.nnunet_input_future:  # 已导入新的病例
+            return
+        self.nnunet_input_future = None
+        callbacks, self.nnunet_input_callbacks = self.nnunet_input_callbacks, []
+
+        error = future.exception() if not future.cancelled() else None
+        if error is not None:
+            self.tumor_seg_btn.setEnabled(True)
+            self.info.setText("  ".join(self.info_list))
+            error_message = QErrorMessage(self)
+            error_message.setWindowTitle("错误提示")
+            error_message.showMessage("复制CT失败: {}".format(error))
+            error_message.exec_()
+            return
+
+        self.info.setText("  ".join(self.info_list))
+        for callback in callbacks:
+            callback()
+
     def _tumor_seg(self):
         """槽函数:肿瘤分割"""
 
@@ -1105,7 +1249,7 @@ class MainWindow(QMainWindow, Ui_MainWindow):
         # 判断返回结果处理相应事项
         if mb.clickedButton() == import_btn:
             self.tumor_mask_path, _type = QFileDialog.getOpenFileNames(
-                self, "请导入肿瘤掩膜", self.cwd, "nii Files (*.nii.gz)")
+                self, "请导入肿瘤掩膜", self.cwd, mask_file_filter())
             if self.tumor_mask_path == []:  # 没选择时返回
                 return
             
@@ -1119,42 +1263,47 @@ class MainWindow(QMainWindow, Ui_MainWindow):
             self.tumor_seg_btn.setEnabled(False)
             self.info_list[3] = "正在进行肿瘤分割..."
             self.info.setText("  ".join(self.info_list))
-            self.tumor_mask_dir = os.path.join(self.cwd, "result", "tumor")
-            os.makedirs(self.tumor_mask_dir, exist_ok=True)
-
-            model_folder_name = os.path.join(self.cwd,"nnUNet", "nnUNet_trained_models", "nnUNet", "3d_fullres", "Task006_Lung", "nnUNetTrainerV2__nnUNetPlansv2.1")
-            input_folder = os.path.join(self.cwd, "mid_result")
-            # input_folder= 'mid_result'
-            output_folder = self.tumor_mask_dir
-            folds = 0
-            save_npz = None
-            num_threads_preprocessing = 6
-            num_threads_nifti_save = 2
-            lowres_segmentations = None
-            part_id = 0
-            num_parts = 1
-            disable_tta = True
-            overwrite_existing = False
-            mode = "normal"
-            all_in_gpu = False
-            disable_mixed_precision = False
-            step_size = 0.5
-            chk = "model_final_checkpoint"
-
-            predict_from_folder(model_folder_name, input_folder, output_folder, folds, save_npz, num_threads_preprocessing,
-                    num_threads_nifti_save, lowres_segmentations, part_id, num_parts, not disable_tta,
-                    overwrite_existing=overwrite_existing, mode=mode, overwrite_all_in_gpu=all_in_gpu,
-                    mixed_precision=not disable_mixed_precision,
-                    step_size=step_size, checkpoint_name=chk)
-            
-            tumor_file_name = os.listdir(self.tumor_mask_dir)[0]
-            self.tumor_mask_path = os.path.join(self.tumor_mask_dir, tumor_file_name)
-            self._tumor_rebuild(self.tumor_mask_path)
-            # return
+            # CT 还在后台复制时, 复制完成后再开始分割, 不阻塞界面
+            self._after_nnunet_input(self._tumor_auto_seg)
 
         else:
             return
 
+    def _tumor_auto_seg(self):
+        """nnU-Net 自动分割肿瘤, mid_result 中的CT准备好后调用"""
+
+        self.tumor_mask_dir = os.path.join(self.cwd, "result", "tumor")
+        os.makedirs(self.tumor_mask_dir, exist_ok=True)
+
+        model_folder_name = os.path.join(self.cwd,"nnUNet", "nnUNet_trained_models", "nnUNet", "3d_fullres", "Task006_Lung", "nnUNetTrainerV2__nnUNetPlansv2.1")
+        input_folder = os.path.join(self.cwd, "mid_result")
+        # input_folder= 'mid_result'
+        output_folder = self.tumor_mask_dir
+        folds = 0
+        save_npz = None
+        num_threads_preprocessing = runtime_config('nnunet_preprocessing_threads')
+        num_threads_nifti_save = runtime_config('nnunet_save_threads')
+        lowres_segmentations = None
+        part_id = 0
+        num_parts = 1
+        disable_tta = True
+        overwrite_existing = False
+        mode = "normal"
+        all_in_gpu = False
+        disable_mixed_precision = False
+        step_size = 0.5
+        chk = "model_final_checkpoint"
+
+        predict_from_folder(model_folder_name, input_folder, output_folder, folds, save_npz, num_threads_preprocessing,
+                num_threads_nifti_save, lowres_segmentations, part_id, num_parts, not disable_tta,
+                overwrite_existing=overwrite_existing, mode=mode, overwrite_all_in_gpu=all_in_gpu,
+                mixed_precision=not disable_mixed_precision,
+                step_size=step_size, checkpoint_name=chk)
+        
+        tumor_file_name = os.listdir(self.tumor_mask_dir)[0]
+        self.tumor_mask_path = os.path.join(self.tumor_mask_dir, tumor_file_name)
+        self._tumor_rebuild(self.tumor_mask_path)
+
     def _tumor_rebuild(self, tumor_mask_path):
         """槽函数:肿瘤重建"""
 
@@ -1175,9 +1324,9 @@ class MainWindow(QMainWindow, Ui_MainWindow):
         self.tumor_slider.setValue(100)
 
         # 三视图肿瘤掩膜
-        self.tumor_reader = vtk.vtkNIFTIImageReader()
-        self.tumor_reader.SetFileName(self.tumor_mask_path)
-        self.tumor_reader.Update()
+        # 三视图使用 _rebuild 读取的同一份图像(在缓存中), 不再解析文件
+        self.tumor_reader = vtk.vtkTrivialProducer()
+        self.tumor_reader.SetOutput(vtk_nii_reader(self.tumor_mask_path)[1])
 
         color_table = vtk.vtkLookupTable()
         color_table.SetNumberOfColors(2)
@@ -1611,49 +1760,55 @@ class MainWindow(QMainWindow, Ui_MainWindow):
             self.tumor_seg_btn.setEnabled(False)
             self.info_list[5] = "正在进行术后评估..."
             self.info.setText("  ".join(self.info_list))
-            self.tumor_post_mask_dir = os.path.join(self.cwd, "result", "tumor_post")
-            os.makedirs(self.tumor_post_mask_dir, exist_ok=True)
-
-            model_folder_name = os.path.join(self.cwd,"nnUNet", "nnUNet_trained_models", "nnUNet", "3d_fullres", "Task006_Lung", "nnUNetTrainerV2__nnUNetPlansv2.1")
-            input_folder = os.path.join(self.cwd, "mid_result")
-            # input_folder= 'mid_result'
-            output_folder = self.tumor_post_mask_dir
-            folds = 0
-            save_npz = None
-            num_threads_preprocessing = 6
-            num_threads_nifti_save = 2
-            lowres_segmentations = None
-            part_id = 0
-            num_parts = 1
-            disable_tta = True
-            overwrite_existing = False
-            mode = "normal"
-            all_in_gpu = False
-            disable_mixed_precision = False
-            step_size = 0.5
-            chk = "model_final_checkpoint"
-
-            predict_from_folder(model_folder_name, input_folder, output_folder, folds, save_npz, num_threads_preprocessing,
-                    num_threads_nifti_save, lowres_segmentations, part_id, num_parts, not disable_tta,
-                    overwrite_existing=overwrite_existing, mode=mode, overwrite_all_in_gpu=all_in_gpu,
-                    mixed_precision=not disable_mixed_precision,
-                    step_size=step_size, checkpoint_name=chk)
-            
-            tumor_file_name = os.listdir(self.tumor_post_mask_dir)[0]
-            tumor_post_mask_path = os.path.join(self.tumor_post_mask_dir, tumor_file_name)
-            tumor_post_mask = sitk.ReadImage(tumor_post_mask_path)
-            tumor_post_array = sitk.GetArrayFromImage(tumor_post_mask)
-            if np.max(tumor_post_array) > 0:
-                self.eval_result_edit.setText("有病灶残留！")
-                self._tumor_post_rebuild(tumor_post_mask_path)
-            else:
-                self.eval_result_edit.setText("消融完全！")
-            self.info_list[5] = "术后评估完成！"
-            self.info.setText("  ".join(self.info_list))
-            self.tumor_seg_btn.setEnabled(True)
+            # CT 还在后台复制时, 复制完成后再开始评估, 不阻塞界面
+            self._after_nnunet_input(self._post_eval_seg)
         else:
             return
 
+    def _post_eval_seg(self):
+        """nnU-Net 分割术后肿瘤并评估, mid_result 中的CT准备好后调用"""
+
+        self.tumor_post_mask_dir = os.path.join(self.cwd, "result", "tumor_post")
+        os.makedirs(self.tumor_post_mask_dir, exist_ok=True)
+
+        model_folder_name = os.path.join(self.cwd,"nnUNet", "nnUNet_trained_models", "nnUNet", "3d_fullres", "Task006_Lung", "nnUNetTrainerV2__nnUNetPlansv2.1")
+        input_folder = os.path.join(self.cwd, "mid_result")
+        # input_folder= 'mid_result'
+        output_folder = self.tumor_post_mask_dir
+        folds = 0
+        save_npz = None
+        num_threads_preprocessing = runtime_config('nnunet_preprocessing_threads')
+        num_threads_nifti_save = runtime_config('nnunet_save_threads')
+        lowres_segmentations = None
+        part_id = 0
+        num_parts = 1
+        disable_tta = True
+        overwrite_existing = False
+        mode = "normal"
+        all_in_gpu = False
+        disable_mixed_precision = False
+        step_size = 0.5
+        chk = "model_final_checkpoint"
+
+        predict_from_folder(model_folder_name, input_folder, output_folder, folds, save_npz, num_threads_preprocessing,
+                num_threads_nifti_save, lowres_segmentations, part_id, num_parts, not disable_tta,
+                overwrite_existing=overwrite_existing, mode=mode, overwrite_all_in_gpu=all_in_gpu,
+                mixed_precision=not disable_mixed_precision,
+                step_size=step_size, checkpoint_name=chk)
+        
+        tumor_file_name = os.listdir(self.tumor_post_mask_dir)[0]
+        tumor_post_mask_path = os.path.join(self.tumor_post_mask_dir, tumor_file_name)
+        tumor_post_mask = sitk.ReadImage(tumor_post_mask_path)
+        tumor_post_array = sitk.GetArrayFromImage(tumor_post_mask)
+        if np.max(tumor_post_array) > 0:
+            self.eval_result_edit.setText("有病灶残留！")
+            self._tumor_post_rebuild(tumor_post_mask_path)
+        else:
+            self.eval_result_edit.setText("消融完全！")
+        self.info_list[5] = "术后评估完成！"
+        self.info.setText("  ".join(self.info_list))
+        self.tumor_seg_btn.setEnabled(True)
+
     def _tumor_post_rebuild(self, tumor_post_mask_path):
         """槽函数:肿瘤重建"""
 
@@ -1673,9 +1828,8 @@ class MainWindow(QMainWindow, Ui_MainWindow):
         self.tumor_slider.setValue(100)
 
         # 三视图肿瘤掩膜
-        self.tumor_reader = vtk.vtkNIFTIImageReader()
-        self.tumor_reader.SetFileName(tumor_post_mask_path)
-        self.tumor_reader.Update()
+        self.tumor_reader = vtk.vtkTrivialProducer()
+        self.tumor_reader.SetOutput(vtk_nii_reader(tumor_post_mask_path)[1])
 
         color_table = vtk.vtkLookupTable()
         color_table.SetNumberOfColors(2)
@@ -1751,13 +1905,13 @@ class MainWindow(QMainWindow, Ui_MainWindow):
 
     def _tumor_eval(self):
         label1_path, _type = QFileDialog.getOpenFileNames(
-                self, "请选择术前肿瘤掩膜", self.cwd, "nii Files (*.nii.gz)")
+                self, "请选择术前肿瘤掩膜", self.cwd, mask_file_filter())
         if label1_path == []:  # 没选择时返回
             return
         label1_path = label1_path[0]  # 取路径
 
         label2_path, _type = QFileDialog.getOpenFileNames(
-            self, "请选择术后肿瘤掩膜", self.cwd, "nii Files (*.nii.gz)")
+            self, "请选择术后肿瘤掩膜", self.cwd, mask_file_filter())
 
         if label2_path == []:  # 没选择时返回
             return
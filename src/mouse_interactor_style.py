@@ -4,6 +4,7 @@ from PyQt5.QtWidgets import QMessageBox
 
 from vtkmodules.vtkInteractionStyle import vtkInteractorStyleTrackballCamera
 from src.seg import LungTracheaSegThread
+from utils.storage import intermediate_path
 
 class MouseInteractorStyle1(vtkInteractorStyleTrackballCamera):
     """view1鼠标交互"""
@@ -250,9 +251,10 @@ class MouseInteractorStyle3(vtkInteractorStyleTrackballCamera):
 
                 self.lung_trachea_seed = [int(self.main_win.x_pixel_edit.text()), int(self.main_win.y_pixel_edit.text()), int(self.main_win.z_pixel_edit.text())]
                 # print(self.lung_trachea_seed)
-                self.main_win.lung_mask_path = os.path.join(self.main_win.cwd, 'result', 'lung_mask.nii.gz')
-                self.main_win.trachea_mask_path = os.path.join(self.main_win.cwd, 'result', 'trachea_mask.nii.gz')
-                self.main_win.lung_trachea_mask_path = os.path.join(self.main_win.cwd, 'result', 'lung_trachea_mask.nii.gz')
+                result_dir = os.path.join(self.main_win.cwd, 'result')
+                self.main_win.lung_mask_path = intermediate_path(result_dir, 'lung_mask')
+                self.main_win.trachea_mask_path = intermediate_path(result_dir, 'trachea_mask')
+                self.main_win.lung_trachea_mask_path = intermediate_path(result_dir, 'lung_trachea_mask')
                 self.lung_trachea_seg_thread = LungTracheaSegThread(self.lung_trachea_seed, self.main_win.ct_nii_path, self.main_win.lung_mask_path, self.main_win.trachea_mask_path, self.main_win.lung_trachea_mask_path)  # 实例化肺分割线程, 可传参数
                 self.lung_trachea_seg_thread.finish_signal.connect(self.main_win._lung_trachea_rebuild)  # 将线程_lung_seg_thread的信号finish_signal和主线程中的槽函数_lung_trachea_rebuild进行连接
                 self.lung_trachea_seg_thread.start()  # 启动肺分割线程，执行线程类中run函数
@@ -1,10 +1,17 @@
-import itk
-import copy
+import multiprocessing
 import numpy as np
 import SimpleITK as sitk
 from skimage import measure
-import skimage
+from concurrent.futures import ProcessPoolExecutor
 from PyQt5.QtCore import QThread, pyqtSignal
+from utils.region_grow import region_growing, threshold_sweep
+from utils.connected_component import label_components, component_sizes, apply_label_table
+from utils.connected_component import remove_small_components, keep_largest_components
+from utils.shared_volume import SharedVolume
+from utils.vesselness import vesselness_mask
+from utils.storage import write_image, write_image_async
+from utils.volume_cache import volume_cache
+from utils.runtime_config import runtime_config, pool_workers, pool_initargs, init_pool_worker
 
 
 # 窗宽窗位调整
@@ -25,125 +32,154 @@ def window_intensity(itk_image,hu_min, hu_max):
 
     return ww_filter.Execute(itk_image)
 
+def read_image(image):
+    """
+    读取图像, 已经读取的图像直接返回, 文件通过 volume_cache 读取, 一次会话中只解码一次
+    :param image: 图像路径或 SimpleITK 图像
+    :return: SimpleITK 图像
+    """
+
+    if isinstance(image, sitk.Image):
+        return image
+    return volume_cache.read_image(image)
+
+
 # 去除小区域
-def remove_small_region(input_img, remove_size=256):
+def remove_small_region(input_img, remove_size=256, connectivity=18):
+    """
+    去除体素个数小于 remove_size 的连通域
+    :param input_img: 二值掩膜图像
+    :param remove_size: 保留连通域的最小体素个数
+    :param connectivity: 邻域连通方式, 6, 18 或 26
+    :return: 去除小区域后的掩膜图像, uint8
+    """
 
-    input_ar = sitk.GetArrayFromImage(input_img)
-    output_ar = copy.deepcopy(input_ar)
+    # 只读视图, 不复制
+    input_ar = sitk.GetArrayViewFromImage(input_img)
+    print("volarray_sum:", np.count_nonzero(input_ar))
 
+    output_ar, num, keep_num = remove_small_components(input_ar, remove_size, connectivity)
+    print(num, '->', keep_num)
 
-    print("volarray_sum:", sum(sum(sum(input_ar))))
+    l = sitk.GetImageFromArray(output_ar)
+    l.CopyInformation(input_img)
 
-    label = skimage.measure.label(input_ar, connectivity=2)
+    return l
 
-    props = skimage.measure.regionprops(label)
-    print(len(props))
-    numPix = []
-    for ia in range(len(props)):
-        numPix += [props[ia].area]
 
-    numPix_ar = np.array(numPix)
-    index = np.squeeze(np.array(np.where(numPix_ar < remove_size)))
+def body_mask_seg(threshold):
+    """
+    身体掩膜分割, 从图像角点出发填充体外空气, 剩下的部分即为身体(包括床板)
+    :param threshold: 二值化后的图像, 空气为0
+    :return: 身体掩膜, 身体部分为1
+    """
 
-    for ind in index:
-        output_ar[label==ind+1] = 0
+    size = threshold.GetSize()
 
-    l = sitk.GetImageFromArray(output_ar)
-    l.SetSpacing(input_img.GetSpacing())
-    l.SetOrigin(input_img.GetOrigin())
-    l.SetDirection(input_img.GetDirection())
-    
+    # 利用种子生成算法，填充空气
+    ConnectedThresholdImageFilter = sitk.ConnectedThresholdImageFilter()
+    ConnectedThresholdImageFilter.SetLower(0)
+    ConnectedThresholdImageFilter.SetUpper(0)
+    ConnectedThresholdImageFilter.SetSeedList([(0,0,0),(size[0]-1,size[1]-1,0)])
 
-    return l
+    # 得到body的mask，此时body部分是0，所以反转一下
+    bodymask = ConnectedThresholdImageFilter.Execute(threshold)
+    bodymask = sitk.ShiftScale(bodymask,-1,-1)
+
+    return bodymask
+
+
+def airways_roi(lung_image, seed, num=-450, margin=10):
+    """
+    气管分割的感兴趣区域: 身体内部空气(肺和气管)的包围盒
+    :param lung_image: CT图像
+    :param seed: 气管种子点, xyz
+    :param num: 空气的CT值上限
+    :param margin: 包围盒向外扩展的体素个数
+    :return: 包围盒的起点和终点(不含), xyz
+    """
+
+    size = lung_image.GetSize()
+
+    # 身体内部的空气
+    threshold = lung_image >= num
+    air = sitk.And(body_mask_seg(threshold), sitk.Not(threshold))
+
+    stats = sitk.LabelShapeStatisticsImageFilter()
+    stats.Execute(air)
+    if not stats.HasLabel(1):
+        return (0, 0, 0), tuple(size)
+
+    bbox = stats.GetBoundingBox(1)  # x, y, z, size_x, size_y, size_z
+    lower = [max(min(bbox[i], seed[i]) - margin, 0) for i in range(3)]
+    upper = [min(max(bbox[i] + bbox[i + 3], seed[i] + 1) + margin, size[i]) for i in range(3)]
+
+    return tuple(lower), tuple(upper)
 
 
 def lung_cu_seg(img_path, remove_block=None):
+    """
+    肺部粗分割, 中间结果只使用 uint8/bool, 连通域标记使用 int32
+    :param img_path: CT图像路径或已经读取的 SimpleITK 图像
+    :param remove_block: 未使用, 是否分割成床板由最大连通域的重心自动判断
+    :return: 肺部掩膜, uint8
+    """
 
-    lung_img = sitk.ReadImage(img_path)
+    lung_img = read_image(img_path)
 
-    # 获取体数据的尺寸
-    size = sitk.Image(lung_img).GetSize()
     # 获取体数据direction
-    direction = sitk.Image(lung_img).GetDirection()
+    direction = lung_img.GetDirection()
     # 获取体数据的空间尺寸
-    spacing = sitk.Image(lung_img).GetSpacing()
+    spacing = lung_img.GetSpacing()
     # 获得体数据的oringin
-    oringin = sitk.Image(lung_img).GetOrigin()
-    # 将体数据转为numpy数组
-    volarray = sitk.GetArrayFromImage(lung_img)
+    oringin = lung_img.GetOrigin()
 
     # 根据CT值，将数据二值化（一般来说 -450 以下是空气的CT值）
     num = -450  # 根据CT图像进行微调
-    volarray[volarray>=num]=1
-    volarray[volarray<=num]=0
+    threshold = lung_img >= num  # uint8, 保留原图的spacing, origin, direction
+    del lung_img  # 之后只用到二值图像
 
-    # 生成阈值图像
-    threshold = sitk.GetImageFromArray(volarray)
-    threshold.SetSpacing(spacing)
+    # 得到body的mask
+    bodymask = body_mask_seg(threshold)
 
-    # 利用种子生成算法，填充空气
-    ConnectedThresholdImageFilter = sitk.ConnectedThresholdImageFilter()
-    ConnectedThresholdImageFilter.SetLower(0)
-    ConnectedThresholdImageFilter.SetUpper(0)
-    ConnectedThresholdImageFilter.SetSeedList([(0,0,0),(size[0]-1,size[1]-1,0)])
-    
-    # 得到body的mask，此时body部分是0，所以反转一下
-    bodymask = ConnectedThresholdImageFilter.Execute(threshold)
-    bodymask = sitk.ShiftScale(bodymask,-1,-1)
-    
     # 用bodymask减去threshold，得到初步的lung的mask
-    temp_array = sitk.GetArrayFromImage(bodymask)-sitk.GetArrayFromImage(threshold)
-    # temp_array.dtype = np.int16 #np.int16 # # 512 -> 1024
-    temp = sitk.GetImageFromArray(temp_array)
-    temp = sitk.Cast(temp, sitk.sitkInt16)
-    temp.SetSpacing(spacing)
-    
+    temp = sitk.And(bodymask, sitk.Not(threshold))
+    del bodymask, threshold
+
     # 利用形态学来去掉一定的肺部的小区域
     bm = sitk.BinaryMorphologicalClosingImageFilter()
     bm.SetKernelType(sitk.sitkBall)
     bm.SetKernelRadius(4) # 微调参数可以消除未分割到的肺部小区域
     bm.SetForegroundValue(1)
     lungmask = bm.Execute(temp)
-    
-    # 利用measure来计算连通域
-    lungmaskarray = sitk.GetArrayFromImage(lungmask)
-    label = measure.label(lungmaskarray, connectivity=2)
-    label1 = copy.deepcopy(label)
-    props = measure.regionprops(label)
-
-    # 计算每个连通域的体素的个数
-    numPix = []
-    for ia in range(len(props)):
-        numPix += [props[ia].area]
-    
-    # 最大连通域的体素个数，也就是肺部
-    # 遍历每个连通区域
-    index = np.argmax(numPix)
+    del temp
 
-    # if remove_block == 1:
-    #     numPix[index]=0 # 去掉最大的index
-    #     index = np.argmax(numPix)
+    # 计算连通域, 只读视图, 不复制
+    lungmaskarray = sitk.GetArrayViewFromImage(lungmask)
+    label, label_num = label_components(lungmaskarray, connectivity=18)
+    del lungmaskarray, lungmask
 
-    label[label!=index+1]=0
-    label[label==index+1]=1
-    
-    label = label.astype("int16")
+    # 计算每个连通域的体素的个数
+    numPix = component_sizes(label, label_num)
+    numPix[0] = 0
 
-    rows, cols, slices = label.nonzero()
-    # x = rows.mean()
-    y = cols.mean()
-    # z = slices.mean()
+    # 最大连通域的体素个数，也就是肺部
+    index = int(np.argmax(numPix))
 
-    # 自动判断是否分割成床板
+    # 自动判断是否分割成床板, 重心由连通域属性计算, 只访问该连通域的包围盒
+    # 不用 centroid 属性, 避免生成 体素数x3 的坐标数组
+    region = measure.regionprops(label)[index - 1]
+    y = region.bbox[1] + np.average(np.arange(region.image.shape[1]), weights=region.image.sum(axis=(0, 2)))
     if y > label.shape[1]*0.667:
         print("need remove block")
         numPix[index]=0 # 去掉最大的index
-        index = np.argmax(numPix)
-        label1[label1!=index+1]=0 
-        label1[label1==index+1]=1
-        label = label1.astype("int16")
+        index = int(np.argmax(numPix))
 
-    l = sitk.GetImageFromArray(label)
+    keep = np.zeros(label_num + 1, dtype=bool)
+    keep[index] = True
+    lung_arr = apply_label_table(label, keep)
+    del label
+    l = sitk.GetImageFromArray(lung_arr)
     l.SetSpacing(spacing)
     l.SetOrigin(oringin)
     l.SetDirection(direction)
@@ -157,74 +193,21 @@ def regionGrowing(grayImg, seed, threshold):
     :param grayImg: 灰度图像
     :param seed: 生长起始点的位置
     :param threshold: 阈值
-    :return: 取值为{0, 255}的二值图像
+    :return: 取值为{0, 1}的二值图像, 生长点个数
     """
 
-    [maxX, maxY,maxZ] = grayImg.shape[0:3]
-
-    # 用于保存生长点的队列
-    pointQueue = []
-    pointQueue.append((seed[0], seed[1],seed[2])) # 保存种子点
-    outImg = np.zeros_like(grayImg)
-    outImg[seed[0], seed[1], seed[2]] = 1
-
-    pointsNum = 1
-    pointsMean = float(grayImg[seed[0], seed[1],seed[2]])
-
-    # 用于计算生长点周围26个点的位置
-    Next26 = [[-1, -1, -1],[-1, 0, -1],[-1, 1, -1],
-                [-1, 1, 0], [-1, -1, 0], [-1, -1, 1],
-                [-1, 0, 1], [-1, 0, 0],[-1, 0, -1],
-                [0, -1, -1], [0, 0, -1], [0, 1, -1],
-                [0, 1, 0],[-1, 0, -1],
-                [0, -1, 0],[0, -1, 1],[-1, 0, -1],
-                [0, 0, 1],[1, 1, 1],[1, 1, -1],
-                [1, 1, 0],[1, 0, 1],[1, 0, -1],
-                [1, -1, 0],[1, 0, 0],[1, -1, -1]]
-
-    while(len(pointQueue)>0):
-        # 取出队首并删除
-        growSeed = pointQueue[0]
-        del pointQueue[0]
-
-        for differ in Next26:
-            growPointx = growSeed[0] + differ[0]
-            growPointy = growSeed[1] + differ[1]
-            growPointz = growSeed[2] + differ[2]
-
-            # 是否是边缘点
-            if((growPointx < 0) or (growPointx > maxX - 1) or
-               (growPointy < 0) or (growPointy > maxY - 1) or (growPointz < 0) or (growPointz > maxZ - 1)) :
-                continue
-
-            # 是否已经被生长
-            if(outImg[growPointx,growPointy,growPointz] == 1):
-                continue
-
-            data = grayImg[growPointx,growPointy,growPointz]
-            # 判断条件
-            # 符合条件则生长，并且加入到生长点队列中
-            if(abs(data - pointsMean)<threshold):
-                pointsNum += 1
-                pointsMean = (pointsMean * (pointsNum - 1) + data) / pointsNum
-                outImg[growPointx, growPointy,growPointz] = 1
-                pointQueue.append([growPointx, growPointy,growPointz])
-            
-            # 李文豪没改完
-            # if pointsNum > 50000:
-            #     break
-
-    return outImg, pointsNum 
-
-
-def regionGrowing_v2(grayImg, seed, open_grow_mode = None):
+    # 按层批量生长, 见 utils.region_grow
+    return region_growing(grayImg, seed, threshold)
+
+
+def regionGrowing_v2(grayImg, seed, open_grow_mode = None, max_points = 100000):
     """
     寻找最佳阈值
     :param grayImg: 灰度图像
     :param seed: 生长起始点的位置
-    :param threshold: 阈值
     :param open_grow_mode: 防止一些气管分割提前停止生长，导致效果不好，可以说是放开生长模式
-    :return: 取值为{0, 255}的二值图像
+    :param max_points: 生长点数上限，超过则认为已经泄漏，气管一般不会超过这么大的像素个数
+    :return: 最佳阈值, 最佳阈值下取值为{0, 1}的二值图像, 生长点个数
     """
 
     if open_grow_mode is not None:
@@ -233,106 +216,46 @@ def regionGrowing_v2(grayImg, seed, open_grow_mode = None):
         pointsnum_min = 15000
     pointsnum_min = 20000
 
-    threshold = 0
-    Lt = 0
-    old_point_num = 1
-    seg_start = 0 #第一次生成模式，一般都会有超过0.9以上的增加率
-    while(True): # 阈值大循环
-        [maxX, maxY,maxZ] = grayImg.shape[0:3]
-
-        # 用于保存生长点的队列
-        pointQueue = []
-        pointQueue.append((seed[0], seed[1],seed[2])) # 保存种子点
-        outImg = np.zeros_like(grayImg)
-        outImg[seed[0], seed[1],seed[2]] = 1
-
-        pointsNum = 1
-        pointsMean = float(grayImg[seed[0], seed[1],seed[2]])
-
-        # 用于计算生长点周围26个点的位置
-        Next26 = [[-1, -1, -1],[-1, 0, -1],[-1, 1, -1],
-                    [-1, 1, 0], [-1, -1, 0], [-1, -1, 1],
-                    [-1, 0, 1], [-1, 0, 0],[-1, 0, -1],
-                    [0, -1, -1], [0, 0, -1], [0, 1, -1],
-                    [0, 1, 0],[-1, 0, -1],
-                    [0, -1, 0],[0, -1, 1],[-1, 0, -1],
-                    [0, 0, 1],[1, 1, 1],[1, 1, -1],
-                    [1, 1, 0],[1, 0, 1],[1, 0, -1],
-                    [1, -1, 0],[1, 0, 0],[1, -1, -1]]
-
-        # 给定阈值后一个生长循环
-        while(len(pointQueue)>0):
-            # 取出队首并删除
-            growSeed = pointQueue[0]
-            del pointQueue[0]
-
-            for differ in Next26:
-                growPointx = growSeed[0] + differ[0]
-                growPointy = growSeed[1] + differ[1]
-                growPointz = growSeed[2] + differ[2]
-
-                # 是否是边缘点
-                if((growPointx < 0) or (growPointx > maxX - 1) or
-                (growPointy < 0) or (growPointy > maxY - 1) or (growPointz < 0) or (growPointz > maxZ - 1)) :
-                    continue
-
-                # 是否已经被生长
-                if(outImg[growPointx,growPointy,growPointz] == 1):
-                    continue
-
-                data = grayImg[growPointx,growPointy,growPointz] # 该点的像素值
-                # 判断条件
-                # 符合条件则生长，并且加入到生长点队列中
-                if(abs(data - pointsMean)<threshold):
-                    pointsNum += 1
-                    pointsMean = (pointsMean * (pointsNum - 1) + data) / pointsNum
-                    outImg[growPointx, growPointy,growPointz] = 1
-                    pointQueue.append([growPointx, growPointy,growPointz])
-                if pointsNum > 150000:
-                    break
-
-        add_pointsNum = pointsNum - old_point_num
-        Lt = add_pointsNum / pointsNum
-
-
-        print("threshold:", threshold, "Lt:", Lt, 'pointsNum:', pointsNum)
-        if (Lt > 0.1  and seg_start == 1 and old_point_num > pointsnum_min ) or pointsNum > 100000:
-            # pointsNum > 150000 气管一般不会超过这么大的像素个数
-            # 150000可以说是气管的上限。
-            # 27000为气管的下限
-            # print("the best threshold is :", threshold)
-            break
-        else:
-            threshold += 1
-            old_point_num = pointsNum
-
-            # 避免第一次有效生长导致停止
-            if Lt > 0.9 :
-                seg_start = 1
-
-    return threshold - 1
+    # 一次遍历按所需阈值由小到大生长, 同时得到停止的阈值和掩膜, 见 utils.region_grow.threshold_sweep
+    threshold, outImg, pointsNum, _ = threshold_sweep(grayImg, seed,
+                                                      max_points=max_points,
+                                                      pointsnum_min=pointsnum_min)
+
+    return threshold, outImg, pointsNum
 
 
 def airways_seg(image_path,
                 output_path,
                 seed = (236, 201, 252),
                 threshold = 10,
-                open_grow_mode = None):
+                open_grow_mode = None,
+                max_points = 100000):
     '''
     使用一个定点
     还有阈值
+    image_path 可以是CT图像路径或已经读取的 SimpleITK 图像
+    max_points 为生长点数上限, 超过则认为已经泄漏, 取上一个阈值
     '''
 
-    lung_image = sitk.ReadImage(image_path)
-    lung_arr = sitk.GetArrayFromImage(lung_image) # zyx
-    lung_arr_T = lung_arr.transpose((2, 1, 0)) # zyx => xyz
+    lung_image = read_image(image_path)
+    lung_arr = sitk.GetArrayViewFromImage(lung_image) # zyx, 只读视图
 
+    # 只在身体内部空气的包围盒内生长, 去掉床板、体外空气等区域
+    lower, upper = airways_roi(lung_image, seed)
+    roi_arr = lung_arr[lower[2]:upper[2], lower[1]:upper[1], lower[0]:upper[0]]
+    roi_arr_T = roi_arr.transpose((2, 1, 0)) # zyx => xyz
+    roi_seed = [seed[i] - lower[i] for i in range(3)]
+    print('airways roi:', lower, upper)
 
-    # 临近像素的阈值，微调可以减少误分割，和少分割 阈值越小，mask越小，默认50，需要动态设置阈值才好
-    threshold = regionGrowing_v2(lung_arr_T, seed, open_grow_mode = open_grow_mode)
+    # 临近像素的阈值，微调可以减少误分割，和少分割 阈值越小，mask越小，需要动态设置阈值才好
+    threshold, roi_img_T, pointsNum = regionGrowing_v2(roi_arr_T, roi_seed,
+                                                       open_grow_mode = open_grow_mode,
+                                                       max_points = max_points)
     print('select threshold:', threshold)
-    trachea_img_T, pointsNum = regionGrowing(lung_arr_T, seed, threshold)
-    trachea_img = trachea_img_T.transpose((2, 1, 0)) # xyz => zyx
+
+    # 放回原图大小
+    trachea_img = np.zeros(lung_arr.shape, dtype=np.uint8)
+    trachea_img[lower[2]:upper[2], lower[1]:upper[1], lower[0]:upper[0]] = roi_img_T.transpose((2, 1, 0)) # xyz => zyx
 
     print('the number of pointsNum: ', pointsNum)
 
@@ -344,7 +267,7 @@ def airways_seg(image_path,
     # 闭运算填充与连接
     sitk_airways = sitk.BinaryMorphologicalClosing(pred != 0, [5,5,5])
 
-    sitk.WriteImage(sitk_airways, output_path)
+    write_image(sitk_airways, output_path)
 
     return sitk_airways
 
@@ -371,48 +294,86 @@ def MorphologicalOperation(sitk_maskimg, kernelsize, name='open'):
         return morphoimage
 
 
-def GetLargestConnectedCompont(binarysitk_image):
+def _airways_seg_worker(ct_volume, airways_volume, trachea_mask_path, seed, max_points=100000):
+    """
+    子进程: 气管分割, 结果写入共享内存
+    """
+
+    try:
+        airways_image = airways_seg(ct_volume.to_image(), trachea_mask_path, seed=seed, max_points=max_points)
+        airways_volume.array[...] = sitk.GetArrayViewFromImage(airways_image)
+    finally:
+        ct_volume.close()
+        airways_volume.close()
+
+
+def _lung_cu_seg_worker(ct_volume, lung_volume):
+    """
+    子进程: 肺部粗分割, 结果写入共享内存
+    """
+
+    try:
+        lung_image = lung_cu_seg(ct_volume.to_image(), remove_block=0)
+        lung_volume.array[...] = sitk.GetArrayViewFromImage(lung_image)
+    finally:
+        ct_volume.close()
+        lung_volume.close()
+
+
+def lung_trachea_seg(ct_nii_path, seed, lung_mask_path, trachea_mask_path, lung_trachea_mask_path,
+                     max_points=100000):
     """
-    save largest object
-    :param sitk_maskimg:binary itk image
-    :return: largest region binary image
+    肺和气管分割
+    CT只解码一次, 通过共享内存传给两个子进程, 气管分割和肺部粗分割并行执行, 最后合并
+    :param ct_nii_path: CT图像路径
+    :param seed: 气管种子点, xyz
+    :param lung_mask_path: 肺掩膜保存路径
+    :param trachea_mask_path: 气管掩膜保存路径
+    :param lung_trachea_mask_path: 肺+气管掩膜保存路径
+    :param max_points: 气管生长点数上限, 见 airways_seg
     """
-    cc = sitk.ConnectedComponent(binarysitk_image)
-    stats = sitk.LabelIntensityStatisticsImageFilter()
-    stats.SetGlobalDefaultNumberOfThreads(8)
-    stats.Execute(cc, binarysitk_image)
-    maxlabel = 0
-    maxsize = 0
-    size_list = []
-    for l in stats.GetLabels():
-        size = stats.GetPhysicalSize(l)
-        size_list.append(size)
-        if maxsize < size:
-            maxlabel = l
-            maxsize = size
-    labelmaskimage = sitk.GetArrayFromImage(cc) # 带label不同值的mask
-
-
-    outmask = labelmaskimage.copy()
-    outmask[labelmaskimage == maxlabel] = 1
-    outmask[labelmaskimage != maxlabel] = 0
-
-
-    outmask_sitk = sitk.GetImageFromArray(outmask)
-    outmask_sitk.SetDirection(binarysitk_image.GetDirection())
-    outmask_sitk.SetSpacing(binarysitk_image.GetSpacing())
-    outmask_sitk.SetOrigin(binarysitk_image.GetOrigin())
-    return outmask_sitk
+
+    ct_volume = SharedVolume.from_image(read_image(ct_nii_path))
+    airways_volume = SharedVolume.create(ct_volume.shape, np.uint8, **ct_volume.geometry())
+    lung_volume = SharedVolume.create(ct_volume.shape, np.uint8, **ct_volume.geometry())
+
+    try:
+        # spawn 启动子进程, 避免在已有 ITK/Qt 线程的进程中 fork
+        ctx = multiprocessing.get_context('spawn')
+        workers = pool_workers(2)
+        with ProcessPoolExecutor(max_workers=workers, mp_context=ctx, initializer=init_pool_worker,
+                                 initargs=pool_initargs(workers)) as executor:
+            airways_future = executor.submit(_airways_seg_worker, ct_volume, airways_volume, trachea_mask_path,
+                                             tuple(int(s) for s in seed), max_points)
+            lung_future = executor.submit(_lung_cu_seg_worker, ct_volume, lung_volume)
+            airways_future.result()
+            lung_future.result()
+
+        lung_image = lung_volume.to_image()
+        volume_cache.write_image(lung_image, lung_trachea_mask_path) # 保存分割的(肺+气管)
+
+        lung_volume.array[airways_volume.array==1] = 0
+        lung_mask_image = lung_volume.to_image()
+
+        # 开运算去毛刺
+        lung_mask_image = sitk.BinaryMorphologicalOpening(lung_mask_image != 0, [5,5,5])
+        volume_cache.write_image(lung_mask_image, lung_mask_path) # 保存分割的肺
+    finally:
+        ct_volume.unlink()
+        airways_volume.unlink()
+        lung_volume.unlink()
 
 
 class LungTracheaSegThread(QThread):
     """肺分割线程"""
 
     finish_signal = pyqtSignal(bool)  # 使用自定义信号和主线程通讯, 参数是发送信号时附带参数的数据类型
-    def __init__(self, seed, ct_nii_path, lung_mask_path, trachea_mask_path, lung_trachea_mask_path, remove_block=None):
+    def __init__(self, seed, ct_nii_path, lung_mask_path, trachea_mask_path, lung_trachea_mask_path, remove_block=None,
+                 max_points=100000):
         super(LungTracheaSegThread, self).__init__()
 
         self.seed = seed
+        self.max_points = max_points  # 气管生长点数上限
         self.ct_nii_path = ct_nii_path
         self.lung_mask_path = lung_mask_path
         self.trachea_mask_path = trachea_mask_path
@@ -422,124 +383,105 @@ class LungTracheaSegThread(QThread):
     def run(self):
         """线程执行函数"""
 
-        airways_image = airways_seg(image_path=self.ct_nii_path,
-                                    output_path=self.trachea_mask_path,
-                                    seed=self.seed)
-        
-        lung_image = lung_cu_seg(img_path=self.ct_nii_path, remove_block=0)
-
-        lung_arr = sitk.GetArrayFromImage(lung_image)
-        airways_arr = sitk.GetArrayFromImage(airways_image)
+        lung_trachea_seg(self.ct_nii_path, self.seed, self.lung_mask_path, self.trachea_mask_path,
+                         self.lung_trachea_mask_path, max_points=self.max_points)
 
-        # print(lung_arr.shape, airways_arr.shape)
-        lung_arr[airways_arr==1] = 0
-
-        lung_mask_image = sitk.GetImageFromArray(lung_arr)
-        lung_mask_image.SetSpacing(lung_image.GetSpacing())
-        lung_mask_image.SetDirection(lung_image.GetDirection())
-        lung_mask_image.SetOrigin(lung_image.GetOrigin())
+        self.finish_signal.emit(True)  # 向主线程传递自动分割信号
 
-        # 开运算去毛刺
-        lung_mask_image = sitk.BinaryMorphologicalOpening(lung_mask_image != 0, [5,5,5])
 
-        sitk.WriteImage(lung_image, self.lung_trachea_mask_path) # 保存分割的(肺+气管)
-        sitk.WriteImage(lung_mask_image, self.lung_mask_path) # 保存分割的肺
+def vessel_postprocess(vessel_image, lung_mask, remove_size=256):
+    """
+    血管掩膜后处理, 全部在内存中完成: 闭运算, 限制在肺内, 去除小区域
+    :param vessel_image: 血管掩膜
+    :param lung_mask: 肺掩膜(腐蚀后)
+    :param remove_size: 保留连通域的最小体素个数
+    :return: 血管掩膜, uint8
+    """
 
-        self.finish_signal.emit(True)  # 向主线程传递自动分割信号
+    # vessel = MorphologicalOperation(vessel, kernelsize=2, name='close') # 等价以下函数
+    vessel = sitk.BinaryMorphologicalClosing(vessel_image != 0)
+    vessel = sitk.And(vessel, lung_mask != 0)
+    return remove_small_region(vessel, remove_size)
 
 
 class VesselSegThread(QThread):
-    """血管分割线程"""
+    """血管分割线程
+
+    默认与原实现相同: ITK 多尺度 Hessian 血管性测度, sigma 为 2 的单一尺度. multi_scale 为 True 时用增量高斯
+    尺度空间计算 sigma 1~4 的 5 个尺度(见 utils.vesselness.scale_space_objectness), 兼顾细小和粗大的血管,
+    但 Hessian 用 NumPy 中心差分近似 ITK 的递归高斯导数(同一尺度下与 ITK 结果的 Dice 约 0.97), 且尺度范围
+    不同, 输出的血管掩膜与默认设置不同(benchmark.bench_vesselness 的体模中肺内血管体素为 12368, 默认为 13978).
+    """
 
     finish_signal = pyqtSignal(str)  # 使用自定义信号和主线程通讯, 参数是发送信号时附带参数的数据类型
-    def __init__(self, ct_nii_path, lung_mask_path, vessel_mask_path):
+    def __init__(self, ct_nii_path, lung_mask_path, vessel_mask_path, async_write=False, multi_scale=None):
         super(VesselSegThread, self).__init__()
 
         self.ct_nii_path = ct_nii_path
         self.lung_mask_path = lung_mask_path
         self.vessel_mask_path = vessel_mask_path
+        self.async_write = async_write  # 为 True 时在后台线程写文件, 写完后再发送信号
+        # 为 True 时用增量高斯尺度空间计算多个尺度, 为 None 时使用运行配置 vessel_multi_scale
+        if multi_scale is None:
+            multi_scale = bool(runtime_config('vessel_multi_scale'))
+        self.multi_scale = multi_scale
 
     def run(self):
         """线程执行函数"""
 
-        self.vessle_segment(self.ct_nii_path, self.vessel_mask_path)
-
-        sitk_mask = sitk.ReadImage(self.lung_mask_path)
+        sitk_mask = read_image(self.lung_mask_path)
         kernel_size = 4
         new_sitk_mask = sitk.BinaryErode(sitk_mask != 0, [kernel_size, kernel_size, kernel_size])
 
-        vessel = sitk.ReadImage(self.vessel_mask_path)
-        # vessel = MorphologicalOperation(vessel, kernelsize=2, name='close') # 等价以下函数
-        vessel = sitk.BinaryMorphologicalClosing(vessel != 0)
-        new_vessel_mask = self.get_mask_image(vessel, new_sitk_mask, 0)
-        new_vessel_mask = remove_small_region(new_vessel_mask, 256)
-        sitk.WriteImage(new_vessel_mask, self.vessel_mask_path)
+        # 只在腐蚀后的肺的包围盒内计算血管性测度, 结果留在内存中
+        vessel = self.vessle_segment(self.ct_nii_path, new_sitk_mask)
+        new_vessel_mask = vessel_postprocess(vessel, new_sitk_mask, 256)
+
+        # 血管掩膜只在最后写一次, 写完后放入缓存, 重建时不再读取文件
+        if self.async_write:
+            def written(path):
+                volume_cache.put_image(path, new_vessel_mask)
+                self.finish_signal.emit(path)
+            write_image_async(new_vessel_mask, self.vessel_mask_path, callback=written)
+            return
+        volume_cache.write_image(new_vessel_mask, self.vessel_mask_path)
 
         self.finish_signal.emit(self.vessel_mask_path)
 
-    def get_mask_image(self, sitk_src, sitk_mask, replace_value=0):
-        """
-        get mask image
-        :param sitk_src:input image
-        :param sitk_mask:input mask
-        :param replace_value:replace_value of maks value equal 0
-        :return:mask image
-        """
-        array_src = sitk.GetArrayFromImage(sitk_src)
-        array_mask = sitk.GetArrayFromImage(sitk_mask)
-        array_out = array_src.copy()
-        array_out[array_mask == 0] = replace_value
-        outmask_sitk = sitk.GetImageFromArray(array_out)
-        outmask_sitk.SetDirection(sitk_src.GetDirection())
-        outmask_sitk.SetSpacing(sitk_src.GetSpacing())
-        outmask_sitk.SetOrigin(sitk_src.GetOrigin())
-        return outmask_sitk
-
-    def vessle_segment(self, real_lung_path, vessel_mask_path):
+    def vessle_segment(self, real_lung_path, lung_mask=None):
         '''
         分割血管
         :param real_lung_path:实质肺nii.gz
-        :param vessel_mask_path:血管掩膜保存路径名
+        :param lung_mask:肺掩膜, 只在其包围盒内分块计算, 为 None 时计算整幅图像
+        :return:血管掩膜, uint8
         '''
 
         sigma_minimum = 2.
         sigma_maximum = 2.
         number_sigma_steps = 8
         lower_threshold = 40
-
-        input_image = itk.imread(real_lung_path, itk.F)
-        image_type = type(input_image)
-        dimension = input_image.GetImageDimension()
-        hessian_pixel_type = itk.SymmetricSecondRankTensor[itk.D, dimension]
-        hessian_image_type = itk.Image[hessian_pixel_type, dimension]
-        objectness_filter = itk.HessianToObjectnessMeasureImageFilter[hessian_image_type, image_type].New()
-        objectness_filter.SetBrightObject(True)
-        objectness_filter.SetScaleObjectnessMeasure(True)
-        objectness_filter.SetAlpha(0.5)
-        objectness_filter.SetBeta(1.0)
-        objectness_filter.SetGamma(5.0)
-        multi_scale_filter = itk.MultiScaleHessianBasedMeasureImageFilter[image_type, hessian_image_type, image_type].New()
-        multi_scale_filter.SetInput(input_image)
-        multi_scale_filter.SetHessianToMeasureFilter(objectness_filter)
-        multi_scale_filter.SetSigmaStepMethodToLogarithmic()
-        multi_scale_filter.SetSigmaMinimum(sigma_minimum)
-        multi_scale_filter.SetSigmaMaximum(sigma_maximum)
-        multi_scale_filter.SetNumberOfSigmaSteps(number_sigma_steps)
-
-        output_pixel_type = itk.UC
-        output_image_type = itk.Image[output_pixel_type, dimension]
-
-        rescale_filter = itk.RescaleIntensityImageFilter[image_type, output_image_type].New()
-        rescale_filter.SetInput(multi_scale_filter)
-
-        threshold_filter = itk.BinaryThresholdImageFilter[output_image_type, output_image_type].New()
-        threshold_filter.SetInput(rescale_filter.GetOutput())
-        threshold_filter.SetLowerThreshold(lower_threshold)
-        threshold_filter.SetUpperThreshold(255)
-        threshold_filter.SetOutsideValue(0)
-        threshold_filter.SetInsideValue(1)
-
-        itk.imwrite(threshold_filter.GetOutput(), vessel_mask_path)
+        method = 'itk'
+
+        if self.multi_scale:
+            sigma_minimum = 1.
+            sigma_maximum = 4.
+            number_sigma_steps = 5
+            method = 'scale_space'
+
+        report = []
+        input_image = read_image(real_lung_path)
+        vessel_image = vesselness_mask(input_image, lung_mask,
+                                       sigma_minimum=sigma_minimum,
+                                       sigma_maximum=sigma_maximum,
+                                       number_sigma_steps=number_sigma_steps,
+                                       lower_threshold=lower_threshold,
+                                       method=method,
+                                       report=report)
+        for scale in report:
+            print('sigma: %.2f, residual sigma: %.2f, time: %.2fs, memory: %.1fMB'
+                  % (scale['sigma'], scale['residual_sigma'], scale['seconds'], scale['bytes'] / 2 ** 20))
+
+        return vessel_image
 
 
 class SkeletonSegThread(QThread):
@@ -556,7 +498,7 @@ class SkeletonSegThread(QThread):
     def run(self):
         """线程执行函数"""
 
-        sitk_src = sitk.ReadImage(self.ct_nii_path)
+        sitk_src = read_image(self.ct_nii_path)
         sitk_seg = sitk.BinaryThreshold(sitk_src, lowerThreshold=self.lowerThreshold, upperThreshold=3000, insideValue=255,
                             outsideValue=0)
 
@@ -574,102 +516,50 @@ class SkeletonSegThread(QThread):
         sitk_mask.SetOrigin(sitk_seg.GetOrigin())
 
         # 最大连通域提取，去除小连接
-        skeleton_mask = GetLargestConnectedCompont(sitk_mask)
+        skeleton_mask = keep_largest_components(sitk_mask)
 
         # 加上一个闭运算，减少断层
         skeleton_mask = MorphologicalOperation(skeleton_mask, kernelsize=2, name='close')
 
-        sitk.WriteImage(skeleton_mask, self._skeleton_mask_path)
+        volume_cache.write_image(skeleton_mask, self._skeleton_mask_path)
 
         self.finish_signal.emit(self._skeleton_mask_path)
 
 
-def window_transform(ct_array, windowWidth, windowCenter, normal=False):
+def skin_seg(ct_nii_path, lung_mask_path, skin_mask_path):
     """
-    return: trucated image according to window center and window width
-    and normalized to [0,1]
+    皮肤分割, 中间结果都是 uint8 掩膜
+    身体: CT > -400 的最大连通域, 开运算去掉小白点, 用膨胀后的肺掩膜填充肺部, 再膨胀
+    皮肤: 身体边界内外各一层体素 (3x3x3 膨胀减去 3x3x3 腐蚀), 与原 Sobel 边缘检测的非零区域相同
+    :param ct_nii_path: CT 路径
+    :param lung_mask_path: 肺掩膜路径
+    :param skin_mask_path: 皮肤掩膜保存路径
     """
-    minWindow = float(windowCenter) - 0.5 * float(windowWidth)
-    newimg = (ct_array - minWindow) / float(windowWidth)
-    newimg[newimg < 0] = 0
-    newimg[newimg > 1] = 1
-    if not normal:
-        newimg = (newimg * 255).astype('float32')
-    return newimg
-
-
-def skin_seg(ct_nii_path, lung_mask_path, skin_mask_path):
-
-    image = sitk.ReadImage(ct_nii_path, sitk.sitkFloat32)
-
-    origin = image.GetOrigin()
-    spacing = image.GetSpacing()
-    direction = image.GetDirection()
 
-    # 肺窗/二值处理
-    array = sitk.GetArrayFromImage(image)
-    array[array > 0] = 255
-    array = window_transform(array, 400, -200, False)
-    array[array > 0] = 255
-    image1 = sitk.GetImageFromArray(array)
+    image = read_image(ct_nii_path)
+    body = image > -400  # 原实现的窗宽400/窗位-200变换后大于0的部分
+    del image
 
     # 提取最大连通量
-    image1 = sitk.Cast(image1, sitk.sitkInt16)
-    cc = sitk.ConnectedComponent(image1)  # 只支持16位
-    stats = sitk.LabelIntensityStatisticsImageFilter()
-    stats.SetGlobalDefaultNumberOfThreads(8)
-    stats.Execute(cc, image1)
-    maxlabel = 0
-    maxsize = 0
-    for i in stats.GetLabels():
-        size = stats.GetPhysicalSize(i)
-        if maxsize < size:
-            maxlabel = i
-            maxsize = size
-    labelmaskimage = sitk.GetArrayFromImage(cc)
-    outmask = labelmaskimage.copy()
-    outmask[labelmaskimage == maxlabel] = 1
-    outmask[labelmaskimage != maxlabel] = 0
-
-    outmasksitk = sitk.GetImageFromArray(outmask)
+    body = keep_largest_components(body)
 
     # 开运算，去掉小白点
-    kernelsize = (5, 5, 5)
-    image1 = sitk.BinaryMorphologicalOpening(outmasksitk != 0, kernelsize)
-
-    # 使用肺部掩膜和闭运算，填充孔洞
-    # 使用到粗分割肺的掩膜
-    lung_mask_sitk = sitk.ReadImage(lung_mask_path)
-
-    # 对肺掩膜做一个闭运算,然后填充
-    lung_mask_sitk_1 = sitk.BinaryDilate(lung_mask_sitk != 0, (5, 5, 5))
-    mask = sitk.GetArrayFromImage(lung_mask_sitk_1)
-
-    image4_array = sitk.GetArrayFromImage(image1)
-    image4_array[mask == 1] = 1
-
-    image1 = sitk.GetImageFromArray(image4_array)
-    image1 = sitk.BinaryDilate(image1 != 0, (5, 5, 5))
-
-    ## sobel 算子提取边界
-    # change data type before edge detection
-    image1 = sitk.Cast(image1, sitk.sitkFloat32)
-
-    sobel_op = sitk.SobelEdgeDetectionImageFilter()
-    image1 = sobel_op.Execute(image1)
-    image1 = sitk.Cast(image1, sitk.sitkInt16)
-
-    # 二值化皮肤mask
-    sobel_array = sitk.GetArrayFromImage(image1)
-    outmask = sobel_array.copy()
-    outmask[sobel_array != 0] = 1
-
-    image1 = sitk.GetImageFromArray(outmask)
-
-    image1.SetOrigin(origin)
-    image1.SetSpacing(spacing)
-    image1.SetDirection(direction)
-    sitk.WriteImage(image1, skin_mask_path)
+    body = sitk.BinaryMorphologicalOpening(body, (5, 5, 5))
+
+    # 用膨胀后的肺掩膜填充肺部
+    lung_mask = volume_cache.read_image(lung_mask_path, sitk.sitkUInt8)
+    lung_mask.CopyInformation(body)
+    body = sitk.Or(body, sitk.BinaryDilate(lung_mask != 0, (5, 5, 5)))
+    del lung_mask
+    body = sitk.BinaryDilate(body, (5, 5, 5))
+
+    # 边界内外各一层体素
+    outer = sitk.BinaryDilate(body, (1, 1, 1), sitk.sitkBox)
+    inner = sitk.BinaryErode(body, (1, 1, 1), sitk.sitkBox)
+    del body
+    skin = sitk.And(outer, sitk.Not(inner))
+
+    volume_cache.write_image(skin, skin_mask_path)
 
 if __name__ == '__main__':
     pass
@@ -0,0 +1,125 @@
+import numpy as np
+import SimpleITK as sitk
+from scipy import ndimage
+
+
+# 邻域连通方式 => generate_binary_structure 的 connectivity 参数
+CONNECTIVITY_RANK = {6: 1, 18: 2, 26: 3}
+
+# 分块统计时每块的体素个数
+LABEL_CHUNK = 1 << 22
+
+
+def label_components(mask, connectivity=26):
+    """三维二值掩膜的连通域标记
+
+    Args:
+        mask: 二值掩膜, 非零为前景 -> 'numpy.ndarray'
+        connectivity: 邻域连通方式, 6, 18 或 26 -> 'int'
+
+    Returns:
+        label: 连通域标记, 背景为0, 连通域从1开始编号 -> 'numpy.ndarray'(int32)
+        num: 连通域个数 -> 'int'
+
+    Raises:
+        ValueError: connectivity 不是 6, 18, 26 之一
+    """
+
+    if connectivity not in CONNECTIVITY_RANK:
+        raise ValueError("connectivity must be one of 6, 18, 26, got {}".format(connectivity))
+    structure = ndimage.generate_binary_structure(3, CONNECTIVITY_RANK[connectivity])
+    label = np.empty(mask.shape, dtype=np.int32)
+    num = ndimage.label(mask, structure=structure, output=label)
+
+    return label, int(num)
+
+
+def component_sizes(label, num):
+    """一次 bincount 统计所有连通域的体素个数
+
+    Args:
+        label: 连通域标记 -> 'numpy.ndarray'
+        num: 连通域个数 -> 'int'
+
+    Returns:
+        sizes: 各连通域的体素个数, 下标为标记值, sizes[0] 为背景 -> 'numpy.ndarray'(int64)
+
+    Raises:
+        None
+    """
+
+    # bincount 会把 int32 标记转换为 int64, 分块统计避免整幅图像大小的临时数组
+    flat = label.reshape(-1)
+    sizes = np.zeros(num + 1, dtype=np.int64)
+    for start in range(0, flat.size, LABEL_CHUNK):
+        sizes += np.bincount(flat[start:start + LABEL_CHUNK], minlength=num + 1)
+
+    return sizes
+
+
+def apply_label_table(label, keep):
+    """按查找表保留连通域, 一次索引得到结果
+
+    Args:
+        label: 连通域标记 -> 'numpy.ndarray'
+        keep: 查找表, 下标为标记值, 为 True 的连通域保留 -> 'numpy.ndarray'(bool)
+
+    Returns:
+        mask: 取值为{0, 1}的掩膜 -> 'numpy.ndarray'(uint8)
+
+    Raises:
+        None
+    """
+
+    table = keep.astype(np.uint8)
+    table[0] = 0  # 背景始终为0
+    return table[label]
+
+
+def remove_small_components(mask, min_size, connectivity=26):
+    """去除体素个数小于 min_size 的连通域
+
+    Args:
+        mask: 二值掩膜, 非零为前景, 不会被修改 -> 'numpy.ndarray'
+        min_size: 保留连通域的最小体素个数 -> 'int'
+        connectivity: 邻域连通方式, 6, 18 或 26 -> 'int'
+
+    Returns:
+        out_mask: 取值为{0, 1}的掩膜 -> 'numpy.ndarray'(uint8)
+        num: 原连通域个数 -> 'int'
+        keep_num: 保留的连通域个数 -> 'int'
+
+    Raises:
+        ValueError: connectivity 不是 6, 18, 26 之一
+    """
+
+    label, num = label_components(mask, connectivity)
+    keep = component_sizes(label, num) >= min_size
+    keep[0] = False
+    out_mask = apply_label_table(label, keep)
+
+    return out_mask, num, int(keep.sum())
+
+
+def keep_largest_components(binary_image, k=1, fully_connected=False):
+    """保留体素个数最多的 k 个连通域
+
+    按连通域大小重新编号(1为最大), 只统计形状信息, 不计算灰度统计, 也不把标记图像转成数组.
+
+    Args:
+        binary_image: 二值图像, 非零为前景 -> 'SimpleITK.Image'
+        k: 保留的连通域个数 -> 'int'
+        fully_connected: 是否使用26邻域, 默认6邻域 -> 'bool'
+
+    Returns:
+        out_image: 取值为{0, 1}的掩膜, 与输入的 origin, spacing, direction 相同 -> 'SimpleITK.Image'(uint8)
+
+    Raises:
+        None
+    """
+
+    cc = sitk.ConnectedComponent(binary_image != 0, fully_connected)
+    cc = sitk.RelabelComponent(cc, sortByObjectSize=True)
+    out_image = sitk.BinaryThreshold(cc, lowerThreshold=1, upperThreshold=k, insideValue=1, outsideValue=0)
+
+    return out_image
@@ -1,21 +1,123 @@
 import os
+from concurrent.futures import ThreadPoolExecutor
 import SimpleITK as sitk
+from PyQt5.QtCore import QThread, pyqtSignal
+from utils.runtime_config import pool_workers
+from utils.volume_cache import volume_cache
+from utils.storage import write_image
+from utils.vtk_bridge import sitk_to_vtk_image
 
 
-def dcm2nii(dcms_path, nii_dir):
-    reader = sitk.ImageSeriesReader()
-    dicom_names = reader.GetGDCMSeriesFileNames(dcms_path)
-    reader.SetFileNames(dicom_names)
-    image2 = reader.Execute()
+# 每个线程一次解码的层数
+DECODE_CHUNK = 16
 
-    image_array = sitk.GetArrayFromImage(image2)  # z, y, x
-    origin = image2.GetOrigin()  # x, y, z
-    spacing = image2.GetSpacing()  # x, y, z
-    direction = image2.GetDirection()  # x, y, z
 
-    image3 = sitk.GetImageFromArray(image_array)
-    image3.SetSpacing(spacing)
-    image3.SetDirection(direction)
-    image3.SetOrigin(origin)
+def read_dicom_series(dcms_path, workers=None, progress=None, dicom_names=None):
+    """并行解码DICOM序列
+
+    按 GDCM 排好的顺序把层分成若干块, 每块在线程池中用一个 ImageSeriesReader 解码(SimpleITK 解码时
+    释放 GIL), 最后沿 z 轴拼接, 只复制一次.
+
+    Args:
+        dcms_path: DICOM 文件夹 -> 'str'
+        workers: 线程数, 默认使用运行配置 process_workers -> 'int'
+        progress: 每解码完一块调用 progress(百分比) -> 'callable'
+        dicom_names: 排好序的文件列表, 例如 DicomIndex.file_names() 选出的序列, 为 None 时读取
+                     GetGDCMSeriesFileNames 返回的默认序列 -> 'list'
+
+    Returns:
+        image: CT 图像 -> 'SimpleITK.Image'
+
+    Raises:
+        RuntimeError: 文件夹中没有 DICOM 序列, 或解码失败
+    """
+
+    if dicom_names is None:
+        dicom_names = sitk.ImageSeriesReader.GetGDCMSeriesFileNames(dcms_path)
+    if not dicom_names:
+        raise RuntimeError("没有找到DICOM序列: {}".format(dcms_path))
+
+    chunks = [dicom_names[i:i + DECODE_CHUNK] for i in range(0, len(dicom_names), DECODE_CHUNK)]
+
+    def decode(names):
+        reader = sitk.ImageSeriesReader()
+        reader.SetFileNames(names)
+        return reader.Execute()
+
+    if workers is None:
+        workers = pool_workers()
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='dicom_decoder') as executor:
+        futures = [executor.submit(decode, names) for names in chunks]
+        images = []
+        for i, future in enumerate(futures):
+            images.append(future.result())
+            if progress is not None:
+                progress(int(100 * (i + 1) / len(futures)))
+
+    if len(images) == 1:
+        return images[0]
+
+    # 第一块至少有两层, spacing/origin/direction 与整个序列一起读取时相同
+    image = sitk.Tile(images, (1, 1, 0))
+    image.SetSpacing(images[0].GetSpacing())
+    image.SetOrigin(images[0].GetOrigin())
+    image.SetDirection(images[0].GetDirection())
+    return image
+
+
+def dcm2nii(dcms_path, nii_dir, workers=None, progress=None):
+    """DICOM序列转为 nii_0000.nii.gz, 直接写解码结果, 并放入 volume_cache, 后续读取不再解码
+
+    Args:
+        dcms_path: DICOM 文件夹 -> 'str'
+        nii_dir: 保存文件夹 -> 'str'
+        workers: 解码线程数 -> 'int'
+        progress: 解码进度回调, 见 read_dicom_series -> 'callable'
+
+    Returns:
+        new_nii_path: nii 文件路径 -> 'str'
+        image: CT 图像 -> 'SimpleITK.Image'
+    """
+
+    image = read_dicom_series(dcms_path, workers, progress)
+    return write_ct_nii(image, nii_dir), image
+
+
+def write_ct_nii(image, nii_dir):
+    """写 nii_0000.nii.gz(nnU-Net 的输入), 并把图像放入 volume_cache"""
+
     new_nii_path = os.path.join(nii_dir, 'nii_0000.nii.gz')
-    sitk.WriteImage(image3, new_nii_path)
+    write_image(image, new_nii_path)  # 上一个病例导入的 nii 是链接, 替换链接而不是写入原文件
+    volume_cache.put(new_nii_path, 'sitk', image, sitk.GetArrayViewFromImage(image).nbytes)
+    return new_nii_path
+
+
+class DicomImportThread(QThread):
+    """DICOM导入线程
+
+    解码完成后先发送 loaded_signal, 附带可以直接显示的 vtkImageData, 写完 nii 文件后再发送 finish_signal.
+    """
+
+    progress_signal = pyqtSignal(int)  # 解码进度, 百分比
+    loaded_signal = pyqtSignal(object)  # 解码完成, vtkImageData, 与 vtk_nii_reader 读取 nii 文件的结果一致
+    finish_signal = pyqtSignal(str)  # nii 文件写完, 文件路径
+    error_signal = pyqtSignal(str)  # 报错信息
+
+    def __init__(self, dcms_path, nii_dir, dicom_names=None, parent=None):
+        super(DicomImportThread, self).__init__(parent)
+
+        self.dcms_path = dcms_path
+        self.nii_dir = nii_dir
+        self.dicom_names = dicom_names  # 选择的序列的文件列表, 为 None 时导入默认序列
+
+    def run(self):
+        """线程执行函数"""
+
+        try:
+            image = read_dicom_series(self.dcms_path, progress=self.progress_signal.emit,
+                                      dicom_names=self.dicom_names)
+        except RuntimeError as e:
+            self.error_signal.emit(str(e))
+            return
+        self.loaded_signal.emit(sitk_to_vtk_image(image))
+        self.finish_signal.emit(write_ct_nii(image, self.nii_dir))
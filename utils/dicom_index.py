@@ -0,0 +1,199 @@
+import os
+import json
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import SimpleITK as sitk
+from PyQt5.QtCore import QThread, pyqtSignal
+from utils.runtime_config import pool_workers
+
+
+# 索引文件格式版本, 格式变化时重新扫描
+INDEX_VERSION = 1
+
+# 建索引用到的 DICOM 标签
+SERIES_UID_TAG = '0020|000e'
+SERIES_TAGS = {
+    'description': '0008|103e',
+    'modality': '0008|0060',
+    'series_number': '0020|0011',
+    'orientation': '0020|0037',
+    'pixel_spacing': '0028|0030',
+    'thickness': '0018|0050',
+}
+POSITION_TAG = '0020|0032'
+INSTANCE_TAG = '0020|0013'
+
+
+def _read_header(path):
+    """只读取 DICOM 文件头, 不解码像素, 不是 DICOM 文件时返回 None"""
+
+    reader = sitk.ImageFileReader()
+    reader.SetImageIO('GDCMImageIO')
+    reader.SetFileName(path)
+    try:
+        reader.ReadImageInformation()
+    except RuntimeError:
+        return None
+    if not reader.HasMetaDataKey(SERIES_UID_TAG):
+        return None
+
+    def tag(key):
+        return reader.GetMetaData(key).strip() if reader.HasMetaDataKey(key) else ''
+
+    header = {name: tag(key) for name, key in SERIES_TAGS.items()}
+    header['series_uid'] = tag(SERIES_UID_TAG)
+    header['size'] = list(reader.GetSize()[:2])
+    header['position'] = [float(v) for v in tag(POSITION_TAG).split('\\')] if tag(POSITION_TAG) else None
+    header['instance'] = int(tag(INSTANCE_TAG)) if tag(INSTANCE_TAG).lstrip('-').isdigit() else None
+    return header
+
+
+class DicomIndex:
+    """DICOM 文件夹的序列索引
+
+    只读取文件头(序列UID、位置、方向、间距等), 按序列UID分组, 索引保存为 JSON. 再次扫描同一文件夹时,
+    修改时间和大小不变的文件直接使用索引, 只读取新增或修改的文件.
+    """
+
+    def __init__(self, dcms_path, index_dir):
+        self.dcms_path = os.path.abspath(dcms_path)
+        name = hashlib.blake2b(self.dcms_path.encode('utf-8'), digest_size=8).hexdigest()
+        self.index_path = os.path.join(index_dir, name + '.json')
+        self.files = {}  # 相对路径 => (修改时间, 大小, 序列UID 或 None, 位置, 序号)
+        self.series = {}  # 序列UID => 序列信息
+        self._load()
+
+    def _load(self):
+        if not os.path.isfile(self.index_path):
+            return
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            return
+        if index.get('version') != INDEX_VERSION or index.get('root') != self.dcms_path:
+            return
+        self.files = {name: tuple(entry) for name, entry in index['files'].items()}
+        self.series = index['series']
+
+    def _save(self):
+        os.makedirs(os.path.dirname(self.index_path), exist_ok=True)
+        index = dict(version=INDEX_VERSION, root=self.dcms_path, files=self.files, series=self.series)
+        with open(self.index_path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(index, f)
+        os.replace(self.index_path + '.tmp', self.index_path)
+
+    def scan(self, workers=None, progress=None):
+        """扫描文件夹(包括子文件夹), 更新并保存索引
+
+        Args:
+            workers: 读取文件头的线程数, 默认使用运行配置 process_workers -> 'int'
+            progress: 每读取一个新文件调用 progress(百分比) -> 'callable'
+
+        Returns:
+            series: 序列信息列表, 见 series_list -> 'list'
+        """
+
+        stats = {}
+        for root, _, names in os.walk(self.dcms_path):
+            for name in names:
+                path = os.path.join(root, name)
+                stat = os.stat(path)
+                stats[os.path.relpath(path, self.dcms_path)] = (stat.st_mtime_ns, stat.st_size)
+
+        files = {name: entry for name, entry in self.files.items()
+                 if name in stats and tuple(entry[:2]) == stats[name]}
+        new_names = [name for name in stats if name not in files]
+
+        if new_names:
+            if workers is None:
+                workers = pool_workers()
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='dicom_header') as executor:
+                headers = executor.map(_read_header, [os.path.join(self.dcms_path, name) for name in new_names])
+                for i, (name, header) in enumerate(zip(new_names, headers)):
+                    if progress is not None:
+                        progress(int(100 * (i + 1) / len(new_names)))
+                    if header is None:  # 不是 DICOM 文件, 也记录下来, 下次不再读取
+                        files[name] = stats[name] + (None, None, None)
+                        continue
+                    files[name] = stats[name] + (header['series_uid'], header['position'], header['instance'])
+                    if header['series_uid'] not in self.series:
+                        self.series[header['series_uid']] = {key: header[key] for key in
+                                                             list(SERIES_TAGS) + ['size']}
+
+        self.files = files
+        used = {entry[2] for entry in files.values()}
+        self.series = {uid: info for uid, info in self.series.items() if uid in used}
+        self._save()
+        return self.series_list()
+
+    def file_names(self, series_uid):
+        """序列的文件路径, 按层的位置沿法向排序, 与 GetGDCMSeriesFileNames 的顺序一致
+
+        Args:
+            series_uid: 序列UID -> 'str'
+
+        Returns:
+            file_names: 文件路径列表 -> 'list'
+        """
+
+        entries = [(name, entry) for name, entry in self.files.items() if entry[2] == series_uid]
+        orientation = self.series[series_uid]['orientation']
+        if orientation and all(entry[3] is not None for _, entry in entries):
+            cosines = [float(v) for v in orientation.split('\\')]
+            normal = np.cross(cosines[:3], cosines[3:])
+            entries.sort(key=lambda item: (float(np.dot(normal, item[1][3])), item[0]))
+        else:
+            entries.sort(key=lambda item: (item[1][4] if item[1][4] is not None else 0, item[0]))
+        return [os.path.join(self.dcms_path, name) for name, _ in entries]
+
+    def series_list(self):
+        """序列信息列表, 按序列号排序
+
+        Returns:
+            series: 每个序列一个字典, 包括 series_uid, description, modality, series_number, slices, size,
+                    pixel_spacing, thickness -> 'list'
+        """
+
+        slices = {}
+        for entry in self.files.values():
+            if entry[2] is not None:
+                slices[entry[2]] = slices.get(entry[2], 0) + 1
+
+        series = []
+        for uid, info in self.series.items():
+            series.append(dict(info, series_uid=uid, slices=slices[uid]))
+
+        def number(info):
+            return int(info['series_number']) if info['series_number'].lstrip('-').isdigit() else 0
+
+        return sorted(series, key=lambda info: (number(info), info['series_uid']))
+
+
+def series_label(info):
+    """序列在选择列表中显示的文字"""
+
+    return "{} {} {} - {}层 {}x{} 层厚{}".format(info['series_number'], info['modality'], info['description'],
+                                              info['slices'], info['size'][0], info['size'][1],
+                                              info['thickness'] or '?')
+
+
+class DicomScanThread(QThread):
+    """DICOM文件夹扫描线程, 扫描完成后发送序列信息列表"""
+
+    progress_signal = pyqtSignal(int)  # 读取文件头的进度, 百分比
+    finish_signal = pyqtSignal(object)  # (DicomIndex, 序列信息列表)
+
+    def __init__(self, dcms_path, index_dir, parent=None):
+        super(DicomScanThread, self).__init__(parent)
+
+        self.dcms_path = dcms_path
+        self.index_dir = index_dir
+
+    def run(self):
+        """线程执行函数"""
+
+        index = DicomIndex(self.dcms_path, self.index_dir)
+        series = index.scan(progress=self.progress_signal.emit)
+        self.finish_signal.emit((index, series))
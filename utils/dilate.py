@@ -1,4 +1,15 @@
 import SimpleITK as sitk
+from utils.storage import read_image, write_image
+
+
+def dilate_image(nii, kernelsize=5):
+    """
+    nii:肿瘤掩膜
+    kernelsize : 放大的比例，整数
+    return: 放大后的掩膜
+    """
+    kernelsize = (kernelsize, kernelsize, kernelsize)
+    return sitk.BinaryDilate(nii != 0, kernelsize)
 
 
 def dilate(nii_path, new_nii_path, kernelsize=5):
@@ -7,7 +18,6 @@ def dilate(nii_path, new_nii_path, kernelsize=5):
     new_nii_path:放大后掩膜的路径
     kernelsize : 放大的比例，整数
     """
-    nii = sitk.ReadImage(nii_path)
-    kernelsize = (kernelsize, kernelsize, kernelsize)
-    new_nii = sitk.BinaryDilate(nii != 0, kernelsize)
-    sitk.WriteImage(new_nii, new_nii_path)
\ No newline at end of file
+    nii = read_image(nii_path)
+    new_nii = dilate_image(nii, kernelsize)
+    write_image(new_nii, new_nii_path)
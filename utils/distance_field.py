@@ -0,0 +1,98 @@
+import os
+import hashlib
+import numpy as np
+import SimpleITK as sitk
+from utils.skin_cache import file_digest
+
+
+# 缓存目录的默认大小上限(字节), 每个距离场为 CT 体素数 x 4 字节
+DEFAULT_MAX_BYTES = 1 << 31
+
+
+def obstacle_distance(mask, spacing):
+    """掩膜外各体素到掩膜的欧氏距离(mm), 掩膜内为 0
+
+    Args:
+        mask: zyx 顺序的 bool 数组, 例如重要组织掩膜的并集 -> 'numpy.ndarray'
+        spacing: 体素间距, xyz -> 'tuple'
+
+    Returns:
+        distance: zyx 顺序的 float32 数组 -> 'numpy.ndarray'
+    """
+
+    image = sitk.GetImageFromArray(np.ascontiguousarray(mask).view(np.uint8))
+    image.SetSpacing([float(s) for s in spacing])
+    distance = sitk.SignedMaurerDistanceMap(image, insideIsPositive=False, squaredDistance=False,
+                                            useImageSpacing=True)
+    distance = sitk.GetArrayFromImage(distance)
+    np.maximum(distance, 0, out=distance)  # 掩膜内为负的距离, 路径规划只关心掩膜外
+    return distance
+
+
+class DistanceFieldCache:
+    """距离场的磁盘缓存
+
+    每组掩膜(各掩膜的内容哈希)一个 .npy 文件, 读取时内存映射, 只有路径经过的体素会读入内存.
+    目录总大小超过上限时按最近使用时间淘汰.
+    """
+
+    def __init__(self, cache_dir, max_bytes=DEFAULT_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def key(self, mask_paths, spacing, shape):
+        """一组掩膜的缓存键, 与掩膜的顺序无关
+
+        距离以毫米为单位, 同一组掩膜按不同的体素间距计算的距离场不同, 因此体素间距和数组形状也计入缓存键.
+        """
+
+        h = hashlib.blake2b(digest_size=16)
+        for digest in sorted(file_digest(mask_path) for mask_path in mask_paths):
+            h.update(digest.encode())
+        h.update(repr((tuple(float(s) for s in spacing), tuple(int(n) for n in shape))).encode())
+        return h.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key + '.npy')
+
+    def load(self, key):
+        """读取距离场(只读的内存映射), 没有缓存时返回 None"""
+
+        path = self._path(key)
+        if not os.path.isfile(path):
+            return None
+        os.utime(path)  # 记录最近使用时间
+        return np.load(path, mmap_mode='r')
+
+    def save(self, key, distance):
+        """保存距离场"""
+
+        path = self._path(key)
+        tmp_path = path + '.tmp.npy'
+        np.save(tmp_path, distance)
+        os.replace(tmp_path, path)
+
+    def evict(self, keep_key=None):
+        """目录总大小超过上限时, 从最久未使用的距离场开始删除, keep_key 对应的距离场不删除"""
+
+        entries = []
+        total = 0
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            if not name.endswith('.npy') or not os.path.isfile(path):
+                continue
+            size = os.path.getsize(path)
+            entries.append((os.path.getmtime(path), name[:-len('.npy')], size))
+            total += size
+
+        for _, key, size in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if key == keep_key:
+                continue
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                continue
+            total -= size
@@ -1,40 +1,8 @@
 import numpy as np
 from scipy.spatial import ConvexHull
 import SimpleITK as sitk
-
-# 得到最大连通域
-def GetLargestConnectedCompont(binarysitk_image):
-    """
-    save largest object
-    :param sitk_maskimg:binary itk image
-    :return: largest region binary image
-    """
-    cc = sitk.ConnectedComponent(binarysitk_image)
-    stats = sitk.LabelIntensityStatisticsImageFilter()
-    stats.SetGlobalDefaultNumberOfThreads(8)
-    stats.Execute(cc, binarysitk_image)
-    maxlabel = 0
-    maxsize = 0
-    size_list = []
-    for l in stats.GetLabels():
-        size = stats.GetPhysicalSize(l)
-        size_list.append(size)
-        if maxsize < size:
-            maxlabel = l
-            maxsize = size
-    labelmaskimage = sitk.GetArrayFromImage(cc) # 带label不同值的mask
-
-
-    outmask = labelmaskimage.copy()
-    outmask[labelmaskimage == maxlabel] = 1
-    outmask[labelmaskimage != maxlabel] = 0
-
-
-    outmask_sitk = sitk.GetImageFromArray(outmask)
-    outmask_sitk.SetDirection(binarysitk_image.GetDirection())
-    outmask_sitk.SetSpacing(binarysitk_image.GetSpacing())
-    outmask_sitk.SetOrigin(binarysitk_image.GetOrigin())
-    return outmask_sitk
+from utils.connected_component import keep_largest_components
+from utils.storage import read_image
 
 
 def Minimum_envelope_ball(mask_data):
@@ -57,11 +25,11 @@ def eval_tumor_efficacy(label1_path, label2_path):
     :param label1_path 术前肿瘤掩膜路径
     :param label2_path 术前肿瘤掩膜路径
     '''
-    tumor1_image = sitk.ReadImage(label1_path)
-    tumor2_image = sitk.ReadImage(label2_path)
+    tumor1_image = read_image(label1_path)  # 也可以是 npy 格式的中间结果
+    tumor2_image = read_image(label2_path)
 
-    tumor1_image = GetLargestConnectedCompont(tumor1_image)
-    tumor2_image = GetLargestConnectedCompont(tumor2_image)
+    tumor1_image = keep_largest_components(tumor1_image)
+    tumor2_image = keep_largest_components(tumor2_image)
 
     tumor1_arr = sitk.GetArrayFromImage(tumor1_image)
     tumor2_arr = sitk.GetArrayFromImage(tumor2_image)
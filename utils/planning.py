@@ -0,0 +1,720 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field, asdict
+import vtk
+import numpy as np
+import SimpleITK as sitk
+from vtkmodules.util.numpy_support import vtk_to_numpy
+from utils.resample import resample_volume
+from utils.dilate import dilate_image
+from utils.reader import vtk_nii_reader
+from utils.extract_point import extract_pt
+from utils.kmeans import get_pt_center
+from utils.skin_cache import SkinCache, skin_point_set
+from utils.volume_cache import volume_cache
+from utils.vtk_bridge import vtk_image_to_array
+from utils.voxel_rays import segments_hit, segments_min, segments_first_hit
+from utils.distance_field import DistanceFieldCache, obstacle_distance
+from utils.storage import INTERMEDIATE_FORMATS, intermediate_path
+from utils.is_pareto_front import is_pareto_efficient
+
+
+# 进程内缓存的 ObstacleField 数量上限: 一个病例有重要组织、去掉血管后的重要组织和肺三组掩膜
+MAX_SHARED_FIELDS = 4
+# 进程内缓存的 ObstacleField 占用内存的上限(字节), 不含内存映射的距离场
+MAX_SHARED_FIELD_BYTES = 1 << 30
+
+# 病例文件夹中的文件名(不带扩展名, 可以是任意中间结果格式), 与 result 目录中的名称一致
+CASE_FILES = {
+    'ct': ('ct', 'nii_0000'),
+    'lung': ('lung_mask',),
+    'trachea': ('trachea_mask',),
+    'vessel': ('vessel_mask',),
+    'skeleton': ('skeleton_mask',),
+    'tumor': ('tumor_mask',),
+    'lung_trachea': ('lung_trachea_mask',),
+}
+
+
+class PlanningError(Exception):
+    """路径规划失败, 报错信息可以直接显示给用户"""
+
+
+@dataclass
+class PlanningParams:
+    """路径规划参数, 默认值与界面上的默认值一致"""
+
+    max_needle_depth: float = 200  # 最大进针深度(mm)
+    max_ablation_radius: float = 25  # 最大消融半径(mm), 按半径自动确定针数时使用
+    ps_rate: float = 0.02  # 皮肤点集采样参数
+    pt_sample_spacing: int = 2  # 肿瘤点集采样间距(mm)
+    safe_distance: int = 5  # 安全边界距离
+    face_up: bool = True  # 身体朝向是否向上
+    large: bool = False  # 大肿瘤模式: 使用固定针数, 不膨胀肿瘤
+    needles_num: int = 1  # 大肿瘤模式的针数
+
+
+@dataclass
+class PlanningInputs:
+    """路径规划的输入, 界面中直接使用已经重建的表面, 批处理时用 from_case_dir 从掩膜文件重建"""
+
+    ct_path: str  # CT图像路径
+    lung_trachea_mask_path: str  # 肺+气管掩膜路径
+    tumor_mask_path: str  # 肿瘤掩膜路径
+    lung_mask_path: str  # 肺掩膜路径, 胸壁厚度和肺内长度在掩膜上计算
+    obstacle_mask_paths: list  # 重要组织掩膜路径, 进针路径需要避开 -> 'list'
+    fallback_obstacle_mask_paths: list  # 避开所有重要组织的路径太少时改用的掩膜(不含血管) -> 'list'
+    extent: tuple  # CT图像范围
+    spacing: tuple  # CT体素间距
+    result_dir: str  # 中间结果(重采样、膨胀后的肿瘤、皮肤掩膜)保存目录
+    skin_cache_dir: str = None  # 皮肤分割缓存目录, 为 None 时不使用缓存
+    distance_cache_dir: str = None  # 重要组织距离场缓存目录, 为 None 时不使用缓存
+
+    @classmethod
+    def from_case_dir(cls, case_dir, result_dir, skin_cache_dir=None, distance_cache_dir=None):
+        """从病例文件夹读取输入, 文件名见 CASE_FILES
+
+        Args:
+            case_dir: 病例文件夹, 包括 CT、肺、气管、血管、骨骼、肿瘤掩膜 -> 'str'
+            result_dir: 中间结果保存目录 -> 'str'
+            skin_cache_dir: 皮肤分割缓存目录 -> 'str'
+            distance_cache_dir: 重要组织距离场缓存目录 -> 'str'
+
+        Returns:
+            inputs: 路径规划输入 -> 'PlanningInputs'
+
+        Raises:
+            PlanningError: 缺少文件, 或者CT读取失败
+        """
+
+        os.makedirs(result_dir, exist_ok=True)
+        paths = {name: find_case_file(case_dir, names) for name, names in CASE_FILES.items()}
+        for name in ('ct', 'lung', 'tumor'):
+            if paths[name] is None:
+                raise PlanningError("缺少文件: {}".format(os.path.join(case_dir, CASE_FILES[name][0])))
+
+        # 没有肺+气管掩膜时由肺和气管掩膜合并
+        if paths['lung_trachea'] is None:
+            merged = volume_cache.read_image(paths['lung'], sitk.sitkUInt8)
+            if paths['trachea'] is not None:
+                merged = sitk.Maximum(merged, volume_cache.read_image(paths['trachea'], sitk.sitkUInt8))
+            paths['lung_trachea'] = intermediate_path(result_dir, 'lung_trachea_mask')
+            volume_cache.write_image(merged, paths['lung_trachea'])
+
+        error_tag, ct_output = vtk_nii_reader(paths['ct'])
+        if error_tag:
+            raise PlanningError(ct_output)
+
+        # 肺和重要组织只使用掩膜, 不需要重建表面
+        return cls(ct_path=paths['ct'], lung_trachea_mask_path=paths['lung_trachea'],
+                   tumor_mask_path=paths['tumor'], lung_mask_path=paths['lung'],
+                   obstacle_mask_paths=[paths[name] for name in ('trachea', 'vessel', 'skeleton')
+                                        if paths[name] is not None],
+                   fallback_obstacle_mask_paths=[paths[name] for name in ('trachea', 'skeleton')
+                                                 if paths[name] is not None],
+                   extent=ct_output.GetExtent(), spacing=ct_output.GetSpacing(), result_dir=result_dir,
+                   skin_cache_dir=skin_cache_dir, distance_cache_dir=distance_cache_dir)
+
+
+@dataclass
+class PlanningResult:
+    """路径规划结果"""
+
+    needles_num: int  # 针数
+    entry_points: list  # 每针的进针点, 1x3 数组
+    pt_centers: list  # 每针的肿瘤靶向点
+    pt_radius: list  # 每针的消融半径
+    iou_list: list  # 每针的 [AC, OA]
+    ac_all: float  # 总体 AC
+    oa_all: float  # 总体 OA
+    ablate_list: list = field(repr=False)  # 每针的消融区域表面 -> 'vtkPolyData'
+    dilate_tumor_mask_path: str = None  # 膨胀后的肿瘤掩膜路径, 大肿瘤模式为 None
+    timings: dict = field(default_factory=dict)  # 各阶段耗时(s)
+
+    def to_dict(self):
+        """可以保存为 JSON 的结果, 不包括消融区域表面"""
+
+        result = asdict(self)
+        del result['ablate_list']
+        return _to_builtin(result)
+
+
+def _to_builtin(value):
+    if isinstance(value, dict):
+        return {key: _to_builtin(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_to_builtin(item) for item in value]
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def find_case_file(case_dir, names):
+    """在病例文件夹中查找文件, 依次尝试各个名称和中间结果格式, 找不到时返回 None"""
+
+    for name in names:
+        for ext in INTERMEDIATE_FORMATS.values():
+            path = os.path.join(case_dir, name + ext)
+            if os.path.isfile(path):
+                return path
+    return None
+
+
+def mask_surface(mask_path):
+    """掩膜重建表面, 与界面中重建的表面相同
+
+    Args:
+        mask_path: 掩膜路径 -> 'str'
+
+    Returns:
+        polydata: 表面 -> 'vtkPolyData'
+
+    Raises:
+        PlanningError: 读取失败, 或者掩膜最大值不是 1
+    """
+
+    error_tag, reader_output = vtk_nii_reader(mask_path)
+    if error_tag:
+        raise PlanningError(reader_output)
+
+    accumulator = vtk.vtkImageAccumulate()
+    accumulator.SetInputData(reader_output)
+    accumulator.Update()
+    if accumulator.GetMax()[0] != 1:
+        raise PlanningError("请检查掩膜的值是否为1: {}".format(mask_path))
+
+    mc = vtk.vtkDiscreteMarchingCubes()
+    mc.SetInputData(reader_output)
+    mc.SetValue(0, 1)
+    mc.Update()
+    return mc.GetOutput()
+
+
+def mask_union(mask_paths):
+    """多个掩膜的并集, 几何与 vtk_nii_reader 的输出一致(路径规划使用的坐标), 掩膜与CT的大小相同
+
+    Args:
+        mask_paths: 掩膜路径 -> 'list'
+
+    Returns:
+        union: zyx 顺序的 bool 数组, 没有掩膜时为 None -> 'numpy.ndarray'
+
+    Raises:
+        PlanningError: 读取失败
+    """
+
+    union = None
+    for mask_path in mask_paths:
+        error_tag, reader_output = vtk_nii_reader(mask_path)
+        if error_tag:
+            raise PlanningError(reader_output)
+        mask = vtk_image_to_array(reader_output) != 0
+        union = mask if union is None else np.logical_or(union, mask, out=union)
+    return union
+
+
+class ObstacleField:
+    """一组掩膜(例如重要组织)的并集及其距离场, 各针共用
+
+    都在第一次使用时计算: 避障检查只需要掩膜, 距离场用于路径到重要组织的距离. 距离场保存在磁盘缓存中,
+    同一病例重新规划时直接读取; 计算后也改为使用缓存的内存映射, 不常驻内存. 计算结果只读, 可以在多个
+    线程中同时使用.
+    """
+
+    def __init__(self, mask_paths, spacing, cache=None):
+        self.mask_paths = list(mask_paths)
+        self.spacing = spacing
+        self.cache = cache
+        self._mask = None
+        self._distance = None
+        self._lock = threading.RLock()
+
+    @property
+    def mask(self):
+        """掩膜的并集, 见 mask_union"""
+
+        with self._lock:
+            if self._mask is None:
+                mask = mask_union(self.mask_paths)
+                if mask is not None:
+                    mask.flags.writeable = False
+                self._mask = mask
+            return self._mask
+
+    @property
+    def distance(self):
+        """掩膜外各体素到掩膜的距离(mm), 见 obstacle_distance"""
+
+        with self._lock:
+            if self._distance is None:
+                key = None
+                if self.cache is not None:
+                    key = self.cache.key(self.mask_paths, self.spacing, self.mask.shape)
+                distance = self.cache.load(key) if self.cache is not None else None
+                if distance is None:
+                    distance = obstacle_distance(self.mask, self.spacing)
+                    distance.flags.writeable = False
+                    if self.cache is not None:
+                        self.cache.save(key, distance)
+                        self.cache.evict(keep_key=key)
+                        distance = self.cache.load(key)
+                else:
+                    print("重要组织距离场: 使用缓存")
+                self._distance = distance
+            return self._distance
+
+    @property
+    def nbytes(self):
+        """已经计算的数组占用的内存(字节), 内存映射的距离场不计入"""
+
+        with self._lock:
+            arrays = [self._mask, self._distance]
+            return sum(array.nbytes for array in arrays if array is not None and not isinstance(array, np.memmap))
+
+
+def _mask_stamps(mask_paths):
+    stamps = []
+    for mask_path in mask_paths:
+        try:
+            stat = os.stat(mask_path)
+        except OSError:  # 文件不存在时不缓存, 由 mask_union 报错
+            return None
+        stamps.append((stat.st_mtime_ns, stat.st_size))
+    return tuple(stamps)
+
+
+# 进程内共用的 ObstacleField, (各掩膜绝对路径, spacing) => (各掩膜的修改时间和大小, ObstacleField)
+_shared_fields = OrderedDict()
+_shared_fields_lock = threading.Lock()
+
+
+def shared_field(mask_paths, spacing, cache=None):
+    """一组掩膜的 ObstacleField, 同一进程中的多次规划(例如界面中的普通模式和大肿瘤模式)共用
+
+    各掩膜文件被重写(重新分割)后自动失效, 重新读取掩膜、计算距离场. 最多保留 MAX_SHARED_FIELDS 组,
+    占用内存不超过 MAX_SHARED_FIELD_BYTES, 淘汰最久未使用的(返回的这一组除外).
+
+    Args:
+        mask_paths: 掩膜路径 -> 'list'
+        spacing: 体素间距 -> 'tuple'
+        cache: 距离场的磁盘缓存, 为 None 时不使用 -> 'DistanceFieldCache'
+
+    Returns:
+        field: 掩膜的并集及其距离场 -> 'ObstacleField'
+    """
+
+    key = (tuple(os.path.abspath(mask_path) for mask_path in mask_paths), tuple(float(s) for s in spacing))
+    stamps = _mask_stamps(mask_paths)
+    with _shared_fields_lock:
+        entry = _shared_fields.get(key)
+        if stamps is not None and entry is not None and entry[0] == stamps:
+            _shared_fields.move_to_end(key)
+            field = entry[1]
+            if field.cache is None:
+                field.cache = cache
+        else:
+            field = ObstacleField(mask_paths, spacing, cache)
+            _shared_fields.pop(key, None)
+            if stamps is not None:
+                _shared_fields[key] = (stamps, field)
+
+        # 掩膜和距离场在第一次使用时才读取, 每次调用时按当前占用的内存淘汰, 最近使用的一组保留
+        while len(_shared_fields) > 1:
+            if len(_shared_fields) <= MAX_SHARED_FIELDS and \
+                    sum(entry[1].nbytes for entry in _shared_fields.values()) <= MAX_SHARED_FIELD_BYTES:
+                break
+            _shared_fields.popitem(last=False)
+        return field
+
+
+def plan_paths(inputs, params):
+    """自动路径规划
+
+    Args:
+        inputs: 输入 -> 'PlanningInputs'
+        params: 参数 -> 'PlanningParams'
+
+    Returns:
+        result: 规划结果 -> 'PlanningResult'
+
+    Raises:
+        PlanningError: 无法规划出满足约束的路径, 报错信息可以直接显示给用户
+    """
+
+    timings = {}
+    start = time.perf_counter()
+
+    # 计算靶向点
+    # 重采样肿瘤掩膜的spacing为(1, 1, 1)
+    resample_tumor_mask_path = intermediate_path(inputs.result_dir, "resample_tumor_mask")
+    tumor_vol = volume_cache.read_image(inputs.tumor_mask_path)
+    resample_tumor_vol = resample_volume([1, 1, 1], tumor_vol)
+    volume_cache.write_image(resample_tumor_vol, resample_tumor_mask_path)
+
+    if params.large:
+        dilate_tumor_mask_path = None
+        error_tag, tumor_reader_output = vtk_nii_reader(resample_tumor_mask_path)
+    else:
+        # 肿瘤安全边界膨胀, 直接使用内存中的重采样结果, 写入的文件放入缓存, 不再读取
+        dilate_tumor_mask_path = intermediate_path(inputs.result_dir, "dilate_tumor_mask")
+        volume_cache.write_image(dilate_image(resample_tumor_vol, kernelsize=5), dilate_tumor_mask_path)
+        error_tag, tumor_reader_output = vtk_nii_reader(dilate_tumor_mask_path)
+    if error_tag:
+        raise PlanningError(tumor_reader_output)
+
+    # 提取肿瘤点集pt
+    pt_array = extract_pt(tumor_reader_output, params.pt_sample_spacing)
+    print("肿瘤采样点集：", pt_array.shape[0])
+
+    # 聚类算法获取消融次数, 肿瘤靶向点, 消融半径
+    if params.large:
+        needles_num = params.needles_num
+        pt_centers, pt_predict = get_pt_center(pt_array, needles_num)
+        pt_radius = [_cluster_radius(pt_predict[i], pt_centers[i]) / 1.5 for i in range(needles_num)]
+    else:
+        needles_num = 1  # 初始化针数为1
+        while True:
+            pt_centers, pt_predict = get_pt_center(pt_array, needles_num)
+            pt_radius = [_cluster_radius(pt_predict[i], pt_centers[i]) for i in range(needles_num)]
+            if all(radius < params.max_ablation_radius for radius in pt_radius):
+                break
+            needles_num += 1
+    timings['target'] = time.perf_counter() - start
+
+    # ps点集提取
+    start = time.perf_counter()
+    skin_mask_path = intermediate_path(inputs.result_dir, 'skin_mask')  # 皮肤掩膜路径
+    skin_cache = SkinCache(inputs.skin_cache_dir) if inputs.skin_cache_dir else None  # 同一病例重复规划时复用皮肤分割结果
+    error_tag, ps_output = skin_point_set(inputs.ct_path, inputs.lung_trachea_mask_path, skin_mask_path,
+                                          inputs.extent, inputs.spacing, params.ps_rate, params.face_up, skin_cache)
+    if error_tag:
+        raise PlanningError(ps_output)
+    ps_array = ps_output
+    print("皮肤采样点集:", ps_array.shape[0])
+    timings['skin'] = time.perf_counter() - start
+
+    # 重要组织掩膜及其距离场, 各针共用, 重新规划时掩膜未修改则直接使用
+    start = time.perf_counter()
+    if not inputs.obstacle_mask_paths:
+        raise PlanningError("请先分割气管、血管或骨骼")
+    distance_cache = DistanceFieldCache(inputs.distance_cache_dir) if inputs.distance_cache_dir else None
+    obstacles = shared_field(inputs.obstacle_mask_paths, inputs.spacing, distance_cache)
+    fallback_obstacles = None
+    if inputs.fallback_obstacle_mask_paths:
+        fallback_obstacles = shared_field(inputs.fallback_obstacle_mask_paths, inputs.spacing, distance_cache)
+    lung_mask = shared_field([inputs.lung_mask_path], inputs.spacing).mask
+
+    # 针对每个靶向点，获取对应的进针点
+    entry_point_list = []
+    for i in range(needles_num):
+        print("#####################")
+        print("第", i, "针：")
+        entry_point_list.append(get_needle_entry_point(obstacles, fallback_obstacles, pt_centers[i], ps_array,
+                                                       params.max_needle_depth, lung_mask, inputs.spacing))
+    timings['entry'] = time.perf_counter() - start
+
+    # 创建消融区域并评估
+    start = time.perf_counter()
+    ablate_list = []
+    for i in range(needles_num):
+        if params.large:
+            radii = (pt_radius[i], pt_radius[i] / 1.2, pt_radius[i] / 1.2)
+        else:
+            radii = (pt_radius[i] * 1.2, pt_radius[i], pt_radius[i])
+        ablate_list.append(ablation_ellipsoid(pt_centers[i], entry_point_list[i], radii))
+
+    iou_list, ac_all, oa_all = evaluate_ablation(tumor_reader_output, ablate_list)
+    timings['evaluation'] = time.perf_counter() - start
+
+    return PlanningResult(needles_num=needles_num, entry_points=entry_point_list, pt_centers=pt_centers,
+                          pt_radius=pt_radius, iou_list=iou_list, ac_all=ac_all, oa_all=oa_all,
+                          ablate_list=ablate_list, dilate_tumor_mask_path=dilate_tumor_mask_path, timings=timings)
+
+
+def _cluster_radius(cluster, center):
+    return np.max(np.sqrt(np.sum((np.array(cluster) - center) ** 2, axis=-1)))
+
+
+def _angle_calculation(vector1, vector2):
+    data_m = np.sqrt(np.sum(vector1 * vector1))
+    data_n = np.sqrt(np.sum(vector2 * vector2))
+    cos_theta = np.sum(vector1 * vector2) / (data_m * data_n)
+    theta = np.degrees(np.arccos(cos_theta))
+    return theta
+
+
+def ablation_ellipsoid(pt_center, entry_point, radii):
+    """消融区域椭球, 长轴沿进针方向
+
+    Args:
+        pt_center: 肿瘤靶向点 -> 'list'
+        entry_point: 进针点, 1x3 -> 'numpy.ndarray'
+        radii: x(进针方向), y, z 半径 -> 'tuple'
+
+    Returns:
+        polydata: 椭球表面 -> 'vtkPolyData'
+    """
+
+    ellipsoid = vtk.vtkParametricEllipsoid()
+    ellipsoid.SetXRadius(radii[0])
+    ellipsoid.SetYRadius(radii[1])
+    ellipsoid.SetZRadius(radii[2])
+
+    ablate_ellipsoid = vtk.vtkParametricFunctionSource()
+    ablate_ellipsoid.SetParametricFunction(ellipsoid)
+    ablate_ellipsoid.Update()
+
+    vector1 = np.array([1, 0, 0])
+    vector2 = pt_center - entry_point
+    vector3 = np.array([vector2[0][0], vector2[0][1], 0])
+
+    angle1 = _angle_calculation(vector1, vector2)
+    angle2 = _angle_calculation(vector2, vector3)
+    print("角度：", angle1, angle2)
+
+    if vector2[0][1] < 0:
+        angle1 = 360 - angle1
+    if vector2[0][2] > 0:
+        angle2 = 360 - angle2
+
+    ellipsoid_trans = vtk.vtkTransform()
+    ellipsoid_trans.PreMultiply()
+    ellipsoid_trans.RotateZ(angle1)
+    ellipsoid_trans.RotateY(angle2)
+    ellipsoid_trans.PostMultiply()
+    ellipsoid_trans.Translate(pt_center)
+
+    transform_filter = vtk.vtkTransformPolyDataFilter()
+    transform_filter.SetInputConnection(ablate_ellipsoid.GetOutputPort())
+    transform_filter.SetTransform(ellipsoid_trans)
+    transform_filter.Update()
+
+    return transform_filter.GetOutput()
+
+
+def evaluate_ablation(tumor_image, ablate_list):
+    """计算消融覆盖率 AC 和过消融率 OA
+
+    Args:
+        tumor_image: 肿瘤掩膜(+安全边界) -> 'vtkImageData'
+        ablate_list: 每针的消融区域表面 -> 'list'
+
+    Returns:
+        iou_list: 每针的 [AC, OA] -> 'list'
+        ac_all: 总体 AC -> 'float'
+        oa_all: 总体 OA -> 'float'
+    """
+
+    needles_num = len(ablate_list)
+
+    # 计算消融小球体积
+    ablate_image_list = []
+    vol_list = []
+    for i in range(needles_num):
+        ablate_image = _polydata_to_imagedata(tumor_image.GetSpacing(), tumor_image.GetDimensions(),
+                                              tumor_image.GetOrigin(), ablate_list[i])
+        ablate_image_list.append(ablate_image)
+        vol_list.append(_calculate_volume(ablate_image))
+
+    # 计算肿瘤体积
+    tumor_array = vtk_to_numpy(tumor_image.GetPointData().GetScalars())
+    tumor_vol = np.sum(tumor_array)
+
+    # 计算iou
+    ablate_image_all = ablate_image_list[0]
+    ablate_vol_all = vol_list[0]
+    iou_list = []
+    esp = 0.0000001
+
+    if needles_num > 1:
+        for i in range(1, needles_num):
+            ablate_image_all = _bool_or(ablate_image_all, ablate_image_list[i])
+        ablate_vol_all = _calculate_volume(ablate_image_all)
+
+        for i in range(needles_num):
+            and_image = _bool_and(tumor_image, ablate_image_list[i])
+            and_volume = _calculate_volume(and_image)
+
+            ac = round(and_volume / (tumor_vol+esp), 2)
+            oa = round((vol_list[i] - and_volume) / (vol_list[i]+esp), 2)
+            iou_list.append([ac, oa])
+
+    and_image_all = _bool_and(tumor_image, ablate_image_all)
+    and_volume_all = _calculate_volume(and_image_all)
+
+    ac_all = round(and_volume_all / (tumor_vol+esp), 2)
+    oa_all = round((ablate_vol_all - and_volume_all) / (ablate_vol_all+esp), 2)
+
+    if needles_num == 1:
+        iou_list.append([ac_all, oa_all])
+
+    print("tumor_vol:", tumor_vol)
+    print("ablate_image_all:", ablate_vol_all)
+    print("and_volume_all:", and_volume_all)
+
+    return iou_list, ac_all, oa_all
+
+
+def _obstacle_free(obstacle_mask, spacing, pt_point, ps_array, needle_depth_array):
+    """皮肤点到靶向点的线段不经过重要组织掩膜的皮肤点及其进针深度, 所有线段一次性检查"""
+
+    keep = ~segments_hit(obstacle_mask, spacing, ps_array, pt_point)
+    return ps_array[keep], needle_depth_array[keep]
+
+
+def _normalize(values):
+    """线性归一化到 [0, 1], 所有值相同(包括只有一个值)时全部为 0, 该子目标不影响帕累托前沿"""
+
+    value_range = np.max(values) - np.min(values)
+    if not value_range > 0:
+        return np.zeros_like(values)
+    return (values - np.min(values)) / value_range
+
+
+def get_needle_entry_point(obstacles, fallback_obstacles, pt_point, ps_array, max_needle_depth, lung_mask, spacing):
+    """获取肿瘤靶向点对应的进针点
+
+    Args:
+        obstacles: 重要组织掩膜及其距离场 -> 'ObstacleField'
+        fallback_obstacles: 避开所有重要组织的路径太少时改用的重要组织, 为 None 时不改用 -> 'ObstacleField'
+        pt_point: 肿瘤靶向点 -> 'list'
+        ps_array: 皮肤点集 -> 'numpy.ndarray'
+        max_needle_depth: 最大进针深度 -> 'float'
+        lung_mask: zyx 顺序的肺掩膜, 见 mask_union -> 'numpy.ndarray'
+        spacing: 体素间距 -> 'tuple'
+
+    Returns:
+        best_ps: 帕累托最优的进针点, 1x3 -> 'numpy.ndarray'
+
+    Raises:
+        PlanningError: 没有满足约束的进针点
+    """
+
+    # 约束条件一：穿刺深度
+    needle_depth_array = np.sqrt(np.sum((ps_array-pt_point)**2, axis=-1))  # 计算各皮肤点到肿瘤中心点的距离
+    depth_mask = needle_depth_array <= max_needle_depth
+    ps_array = ps_array[depth_mask]
+    needle_depth_array = needle_depth_array[depth_mask]
+    print("约束1（进针深度）：", ps_array.shape[0])
+    if ps_array.shape[0] < 100:
+        raise PlanningError("请检查身体朝向是否设置正确，或者增大最大进针深度")
+
+    # 约束条件二：重要器官避障
+    free_ps_array, free_needle_depth_array = _obstacle_free(obstacles.mask, spacing, pt_point, ps_array,
+                                                            needle_depth_array)
+    if free_ps_array.shape[0] < 5 and fallback_obstacles is not None:
+        # 删除血管约束条件, 距离风险也改为到气管和骨骼的距离
+        obstacles = fallback_obstacles
+        free_ps_array, free_needle_depth_array = _obstacle_free(obstacles.mask, spacing, pt_point, ps_array,
+                                                                needle_depth_array)
+
+    ps_array = free_ps_array
+    needle_depth_array = free_needle_depth_array
+    print("约束2（重要组织避障）：", ps_array.shape[0])
+    if ps_array.shape[0] < 1:
+        raise PlanningError("无法避开重要组织，请尝试减小肿瘤点集采样间距或减小皮肤点集采样参数")
+
+    # 目标性条件一：重要器官距离风险子目标函数
+    # dvo -> 路径到重要器官的距离, 沿路径在距离场上采样取最小值, 所有路径一次性计算
+    # 与原来的 vtkLine.DistanceToLine 一致, 使用距离的平方, 并同样在 200(约 14mm) 截断
+    dvo_array = np.minimum(segments_min(obstacles.distance, spacing, ps_array, pt_point).astype(np.float64) ** 2, 200)
+    dvo_array = _normalize(dvo_array)
+    print("dvo_shape：", dvo_array.shape[0])
+
+    # 约束条件四：皮肤入刺角
+    # 目标性条件二：皮肤入刺角风险子目标函数
+
+    # 目标性条件三：胸壁厚度风险子目标函数
+    # 目标性条件四：肺内长度风险子目标函数
+    # 沿路径在肺掩膜上采样, 第一次进入肺的位置之前为胸壁厚度 cwt, 之后为肺内长度 pll, 所有路径一次性计算
+    lung_entry = segments_first_hit(lung_mask, spacing, ps_array, pt_point).astype(np.float64)
+    cwt_array = lung_entry * needle_depth_array  # cwt -> 胸壁厚度
+    pll_array = (1 - lung_entry) * needle_depth_array  # pll -> 肺内长度
+    outside_lung = np.isnan(lung_entry)  # 不经过肺的路径取经过肺的路径中的最大值
+    if outside_lung.all():
+        # 所有路径都不经过肺, 胸壁厚度和肺内长度无法比较, 两项都取 0
+        cwt_array[:] = 0
+        pll_array[:] = 0
+    elif outside_lung.any():
+        cwt_array[outside_lung] = np.max(cwt_array[~outside_lung])
+        pll_array[outside_lung] = np.max(pll_array[~outside_lung])
+
+    cwt_array = _normalize(cwt_array)
+    print("cwt_shape：", cwt_array.shape[0])
+
+    pll_array = _normalize(pll_array)
+    print("pll_shape：", pll_array.shape[0])
+
+    # 计算帕累托前沿
+    cost_array = np.stack((cwt_array, pll_array, dvo_array), axis=-1)
+    is_pareto_front = is_pareto_efficient(cost_array)
+    pareto_ps_array = ps_array[is_pareto_front, :]
+    pareto_cost_array = cost_array[is_pareto_front, :]
+    print("帕累托前沿：", pareto_ps_array.shape)
+
+    # 计算最优穿刺路径，可自定义每个目标函数的比率，这里取平均
+    pareto_score = np.mean(pareto_cost_array, axis=1)
+    min_index = np.where(pareto_score==np.min(pareto_score))
+    best_ps = pareto_ps_array[min_index]
+    print("帕累托最优前沿:", best_ps)
+
+    return best_ps
+
+
+def _polydata_to_imagedata(spacing, dim, origin, data):
+    white_image = vtk.vtkImageData()
+    white_image.SetSpacing(spacing)
+    white_image.SetDimensions(dim)
+    white_image.SetExtent(0, dim[0] - 1, 0, dim[1] - 1, 0, dim[2] - 1)
+    white_image.SetOrigin(origin)
+    white_image.AllocateScalars(vtk.VTK_UNSIGNED_CHAR, 1)
+
+    pol2stenc = vtk.vtkPolyDataToImageStencil()
+    pol2stenc.SetInputData(data)
+    pol2stenc.SetOutputOrigin(origin)
+    pol2stenc.SetOutputSpacing(spacing)
+    pol2stenc.SetOutputWholeExtent(white_image.GetExtent())
+    pol2stenc.Update()
+
+    imgstenc = vtk.vtkImageStencil()
+    imgstenc.SetInputData(white_image)
+    imgstenc.SetStencilConnection(pol2stenc.GetOutputPort())
+    imgstenc.ReverseStencilOn()
+    imgstenc.SetBackgroundValue(1)
+    imgstenc.Update()
+
+    return imgstenc.GetOutput()
+
+
+def _bool_or(data1, data2):
+    image_or = vtk.vtkImageLogic()
+    image_or.SetInput1Data(data1)
+    image_or.SetInput2Data(data2)
+    image_or.SetOperationToOr()
+    image_or.SetOutputTrueValue(1)
+    image_or.Update()
+
+    return image_or.GetOutput()
+
+
+def _bool_and(data1, data2):
+    image_and = vtk.vtkImageLogic()
+    image_and.SetInput1Data(data1)
+    image_and.SetInput2Data(data2)
+    image_and.SetOperationToAnd()
+    image_and.SetOutputTrueValue(1)
+    image_and.Update()
+
+    return image_and.GetOutput()
+
+
+def _calculate_volume(data):
+    scalars = data.GetPointData().GetScalars()
+    array = vtk_to_numpy(scalars)
+    volume = sum(array)
+
+    return volume
@@ -1,4 +1,7 @@
 import vtk
+from utils.volume_cache import volume_cache
+from utils.vtk_bridge import array_to_vtk_image
+from utils.storage import read_array
 
 
 class ErrorObserver:
@@ -44,17 +47,44 @@ def vtk_nii_reader(path):
     """
 
     error_tag = False
-    error_observer = ErrorObserver()
-    reader = vtk.vtkNIFTIImageReader()
-    reader.AddObserver('ErrorEvent', error_observer)
-    reader.SetFileName(path)
-    reader.Update()
+    image_data = volume_cache.get(path, 'vtk')
+    if image_data is None and path.endswith('.npy'):
+        try:
+            image_data = npy_to_vtk_image(path)
+        except (OSError, ValueError) as e:
+            error_tag = True
+            return error_tag, str(e)
+        volume_cache.put(path, 'vtk', image_data, image_data.GetActualMemorySize() * 1024)
+    elif image_data is None:
+        # 与 SimpleITK 图像共用一次解码(例如导入的CT已被分割读取过), 不再用 vtkNIFTIImageReader 解码第二次
+        try:
+            image_data = volume_cache.read_vtk_image(path)
+        except RuntimeError as e:
+            error_tag = True
+            return error_tag, str(e)
+
+    # 浅拷贝, 与缓存共用像素数据
+    output = vtk.vtkImageData()
+    output.ShallowCopy(image_data)
+    return error_tag, output
+
+
+def npy_to_vtk_image(path):
+    """把 utils.storage 写的 .npy 中间结果转为 vtkImageData, 不需要翻转时像素数据直接使用 memmap,
+    只有访问到的部分才会从磁盘读入
 
-    if error_observer.ErrorOccurred():
-        error_tag = True
-        return error_tag, str(error_observer.ErrorMessage())
-    else:
-        return error_tag, reader.GetOutput()
+    Args:
+        path: 文件路径 -> 'str'
+
+    Returns:
+        image_data: 图像 -> 'vtkmodules.vtkCommonDataModel.vtkImageData'
+
+    Raises:
+        OSError: npy 或几何信息文件不存在
+    """
+
+    array, geometry = read_array(path)
+    return array_to_vtk_image(array, geometry['spacing'], geometry['direction'], array)
 
 
 def vtk_dicom_reader(path):
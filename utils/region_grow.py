@@ -0,0 +1,460 @@
+import itertools
+import numpy as np
+
+try:
+    import numba
+except ImportError:  # 没有安装 numba 时使用 NumPy 按层批量实现
+    numba = None
+
+
+# 26邻域偏移表(不含中心点), 每个偏移只出现一次
+NEIGHBOR_OFFSETS_26 = np.array([offset for offset in itertools.product((-1, 0, 1), repeat=3)
+                                if offset != (0, 0, 0)], dtype=np.int64)
+
+# 一次处理的最大前沿点数, 限制 (前沿点数 x 26) 临时数组的内存
+FRONTIER_CHUNK = 1 << 16
+
+# 逐点判断候选点序列时一块的最小、最大长度
+SEQUENCE_BLOCK_MIN = 64
+SEQUENCE_BLOCK_MAX = 1 << 15
+
+
+def _flat_view(gray_img):
+    """获取图像的一维视图及其展开顺序, 能不复制时不复制
+
+    Args:
+        gray_img: 三维图像数组 -> 'numpy.ndarray'
+
+    Returns:
+        flat: 一维视图 -> 'numpy.ndarray'
+        order: 展开顺序, 'C' 或 'F' -> 'str'
+    """
+
+    if gray_img.flags.c_contiguous:
+        return gray_img.reshape(-1), 'C'
+    if gray_img.flags.f_contiguous:  # 例如 zyx 数组 transpose((2, 1, 0)) 后的 xyz 数组
+        return gray_img.reshape(-1, order='F'), 'F'
+    return np.ascontiguousarray(gray_img).reshape(-1), 'C'
+
+
+def _flat_steps(shape, order):
+    """各坐标轴加1时一维索引的增量"""
+
+    if order == 'C':
+        return np.array([shape[1] * shape[2], shape[2], 1], dtype=np.int64)
+    return np.array([1, shape[0], shape[0] * shape[1]], dtype=np.int64)
+
+
+def _test_bits(bits, index):
+    """查询位图中 index 对应的位是否为1"""
+
+    return ((bits[index >> 3] >> (index & 7).astype(np.uint8)) & 1).astype(bool)
+
+
+def _set_bits(bits, index):
+    """把位图中 index 对应的位置1, index 需升序且不重复"""
+
+    if index.size == 0:
+        return
+    byte_index = index >> 3
+    bit_value = np.left_shift(np.uint8(1), (index & 7).astype(np.uint8))
+    # index 升序不重复, 同一字节内的各位互不相同, 按字节求和等价于按位或
+    start = np.flatnonzero(np.diff(byte_index, prepend=-1))
+    bits[byte_index[start]] |= np.add.reduceat(bit_value, start).astype(np.uint8)
+
+
+def _neighbors(frontier, shape, order, offsets, flat_offsets):
+    """计算前沿点的所有合法邻域点的一维索引(可能重复)
+
+    顺序与逐点队列实现相同: 依次取前沿点, 每个前沿点按偏移表的顺序取邻域点.
+    """
+
+    candidate_list = []
+    for start in range(0, frontier.size, FRONTIER_CHUNK):
+        chunk = frontier[start:start + FRONTIER_CHUNK]
+        coords = np.unravel_index(chunk, shape, order=order)
+        candidate = chunk[:, None] + flat_offsets[None, :]
+
+        # 不在边界上的点, 所有邻域点都合法; 边界上的点逐个偏移判断是否越界
+        inner = np.ones(chunk.size, dtype=bool)
+        for axis in range(3):
+            inner &= (coords[axis] > 0) & (coords[axis] < shape[axis] - 1)
+        if inner.all():
+            candidate_list.append(candidate.ravel())
+            continue
+
+        edge = ~inner
+        valid = np.ones(candidate.shape, dtype=bool)
+        edge_valid = valid[edge]
+        for axis in range(3):
+            moved = coords[axis][edge][:, None] + offsets[None, :, axis]
+            edge_valid &= (moved >= 0) & (moved < shape[axis])
+        valid[edge] = edge_valid
+        candidate_list.append(candidate[valid])  # 按行展开, 保持顺序
+
+    return np.concatenate(candidate_list)
+
+
+def _first_accept(candidate, accept):
+    """每个点在 accept 为真的位置中第一次出现的位置, 即实际生长的位置
+
+    Returns:
+        grown: 实际生长的位置 -> 'numpy.ndarray'(bool)
+        grown_index: 生长的点, 升序 -> 'numpy.ndarray'
+        grown_position: 生长的点所在的位置 -> 'numpy.ndarray'
+    """
+
+    position = np.flatnonzero(accept)
+    grown_index, first = np.unique(candidate[position], return_index=True)
+    grown_position = position[first]
+    grown = np.zeros(candidate.size, dtype=bool)
+    grown[grown_position] = True
+    return grown, grown_index, grown_position
+
+
+def _grow_sequence(flat, bits, candidate, threshold, points_num, points_sum, block=SEQUENCE_BLOCK_MIN):
+    """按顺序逐点判断一个候选点序列, 每生长一个点更新一次区域均值
+
+    逐点判断的结果只与它之前生长的点有关. 先猜测每个位置是否生长(第一轮用当前均值判断),
+    由猜测结果的累加和得到每个位置判断时的区域均值, 重新判断; 第一个与猜测不一致的位置之前
+    的猜测都是正确的, 该位置的重新判断也是正确的, 提交到该位置为止, 剩余部分以重新判断的结果
+    作为猜测继续. 区域均值变化缓慢, 一般一轮即可提交整块. 块大小根据是否整块提交自适应调整.
+
+    Args:
+        flat: 灰度图像的一维视图 -> 'numpy.ndarray'
+        bits: 已生长点位图, 原地更新 -> 'numpy.ndarray'
+        candidate: 按逐点实现的判断顺序排列的候选点一维索引, 可能重复 -> 'numpy.ndarray'
+        threshold: 阈值 -> 'float'
+        points_num: 已生长点个数 -> 'int'
+        points_sum: 已生长点灰度之和 -> 'float'
+        block: 初始块大小 -> 'int'
+
+    Returns:
+        grown: 本次生长的点, 按生长顺序排列 -> 'numpy.ndarray'
+        points_num: 生长点个数 -> 'int'
+        points_sum: 生长点灰度之和 -> 'float'
+        block: 结束时的块大小, 作为下一个序列的初始块大小 -> 'int'
+    """
+
+    grown_list = []
+    start = 0
+    carry = None  # 上一块未提交部分的重新判断结果
+    while start < candidate.size:
+        index = candidate[start:start + block]
+        data = flat[index].astype(np.float64)
+        alive = ~_test_bits(bits, index)  # 是否已经被生长(包括本序列中已提交的部分)
+
+        guess = np.abs(data - points_sum / points_num) < threshold
+        if carry is not None:
+            guess[:carry.size] = carry[:guess.size]
+        guess, guess_index, guess_position = _first_accept(index, guess & alive)
+
+        # 每个位置判断时的区域均值: 已生长的点加上本块中该位置之前(猜测)生长的点
+        grown_data = np.where(guess, data, 0.0)
+        num = points_num + np.cumsum(guess) - guess
+        total = points_sum + np.cumsum(grown_data) - grown_data
+        accept = (np.abs(data - total / num) < threshold) & alive
+
+        # 该位置之前(猜测)已经生长过的点不再生长
+        actual = accept.copy()
+        position = np.flatnonzero(accept)
+        if guess_index.size and position.size:
+            found = np.minimum(np.searchsorted(guess_index, index[position]), guess_index.size - 1)
+            prior = (guess_index[found] == index[position]) & (guess_position[found] < position)
+            actual[position[prior]] = False
+
+        mismatch = np.flatnonzero(actual != guess)
+        commit = int(mismatch[0]) + 1 if mismatch.size else index.size
+        new_index = index[:commit][actual[:commit]]
+        grown_list.append(new_index)
+        points_num += new_index.size
+        points_sum += data[:commit][actual[:commit]].sum()
+        _set_bits(bits, np.sort(new_index))
+
+        start += commit
+        if commit == index.size:
+            carry = None
+            block = min(block * 2, SEQUENCE_BLOCK_MAX)
+        else:
+            carry = accept[commit:]
+            block = max(block // 2, SEQUENCE_BLOCK_MIN)
+
+    grown = np.concatenate(grown_list) if grown_list else candidate[:0]
+    return grown, points_num, points_sum, block
+
+
+def _queue_pass(flat, shape, steps, offsets, flat_offsets, threshold, max_points, grown, queue, head, tail,
+                layer_end, points_num, points_sum):
+    """逐点队列实现的区域生长, 由 numba 编译, 判断条件和顺序与 _grow_sequence 相同
+
+    处理队列直到队列为空、达到 max_points 或队列剩余空间不够一个点的所有邻域点. 队列不在循环中替换,
+    编译后的循环不需要每次重新读取队列的内存地址, 队列的扩大由 _grow_queue 完成.
+
+    Args:
+        flat: 灰度图像的一维视图 -> 'numpy.ndarray'
+        shape: 图像大小 -> 'numpy.ndarray'(int64)
+        steps: 各坐标轴加1时一维索引的增量 -> 'numpy.ndarray'(int64)
+        offsets: 邻域偏移表 -> 'numpy.ndarray'(int64)
+        flat_offsets: 邻域偏移对应的一维索引增量 -> 'numpy.ndarray'(int64)
+        threshold: 阈值 -> 'float'
+        max_points: 生长点数上限, 小于0时不限制 -> 'int'
+        grown: 已生长点, 一维, 原地更新 -> 'numpy.ndarray'(uint8)
+        queue: 队列 -> 'numpy.ndarray'(int64)
+        head, tail: 队首、队尾位置 -> 'int'
+        layer_end: 当前层在队列中的结束位置 -> 'int'
+        points_num: 已生长点个数 -> 'int'
+        points_sum: 已生长点灰度之和 -> 'float'
+
+    Returns:
+        stopped: 是否因为达到 max_points 而停止 -> 'bool'
+        head, tail, layer_end, points_num, points_sum: 更新后的状态
+    """
+
+    points_mean = points_sum / points_num  # 只在生长时更新, 每个候选点不再做除法
+    while head < tail:
+        if head == layer_end:
+            if 0 <= max_points < points_num:
+                return True, head, tail, layer_end, points_num, points_sum
+            layer_end = tail
+        if tail + offsets.shape[0] > queue.size:
+            break
+        index = queue[head]
+        head += 1
+
+        # 不在边界上的点, 所有邻域点都合法; 边界上的点逐个偏移判断是否越界
+        c0 = (index // steps[0]) % shape[0]
+        c1 = (index // steps[1]) % shape[1]
+        c2 = (index // steps[2]) % shape[2]
+        inner = 0 < c0 < shape[0] - 1 and 0 < c1 < shape[1] - 1 and 0 < c2 < shape[2] - 1
+        for k in range(offsets.shape[0]):
+            if not inner and not (0 <= c0 + offsets[k, 0] < shape[0] and 0 <= c1 + offsets[k, 1] < shape[1]
+                                  and 0 <= c2 + offsets[k, 2] < shape[2]):
+                continue
+            neighbor = index + flat_offsets[k]
+            if grown[neighbor]:
+                continue
+
+            value = float(flat[neighbor])
+            if abs(value - points_mean) < threshold:
+                grown[neighbor] = 1
+                points_num += 1
+                points_sum += value
+                points_mean = points_sum / points_num
+                queue[tail] = neighbor
+                tail += 1
+
+    return False, head, tail, layer_end, points_num, points_sum
+
+
+if numba is not None:
+    _queue_pass = numba.njit(cache=True, nogil=True)(_queue_pass)
+
+
+def _grow_queue(flat, shape, order, offsets, seed_index, threshold, max_points, grown):
+    """逐点队列实现的区域生长, 见 _queue_pass. 队列满时先把已出队的部分移走, 仍不够再扩大一倍
+
+    队列中同一层的点连续出队, 一层出队完毕时生长点数超过 max_points 则停止, 与按层批量实现相同.
+
+    Args:
+        flat: 灰度图像的一维视图 -> 'numpy.ndarray'
+        shape: 图像大小 -> 'tuple'
+        order: 展开顺序, 'C' 或 'F' -> 'str'
+        offsets: 邻域偏移表 -> 'numpy.ndarray'(int64)
+        seed_index: 种子点的一维索引 -> 'int'
+        threshold: 阈值 -> 'float'
+        max_points: 生长点数上限, 为 None 时不限制 -> 'int'
+        grown: 已生长点, 一维, 原地更新, 直接作为输出的二值图像 -> 'numpy.ndarray'(uint8)
+
+    Returns:
+        points_num: 生长点个数 -> 'int'
+    """
+
+    steps = _flat_steps(shape, order)
+    shape = np.array(shape, dtype=np.int64)
+    flat_offsets = offsets @ steps
+    max_points = -1 if max_points is None else int(max_points)
+
+    queue = np.empty(1 << 16, dtype=np.int64)
+    queue[0] = seed_index
+    grown[seed_index] = 1
+    head, tail, layer_end = 0, 1, 1
+    points_num, points_sum = 1, float(flat[seed_index])
+    while True:
+        stopped, head, tail, layer_end, points_num, points_sum = _queue_pass(
+            flat, shape, steps, offsets, flat_offsets, float(threshold), max_points, grown, queue, head, tail,
+            layer_end, points_num, points_sum)
+        if stopped or head == tail:
+            return int(points_num)
+        if head < queue.size // 2:
+            queue = np.concatenate([queue, np.empty_like(queue)])
+        queue[:tail - head] = queue[head:tail]
+        tail -= head
+        layer_end -= head
+        head = 0
+
+
+def region_growing(gray_img, seed, threshold, offsets=NEIGHBOR_OFFSETS_26, max_points=None):
+    """26邻域区域生长, 安装了 numba 时用编译的逐点队列实现(见 _grow_queue), 否则按层批量处理前沿点
+
+    与逐点队列实现的判断条件和顺序相同: 邻域点灰度与当前区域均值之差的绝对值小于阈值则生长,
+    每生长一个点更新一次区域均值. 没有 numba 时, 队列中同一层的前沿点连续出队, 每一层按出队顺序展开
+    为候选点序列后用 NumPy 分块逐点判断(见 _grow_sequence). 区域均值由灰度之和除以点数得到, 与逐点
+    实现的递推公式只有浮点舍入误差的差别. 已生长的点记录在按位压缩的位图中, 未通过判断的点
+    不标记, 之后仍可能被其他邻域点生长.
+
+    Args:
+        gray_img: 灰度图像, 三维数组 -> 'numpy.ndarray'
+        seed: 生长起始点的位置 -> 'tuple'
+        threshold: 阈值 -> 'float'
+        offsets: 邻域偏移表, 默认26邻域 -> 'numpy.ndarray'
+        max_points: 生长点数超过该值后不再生长下一层, 此时只有生长点数超过 max_points 这一结论是确定的,
+                    为 None 时生长到结束 -> 'int'
+
+    Returns:
+        out_img: 取值为{0, 1}的二值图像 -> 'numpy.ndarray'(uint8)
+        points_num: 生长点个数 -> 'int'
+
+    Raises:
+        None
+    """
+
+    shape = gray_img.shape[0:3]
+    flat, order = _flat_view(gray_img)
+    # 一维索引尽量用 int32, 减少临时数组的内存带宽
+    index_type = np.int32 if flat.size < np.iinfo(np.int32).max else np.int64
+    offsets = np.asarray(offsets, dtype=np.int64)
+    flat_offsets = (offsets @ _flat_steps(shape, order)).astype(index_type)
+
+    seed_index = np.ravel_multi_index(tuple(int(s) for s in seed[0:3]), shape, order=order)
+
+    if numba is not None:
+        # 直接在输出图像上标记已生长点, 不需要位图和展开
+        out_img = np.zeros(flat.size, dtype=np.uint8)
+        points_num = _grow_queue(flat, shape, order, offsets, int(seed_index), threshold, max_points, out_img)
+        return out_img.reshape(shape, order=order), points_num
+
+    # 已生长点位图, 每个体素占1位
+    bits = np.zeros((flat.size + 7) // 8, dtype=np.uint8)
+
+    frontier = np.array([seed_index], dtype=index_type)
+    _set_bits(bits, frontier)
+
+    points_num = 1
+    points_sum = float(flat[seed_index])
+
+    block = SEQUENCE_BLOCK_MIN
+    while frontier.size > 0 and (max_points is None or points_num <= max_points):
+        candidate = _neighbors(frontier, shape, order, offsets, flat_offsets)
+        candidate = candidate[~_test_bits(bits, candidate)]  # 层开始前已经被生长的点
+        # 下一层的前沿点保持生长顺序, 与逐点队列的出队顺序相同
+        frontier, points_num, points_sum, block = _grow_sequence(flat, bits, candidate, threshold,
+                                                                 points_num, points_sum, block)
+
+    out_img = np.unpackbits(bits, count=flat.size, bitorder='little').reshape(shape, order=order)
+
+    return out_img, points_num
+
+
+def threshold_sweep(gray_img, seed, max_points=100000, pointsnum_min=20000, offsets=NEIGHBOR_OFFSETS_26):
+    """一次遍历完成阈值扫描, 寻找最佳阈值及其生长结果
+
+    按体素生长所需的阈值由小到大依次生长(分层的优先队列漫水): 阈值为 t 时, 区域边界上与当前区域均值之差
+    的绝对值小于 t 的点生长, 每一波生长后更新区域均值, 再从新生长的点和边界继续, 直到没有点满足条件;
+    阈值增加到 t + 1 时只需从上一次的边界继续生长. 每个体素只被生长一次, 一次遍历同时得到
+    阈值-生长点数 曲线、停止的阈值和最佳阈值下的掩膜.
+
+    原实现每个阈值都从种子点按区域均值重新生长, 这里阈值 t 的区域在阈值 t - 1 的区域上继续生长, 区域均值
+    按波而不是按点更新, 生长点数和选出的阈值与原实现接近但不保证相同, 见 benchmark.bench_threshold_sweep.
+
+    停止条件与原实现相同: 第一次有效生长(增长率 > 0.9)之后, 若增长率 > 0.1 且上一阈值的生长点数
+    > pointsnum_min, 或生长点数超过 max_points(泄漏), 取上一个阈值. 生长点数一旦超过 max_points 立即停止.
+
+    Args:
+        gray_img: 灰度图像, 三维数组 -> 'numpy.ndarray'
+        seed: 生长起始点的位置 -> 'tuple'
+        max_points: 生长点数上限, 超过则认为已经泄漏 -> 'int'
+        pointsnum_min: 判断泄漏时上一阈值生长点数的下限 -> 'int'
+        offsets: 邻域偏移表, 默认26邻域 -> 'numpy.ndarray'
+
+    Returns:
+        best_threshold: 最佳阈值 -> 'int'
+        out_img: 最佳阈值下取值为{0, 1}的二值图像 -> 'numpy.ndarray'(uint8)
+        points_num: 最佳阈值下的生长点数 -> 'int'
+        points_curve: 各阈值下的生长点数, 下标为阈值 -> 'list'
+
+    Raises:
+        None
+    """
+
+    shape = gray_img.shape[0:3]
+    flat, order = _flat_view(gray_img)
+    index_type = np.int32 if flat.size < np.iinfo(np.int32).max else np.int64
+    offsets = np.asarray(offsets, dtype=np.int64)
+    flat_offsets = (offsets @ _flat_steps(shape, order)).astype(index_type)
+
+    bits = np.zeros((flat.size + 7) // 8, dtype=np.uint8)
+
+    seed_index = np.ravel_multi_index(tuple(int(s) for s in seed[0:3]), shape, order=order)
+    frontier = np.array([seed_index], dtype=index_type)
+    _set_bits(bits, frontier)
+    # 每个阈值新生长的点, 用于最后生成最佳阈值的掩膜
+    grown_list = [frontier]
+    points_num = 1
+    points_sum = float(flat[seed_index])
+    points_curve = [points_num]
+
+    # 区域边界上尚未生长的点, 升序不重复
+    pending = np.unique(_neighbors(frontier, shape, order, offsets, flat_offsets))
+
+    threshold = 0
+    old_point_num = 1
+    seg_start = 0  # 第一次生长模式, 一般都会有超过0.9以上的增加率
+    while True:
+        add_pointsNum = points_num - old_point_num
+        Lt = add_pointsNum / points_num
+        if (Lt > 0.1 and seg_start == 1 and old_point_num > pointsnum_min) or points_num > max_points:
+            break
+        if pending.size == 0:  # 区域已无法继续生长
+            threshold += 1
+            break
+
+        threshold += 1
+        old_point_num = points_num
+        if Lt > 0.9:
+            seg_start = 1
+
+        level_list = []
+        while points_num <= max_points:
+            # 边界上满足当前阈值的点, 区域均值变化后之前不满足的点也可能满足
+            take = np.abs(flat[pending] - points_sum / points_num) < threshold
+            if not take.any():
+                break
+            frontier = pending[take]
+            pending_list = [pending[~take]]
+            while frontier.size > 0:
+                _set_bits(bits, frontier)
+                level_list.append(frontier)
+                points_num += frontier.size
+                points_sum += flat[frontier].sum(dtype=np.float64)
+                if points_num > max_points:  # 泄漏, 提前停止
+                    break
+
+                candidate = _neighbors(frontier, shape, order, offsets, flat_offsets)
+                candidate = np.unique(candidate[~_test_bits(bits, candidate)])
+                accept = np.abs(flat[candidate] - points_sum / points_num) < threshold
+                pending_list.append(candidate[~accept])
+                frontier = candidate[accept]
+
+            pending = np.unique(np.concatenate(pending_list))
+            pending = pending[~_test_bits(bits, pending)]
+
+        grown_list.append(np.concatenate(level_list) if level_list else frontier[:0])
+        points_curve.append(points_num)
+
+    best_threshold = threshold - 1
+    best_index = np.concatenate(grown_list[:best_threshold + 1])
+    out_img = np.zeros(flat.size, dtype=np.uint8)
+    out_img[best_index] = 1
+    out_img = out_img.reshape(shape, order=order)
+
+    return best_threshold, out_img, int(best_index.size), points_curve
@@ -0,0 +1,221 @@
+import os
+import json
+
+
+# 默认配置, 线程数为 0 时使用全部核心
+DEFAULTS = {
+    'itk_threads': 0,  # ITK / SimpleITK 全局线程数
+    'vtk_smp_backend': '',  # VTK SMP 后端: Sequential / STDThread / TBB / OpenMP, 为空时使用编译时的默认后端
+    'vtk_threads': 0,  # VTK SMP 线程数
+    'blas_threads': 0,  # NumPy/BLAS/OpenMP 线程数
+    'process_workers': 4,  # 进程池最大进程数
+    'nnunet_preprocessing_threads': 6,  # nnU-Net 预处理进程数
+    'nnunet_save_threads': 2,  # nnU-Net 保存结果进程数
+    'volume_cache_mb': 2048,  # 体数据缓存上限(MB), 见 utils.volume_cache
+    'intermediate_format': 'nii',  # 中间结果格式: nii.gz / nii / npy, 见 utils.storage
+    'vessel_multi_scale': 0,  # 血管分割是否使用多尺度(sigma 1~4, 5个尺度): 0 / 1, 见 src.seg.VesselSegThread
+}
+
+# 只能取固定值的配置项, intermediate_format 与 utils.storage.INTERMEDIATE_FORMATS 一致
+CHOICES = {
+    'intermediate_format': ('nii.gz', 'nii', 'npy'),
+    'vessel_multi_scale': (0, 1),
+}
+
+# 配置文件路径的环境变量, 未设置时读取当前目录下的 runtime_config.json
+CONFIG_PATH_ENV = 'PLANNING_RUNTIME_CONFIG'
+CONFIG_FILE_NAME = 'runtime_config.json'
+
+# 环境变量前缀, 例如 PLANNING_ITK_THREADS=16, 优先于配置文件
+ENV_PREFIX = 'PLANNING_'
+
+# 控制 BLAS/OpenMP 线程数的环境变量, 必须在导入 numpy 之前设置
+BLAS_ENV_VARS = ('OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS', 'VECLIB_MAXIMUM_THREADS',
+                 'NUMEXPR_NUM_THREADS')
+
+_config = dict(DEFAULTS)
+_config_source = 'defaults'
+
+
+def cpu_count():
+    """当前进程可用的核心数"""
+
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def load_runtime_config(path=None):
+    """读取运行配置: 默认值 < 配置文件 < 环境变量
+
+    Args:
+        path: 配置文件路径, 为 None 时依次使用环境变量 PLANNING_RUNTIME_CONFIG、当前目录下的 runtime_config.json
+              -> 'str'
+
+    Returns:
+        config: 配置 -> 'dict'
+        source: 配置来源, 用于诊断输出 -> 'str'
+
+    Raises:
+        ValueError: 配置文件中有未知的配置项, 或者数值不合法
+    """
+
+    config = dict(DEFAULTS)
+    sources = ['defaults']
+
+    if path is None:
+        path = os.environ.get(CONFIG_PATH_ENV, os.path.join(os.getcwd(), CONFIG_FILE_NAME))
+    if os.path.isfile(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            file_config = json.load(f)
+        unknown = set(file_config) - set(DEFAULTS)
+        if unknown:
+            raise ValueError("未知的配置项: {}".format(sorted(unknown)))
+        config.update(file_config)
+        sources.append(path)
+
+    for name in DEFAULTS:
+        value = os.environ.get(ENV_PREFIX + name.upper())
+        if value is not None:
+            config[name] = value
+            sources.append(ENV_PREFIX + name.upper())
+
+    for name, default in DEFAULTS.items():
+        if isinstance(default, int):
+            config[name] = int(config[name])
+            if config[name] < 0:
+                raise ValueError("{} 不能小于 0".format(name))
+        else:
+            config[name] = str(config[name])
+    for name, choices in CHOICES.items():
+        if config[name] not in choices:
+            raise ValueError("{} 只能是 {}: {}".format(name, ' / '.join(map(str, choices)), config[name]))
+
+    return config, ', '.join(sources)
+
+
+def _threads(value):
+    return value if value > 0 else cpu_count()
+
+
+def apply_runtime_config(config=None, source=None):
+    """在程序启动时应用运行配置, 应在导入 numpy 等库之前调用, 否则 BLAS 线程数不生效
+
+    Args:
+        config: 配置, 为 None 时调用 load_runtime_config() 读取 -> 'dict'
+        source: 配置来源 -> 'str'
+
+    Returns:
+        config: 生效的配置 -> 'dict'
+
+    Raises:
+        ValueError: 配置不合法
+    """
+
+    global _config, _config_source
+
+    if config is None:
+        config, source = load_runtime_config()
+    _config = dict(config)
+    _config_source = source or 'runtime'
+
+    # BLAS 线程数通过环境变量设置, spawn 出的子进程也会继承
+    if config['blas_threads'] > 0:
+        for name in BLAS_ENV_VARS:
+            os.environ[name] = str(config['blas_threads'])
+
+    set_library_threads(_threads(config['itk_threads']))
+
+    import vtk
+    if config['vtk_smp_backend']:
+        if not vtk.vtkSMPTools.SetBackend(config['vtk_smp_backend']):
+            print("VTK SMP 后端不可用:", config['vtk_smp_backend'])
+    vtk.vtkSMPTools.Initialize(_threads(config['vtk_threads']))
+
+    return _config
+
+
+def set_library_threads(threads):
+    """设置 ITK / SimpleITK 全局默认线程数, 进程池的子进程中也需要调用"""
+
+    import SimpleITK as sitk
+    sitk.ProcessObject.SetGlobalDefaultNumberOfThreads(threads)
+    try:
+        import itk
+    except ImportError:
+        return
+    itk.MultiThreaderBase.SetGlobalDefaultNumberOfThreads(threads)
+
+
+def runtime_config(name):
+    """读取一项配置"""
+
+    return _config[name]
+
+
+def pool_workers(limit=None):
+    """进程池的进程数, 不超过配置的 process_workers, 核心数和 limit"""
+
+    workers = min(_config['process_workers'] or cpu_count(), cpu_count())
+    if limit is not None:
+        workers = min(workers, limit)
+    return max(1, workers)
+
+
+def worker_threads(workers):
+    """进程池中每个子进程的 ITK 线程数, 各子进程平分 itk_threads, 避免超额占用核心"""
+
+    return max(1, _threads(_config['itk_threads']) // max(1, workers))
+
+
+def pool_initargs(workers):
+    """进程池 initializer(init_pool_worker) 的参数: 每个子进程的线程数和父进程的配置
+
+    spawn 出的子进程重新导入本模块, 配置为默认值, 需要由 initializer 传入父进程读取的配置,
+    子进程中的 intermediate_format、volume_cache_mb 等才与父进程一致.
+    """
+
+    return worker_threads(workers), dict(_config), _config_source
+
+
+def init_pool_worker(threads, config=None, source=None):
+    """进程池子进程的 initializer, 应用父进程的配置, ITK 和 VTK 线程数改为平分后的 threads
+
+    Args:
+        threads: 子进程的线程数, 见 worker_threads -> 'int'
+        config: 父进程的配置, 为 None 时只设置 ITK 线程数 -> 'dict'
+        source: 配置来源 -> 'str'
+    """
+
+    if config is None:
+        set_library_threads(threads)
+        return
+    apply_runtime_config(dict(config, itk_threads=threads, vtk_threads=threads), source)
+
+
+def runtime_diagnostics():
+    """运行配置及各库实际生效的线程设置, 用于诊断输出
+
+    Returns:
+        lines: 每行一项 -> 'str'
+    """
+
+    import vtk
+    import SimpleITK as sitk
+
+    lines = ["运行配置 ({})".format(_config_source), "  cpu_count: {}".format(cpu_count())]
+    for name in DEFAULTS:
+        lines.append("  {}: {}".format(name, _config[name]))
+
+    lines.append("  SimpleITK threads: {}".format(sitk.ProcessObject.GetGlobalDefaultNumberOfThreads()))
+    try:
+        import itk
+        lines.append("  ITK threads: {}".format(itk.MultiThreaderBase.GetGlobalDefaultNumberOfThreads()))
+    except ImportError:
+        pass
+    lines.append("  VTK SMP: {}, {} threads".format(vtk.vtkSMPTools.GetBackend(),
+                                                    vtk.vtkSMPTools.GetEstimatedNumberOfThreads()))
+    for name in BLAS_ENV_VARS:
+        if name in os.environ:
+            lines.append("  {}: {}".format(name, os.environ[name]))
+    return '\n'.join(lines)
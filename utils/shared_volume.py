@@ -0,0 +1,75 @@
+from multiprocessing import shared_memory
+import numpy as np
+import SimpleITK as sitk
+
+
+class SharedVolume:
+    """共享内存中的体数据(zyx 数组)及其几何信息
+
+    在进程间传递时只序列化共享内存的名字、形状、类型和几何信息, 不复制体素数据.
+    创建者负责 unlink, 其他进程用完后 close.
+    """
+
+    def __init__(self, name, shape, dtype, spacing=(1.0, 1.0, 1.0), origin=(0.0, 0.0, 0.0),
+                 direction=(1.0, 0.0, 0.0, 0.0, 1.0, 0.0, 0.0, 0.0, 1.0), create=False):
+        self.name = name
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.spacing = tuple(spacing)
+        self.origin = tuple(origin)
+        self.direction = tuple(direction)
+
+        nbytes = max(int(np.prod(self.shape)) * self.dtype.itemsize, 1)
+        self._shm = shared_memory.SharedMemory(name=name, create=create, size=nbytes if create else 0)
+        self.name = self._shm.name
+        self.array = np.ndarray(self.shape, dtype=self.dtype, buffer=self._shm.buf)
+
+    @classmethod
+    def create(cls, shape, dtype, **geometry):
+        """创建共享内存并清零, geometry 为 spacing, origin, direction"""
+
+        volume = cls(None, shape, dtype, create=True, **geometry)
+        volume.array[...] = 0
+        return volume
+
+    @classmethod
+    def from_image(cls, image):
+        """把 SimpleITK 图像复制到新建的共享内存中"""
+
+        view = sitk.GetArrayViewFromImage(image)
+        volume = cls.create(view.shape, view.dtype, spacing=image.GetSpacing(), origin=image.GetOrigin(),
+                            direction=image.GetDirection())
+        volume.array[...] = view
+        return volume
+
+    def geometry(self):
+        """几何信息, 可以直接传给 create"""
+
+        return dict(spacing=self.spacing, origin=self.origin, direction=self.direction)
+
+    def to_image(self):
+        """生成带几何信息的 SimpleITK 图像(复制一份体素数据)"""
+
+        image = sitk.GetImageFromArray(self.array)
+        image.SetSpacing(self.spacing)
+        image.SetOrigin(self.origin)
+        image.SetDirection(self.direction)
+        return image
+
+    def close(self):
+        """关闭当前进程中的映射, 之后不能再访问 array"""
+
+        self.array = None
+        self._shm.close()
+
+    def unlink(self):
+        """关闭并释放共享内存, 只由创建者调用"""
+
+        self.close()
+        self._shm.unlink()
+
+    def __getstate__(self):
+        return dict(name=self.name, shape=self.shape, dtype=self.dtype.str, **self.geometry())
+
+    def __setstate__(self, state):
+        self.__init__(**state)
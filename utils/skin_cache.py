@@ -0,0 +1,208 @@
+import os
+import shutil
+import hashlib
+import vtk
+import numpy as np
+from utils.reader import vtk_nii_reader
+from utils.mc import marching_cubes
+from utils.extract_point import extract_ps
+from src.seg import skin_seg
+from utils.storage import INTERMEDIATE_FORMATS, image_format, intermediate_path, copy_image
+
+
+# 缓存目录的默认大小上限(字节)
+DEFAULT_MAX_BYTES = 1 << 30
+
+# 计算文件哈希时每次读取的字节数
+HASH_CHUNK = 1 << 20
+
+# 文件哈希的缓存, (绝对路径, 大小, 修改时间) => 哈希值, 文件未修改时不重复计算
+_digest_memo = {}
+
+
+def file_digest(path):
+    """文件内容的哈希值
+
+    Args:
+        path: 文件路径 -> 'str'
+
+    Returns:
+        digest: 十六进制哈希值 -> 'str'
+
+    Raises:
+        OSError: 文件不存在或无法读取
+    """
+
+    stat = os.stat(path)
+    memo_key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    if memo_key not in _digest_memo:
+        h = hashlib.blake2b(digest_size=16)
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(HASH_CHUNK), b''):
+                h.update(chunk)
+        _digest_memo[memo_key] = h.hexdigest()
+    return _digest_memo[memo_key]
+
+
+class SkinCache:
+    """皮肤分割结果的磁盘缓存
+
+    每个病例(CT 和 肺+气管掩膜 的内容哈希)一个目录, 保存皮肤掩膜、皮肤表面网格, 以及每组
+    (ps_rate, face_up) 采样得到的皮肤点集. 目录总大小超过上限时按最近使用时间淘汰.
+    """
+
+    def __init__(self, cache_dir, max_bytes=DEFAULT_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def case_key(self, ct_nii_path, lung_trachea_mask_path):
+        """病例的缓存键"""
+
+        h = hashlib.blake2b(digest_size=16)
+        h.update(file_digest(ct_nii_path).encode())
+        h.update(file_digest(lung_trachea_mask_path).encode())
+        return h.hexdigest()
+
+    def _entry_dir(self, key, create=False):
+        entry_dir = os.path.join(self.cache_dir, key)
+        if create:
+            os.makedirs(entry_dir, exist_ok=True)
+        if os.path.isdir(entry_dir):
+            os.utime(entry_dir)  # 记录最近使用时间
+        return entry_dir
+
+    def _ps_path(self, key, ps_rate, face_up, create=False):
+        return os.path.join(self._entry_dir(key, create), 'ps_{!r}_{:d}.npy'.format(float(ps_rate), bool(face_up)))
+
+    def load_ps(self, key, ps_rate, face_up):
+        """读取皮肤点集, 没有缓存时返回 None"""
+
+        path = self._ps_path(key, ps_rate, face_up)
+        if not os.path.isfile(path):
+            return None
+        return np.load(path)
+
+    def save_ps(self, key, ps_rate, face_up, ps_array):
+        """保存皮肤点集"""
+
+        path = self._ps_path(key, ps_rate, face_up, create=True)
+        tmp_path = path + '.tmp.npy'
+        np.save(tmp_path, ps_array)
+        os.replace(tmp_path, path)
+
+    def load_mesh(self, key):
+        """读取皮肤表面网格, 没有缓存时返回 None"""
+
+        path = os.path.join(self._entry_dir(key), 'skin_mesh.vtp')
+        if not os.path.isfile(path):
+            return None
+        reader = vtk.vtkXMLPolyDataReader()
+        reader.SetFileName(path)
+        reader.Update()
+        return reader.GetOutput()
+
+    def save_mesh(self, key, polydata):
+        """保存皮肤表面网格"""
+
+        path = os.path.join(self._entry_dir(key, create=True), 'skin_mesh.vtp')
+        tmp_path = path + '.tmp.vtp'
+        writer = vtk.vtkXMLPolyDataWriter()
+        writer.SetFileName(tmp_path)
+        writer.SetInputData(polydata)
+        writer.SetDataModeToBinary()
+        writer.Write()
+        os.replace(tmp_path, path)
+
+    def load_mask(self, key, skin_mask_path):
+        """把缓存的皮肤掩膜复制到 skin_mask_path, 格式不同时转换格式, 没有缓存时返回 False"""
+
+        entry_dir = self._entry_dir(key)
+        for fmt in INTERMEDIATE_FORMATS:
+            path = intermediate_path(entry_dir, 'skin_mask', fmt)
+            if os.path.isfile(path):
+                copy_image(path, skin_mask_path)
+                return True
+        return False
+
+    def save_mask(self, key, skin_mask_path):
+        """保存皮肤掩膜, 格式与 skin_mask_path 相同"""
+
+        path = intermediate_path(self._entry_dir(key, create=True), 'skin_mask', image_format(skin_mask_path))
+        copy_image(skin_mask_path, path)
+
+    def evict(self, keep_key=None):
+        """目录总大小超过上限时, 从最久未使用的病例开始删除, keep_key 对应的病例不删除"""
+
+        entries = []
+        total = 0
+        for key in os.listdir(self.cache_dir):
+            entry_dir = os.path.join(self.cache_dir, key)
+            if not os.path.isdir(entry_dir):
+                continue
+            size = sum(os.path.getsize(os.path.join(entry_dir, name)) for name in os.listdir(entry_dir))
+            entries.append((os.path.getmtime(entry_dir), key, size))
+            total += size
+
+        for _, key, size in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if key == keep_key:
+                continue
+            shutil.rmtree(os.path.join(self.cache_dir, key), ignore_errors=True)
+            total -= size
+
+
+def skin_point_set(ct_nii_path, lung_trachea_mask_path, skin_mask_path, extent, spacing, ps_rate, face_up,
+                   cache=None):
+    """皮肤点集 ps, 优先使用缓存
+
+    依次查找缓存中的点集、皮肤表面网格、皮肤掩膜, 只计算缺少的部分, 计算结果写回缓存.
+
+    Args:
+        ct_nii_path: CT图像路径 -> 'str'
+        lung_trachea_mask_path: 肺+气管掩膜路径 -> 'str'
+        skin_mask_path: 皮肤掩膜保存路径 -> 'str'
+        extent: 图像范围 -> 'tuple'
+        spacing: 体素间距 -> 'tuple'
+        ps_rate: 皮肤点集采样参数 -> 'float'
+        face_up: 身体朝向是否向上 -> 'bool'
+        cache: 皮肤缓存, 为 None 时不使用缓存 -> 'SkinCache'
+
+    Returns:
+        error_tag: 是否出错 -> 'bool'
+        output: 出错时为报错信息, 否则为皮肤点集坐标 -> 'str' 或 'numpy.ndarray'
+
+    Raises:
+        None
+    """
+
+    key = None
+    if cache is not None:
+        key = cache.case_key(ct_nii_path, lung_trachea_mask_path)
+        ps_array = cache.load_ps(key, ps_rate, face_up)
+        if ps_array is not None:
+            print("皮肤点集: 使用缓存")
+            return False, ps_array
+
+    ps_polydata = cache.load_mesh(key) if cache is not None else None
+    if ps_polydata is None:
+        if cache is None or not cache.load_mask(key, skin_mask_path):
+            skin_seg(ct_nii_path, lung_trachea_mask_path, skin_mask_path)  # 皮肤分割
+            if cache is not None:
+                cache.save_mask(key, skin_mask_path)
+
+        error_tag, ps_reader_output = vtk_nii_reader(skin_mask_path)
+        if error_tag:
+            return error_tag, ps_reader_output
+
+        ps_polydata = marching_cubes(ps_reader_output)
+        if cache is not None:
+            cache.save_mesh(key, ps_polydata)
+
+    ps_array = extract_ps(ps_polydata, extent, spacing, ps_rate, face_up)
+    if cache is not None:
+        cache.save_ps(key, ps_rate, face_up, ps_array)
+        cache.evict(keep_key=key)
+
+    return False, ps_array
@@ -0,0 +1,334 @@
+import os
+import glob
+import json
+import shutil
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import SimpleITK as sitk
+from utils.runtime_config import runtime_config
+
+
+# 中间结果格式 => 扩展名
+# nii.gz: gzip 压缩的 NIfTI, 体积小, 读写慢
+# nii: 不压缩的 NIfTI, 其他软件也能打开
+# npy: numpy 数组 + JSON 几何信息, 可以用 np.memmap 只读取用到的层
+INTERMEDIATE_FORMATS = {'nii.gz': '.nii.gz', 'nii': '.nii', 'npy': '.npy'}
+
+# 后台写文件的线程, 只用一个线程, 保证同一路径按提交顺序写入
+_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='image_writer')
+
+# 后台整理文件的线程: 跨文件系统的复制、删除上一个病例的文件, 与写图像分开, 不互相等待
+_file_worker = ThreadPoolExecutor(max_workers=1, thread_name_prefix='file_worker')
+
+# clear_dir_async 改名后待删除的目录后缀
+TRASH_SUFFIX = '.trash-'
+
+
+def _stem(path):
+    for ext in INTERMEDIATE_FORMATS.values():
+        if path.endswith(ext):
+            return path[:-len(ext)]
+    return os.path.splitext(path)[0]
+
+
+def image_format(path):
+    """按扩展名判断中间结果格式, 不是中间结果格式时返回 None"""
+
+    for fmt, ext in INTERMEDIATE_FORMATS.items():
+        if path.endswith(ext):
+            return fmt
+    return None
+
+
+def intermediate_path(directory, name, fmt=None):
+    """中间结果的文件路径
+
+    Args:
+        directory: 目录 -> 'str'
+        name: 不带扩展名的文件名 -> 'str'
+        fmt: 格式, 为 None 时使用运行配置 intermediate_format -> 'str'
+
+    Returns:
+        path: 文件路径 -> 'str'
+
+    Raises:
+        ValueError: 格式不在 INTERMEDIATE_FORMATS 中
+    """
+
+    if fmt is None:
+        fmt = runtime_config('intermediate_format')
+    if fmt not in INTERMEDIATE_FORMATS:
+        raise ValueError("unknown intermediate format: {}".format(fmt))
+    return os.path.join(directory, name + INTERMEDIATE_FORMATS[fmt])
+
+
+def geometry_path(path):
+    """npy 文件对应的 JSON 几何信息文件路径"""
+
+    return _stem(path) + '.json'
+
+
+def _tmp_path(path):
+    """同一目录下的临时文件路径, 保留扩展名(SimpleITK 按扩展名选择格式)"""
+
+    directory, name = os.path.split(path)
+    return os.path.join(directory, '.tmp_{}_{}_{}'.format(os.getpid(), threading.get_ident(), name))
+
+
+def write_image(image, path):
+    """按扩展名写图像, .npy 同时写 JSON 几何信息, 其他扩展名由 SimpleITK 写
+
+    先写到同一目录下的临时文件, 再替换 path: path 是 link_file 创建的链接时只替换链接本身,
+    不会写入链接指向的原文件(例如用户导入的CT).
+
+    Args:
+        image: 图像 -> 'SimpleITK.Image'
+        path: 文件路径 -> 'str'
+    """
+
+    tmp_path = _tmp_path(path)
+    try:
+        if not path.endswith('.npy'):
+            sitk.WriteImage(image, tmp_path)
+            os.replace(tmp_path, path)
+            return
+
+        geometry = dict(spacing=image.GetSpacing(), origin=image.GetOrigin(), direction=image.GetDirection())
+        with open(tmp_path, 'wb') as f:
+            np.save(f, sitk.GetArrayViewFromImage(image))
+        os.replace(tmp_path, path)
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(geometry, f)
+        os.replace(tmp_path, geometry_path(path))
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+class _ImageArray:
+    """SimpleITK 图像像素的数组接口, 由它创建的数组引用图像, 图像不会先于数组释放
+
+    GetArrayViewFromImage 返回的视图不引用图像, 图像释放后视图指向已释放的内存.
+    """
+
+    def __init__(self, image):
+        self.image = image
+        self.__array_interface__ = sitk.GetArrayViewFromImage(image).__array_interface__
+
+
+def image_array_view(image):
+    """图像像素的只读视图, zyx 顺序, 不复制, 视图保留对图像的引用
+
+    Args:
+        image: 图像, 共用内存的浅拷贝会先复制一份(见 GetArrayViewFromImage) -> 'SimpleITK.Image'
+
+    Returns:
+        array: 只读数组 -> 'numpy.ndarray'
+    """
+
+    array = np.asarray(_ImageArray(image))
+    array.flags.writeable = False
+    return array
+
+
+def read_array(path):
+    """读取图像数组和几何信息, .npy 以只读 memmap 打开, 只有访问到的层才会从磁盘读入, 不复制;
+    其他格式由 SimpleITK 解码, 返回引用图像的视图
+
+    Args:
+        path: 文件路径 -> 'str'
+
+    Returns:
+        array: zyx 顺序的数组, 只读 -> 'numpy.ndarray'
+        geometry: spacing, origin, direction -> 'dict'
+
+    Raises:
+        RuntimeError: SimpleITK 读取失败
+        OSError: npy 或几何信息文件不存在
+    """
+
+    if not path.endswith('.npy'):
+        image = sitk.ReadImage(path)
+        geometry = dict(spacing=image.GetSpacing(), origin=image.GetOrigin(), direction=image.GetDirection())
+        return image_array_view(image), geometry
+
+    with open(geometry_path(path), 'r', encoding='utf-8') as f:
+        geometry = {name: tuple(value) for name, value in json.load(f).items()}
+    return np.load(path, mmap_mode='r'), geometry
+
+
+def read_image(path):
+    """按扩展名读取图像
+
+    SimpleITK 图像只能使用自己的像素内存(没有 GetImageViewFromArray), .npy 的像素从 memmap 复制一次到
+    SimpleITK 图像中, 整个文件都会读入; 只需要数组时用 read_array, 直接使用 memmap, 不复制.
+
+    Args:
+        path: 文件路径 -> 'str'
+
+    Returns:
+        image: 图像 -> 'SimpleITK.Image'
+
+    Raises:
+        RuntimeError: SimpleITK 读取失败
+        OSError: npy 或几何信息文件不存在
+    """
+
+    if not path.endswith('.npy'):
+        return sitk.ReadImage(path)
+
+    array, geometry = read_array(path)
+    image = sitk.GetImageFromArray(array)
+    image.SetSpacing(geometry['spacing'])
+    image.SetOrigin(geometry['origin'])
+    image.SetDirection(geometry['direction'])
+    return image
+
+
+def copy_image(src_path, dst_path):
+    """复制图像文件, 格式相同时直接复制文件(包括 JSON 几何信息), 否则转换格式"""
+
+    if image_format(src_path) is None or image_format(src_path) != image_format(dst_path):
+        write_image(read_image(src_path), dst_path)
+        return
+    shutil.copyfile(src_path, dst_path)
+    if src_path.endswith('.npy'):
+        shutil.copyfile(geometry_path(src_path), geometry_path(dst_path))
+
+
+def export_nii_gz(src_dir, dst_dir):
+    """把目录中的中间结果导出为 .nii.gz
+
+    Args:
+        src_dir: 中间结果目录, 例如 result -> 'str'
+        dst_dir: 导出目录 -> 'str'
+
+    Returns:
+        paths: 导出的文件路径 -> 'list'
+    """
+
+    os.makedirs(dst_dir, exist_ok=True)
+    paths = []
+    for name in sorted(os.listdir(src_dir)):
+        src_path = os.path.join(src_dir, name)
+        if not os.path.isfile(src_path) or not any(name.endswith(ext) for ext in INTERMEDIATE_FORMATS.values()):
+            continue
+        dst_path = os.path.join(dst_dir, os.path.basename(_stem(src_path)) + '.nii.gz')
+        if dst_path in paths:  # 同一结果有多种格式时只导出一次
+            continue
+        copy_image(src_path, dst_path)
+        paths.append(dst_path)
+    return paths
+
+
+def link_file(src_path, dst_path):
+    """在 dst_path 处引用 src_path, 不复制数据: 依次尝试符号链接、硬链接(同一文件系统),
+    都不行时才在后台线程中复制
+
+    dst_path 只能读取, 不能打开写入, 否则会改写 src_path(例如用户导入的CT); 需要重写时用
+    write_image, 它先写临时文件再替换, 只替换链接本身. 优先使用符号链接, 在文件管理器中也能看出
+    它引用的是原文件; Windows 没有创建符号链接的权限时使用硬链接.
+
+    Args:
+        src_path: 源文件 -> 'str'
+        dst_path: 链接路径, 已存在时先删除 -> 'str'
+
+    Returns:
+        future: 复制任务, result() 等待复制完成; 链接成功时为 None -> 'concurrent.futures.Future'
+
+    Raises:
+        OSError: 源文件不存在
+    """
+
+    src_path = os.path.abspath(src_path)
+    if not os.path.isfile(src_path):
+        raise FileNotFoundError(src_path)
+    if os.path.lexists(dst_path):
+        os.remove(dst_path)
+
+    for link in (os.symlink, os.link):
+        try:
+            link(src_path, dst_path)
+            return None
+        except (OSError, NotImplementedError):  # 跨文件系统, 或没有权限
+            continue
+    return _file_worker.submit(shutil.copyfile, src_path, dst_path)
+
+
+def _remove_contents(directory):
+    for name in os.listdir(directory):
+        path = os.path.join(directory, name)
+        if os.path.isdir(path) and not os.path.islink(path):
+            shutil.rmtree(path)
+        else:
+            os.remove(path)
+
+
+def clear_dir_async(directory):
+    """清空目录, 不等待删除完成: 先把目录改名, 重新创建空目录, 再在后台线程中删除改名后的目录.
+    改名失败时(例如 Windows 下目录中有文件被打开)直接删除目录中的文件
+
+    删除链接只删除链接本身, 不影响 link_file 引用的源文件.
+
+    Args:
+        directory: 目录 -> 'str'
+
+    Returns:
+        future: 删除任务, 同步删除时为 None -> 'concurrent.futures.Future'
+    """
+
+    directory = os.path.abspath(directory)
+    # 上次运行中断时没删完的目录
+    trash_dirs = glob.glob(glob.escape(directory) + TRASH_SUFFIX + '*')
+
+    if not os.path.isdir(directory):
+        os.makedirs(directory, exist_ok=True)
+    elif os.listdir(directory):
+        trash = '{}{}{}'.format(directory, TRASH_SUFFIX, time.time_ns())
+        try:
+            os.rename(directory, trash)
+        except OSError:
+            _remove_contents(directory)
+        else:
+            os.makedirs(directory, exist_ok=True)
+            trash_dirs.append(trash)
+
+    if not trash_dirs:
+        return None
+
+    def remove():
+        for trash_dir in trash_dirs:
+            shutil.rmtree(trash_dir, ignore_errors=True)
+
+    return _file_worker.submit(remove)
+
+
+def write_image_async(image, path, callback=None):
+    """在后台线程中写图像文件
+
+    Args:
+        image: 要写的图像, 提交后不要再修改 -> 'SimpleITK.Image'
+        path: 文件路径, 按扩展名选择格式, 见 write_image -> 'str'
+        callback: 写完后在后台线程中调用 callback(path) -> 'callable'
+
+    Returns:
+        future: 写文件任务, result() 等待写完, 写文件出错时抛出异常 -> 'concurrent.futures.Future'
+
+    Raises:
+        None
+    """
+
+    def write():
+        write_image(image, path)
+        if callback is not None:
+            callback(path)
+        return path
+
+    return _writer.submit(write)
+
+
+if __name__ == "__main__":
+    # 把 result 目录中的中间结果导出为 .nii.gz
+    print(export_nii_gz("result", os.path.join("result", "export")))
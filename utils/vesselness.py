@@ -0,0 +1,479 @@
+import os
+import math
+import time
+import shutil
+import tempfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import itk
+import numpy as np
+import SimpleITK as sitk
+from scipy import ndimage
+from utils.shared_volume import SharedVolume
+from utils.runtime_config import pool_workers, pool_initargs, init_pool_worker
+
+
+# 每个分块的层数(不含重叠部分)
+SLAB_SIZE = 32
+
+# 尺度空间方法中, 计算 Hessian 和特征值时每次处理的层数
+HESSIAN_CHUNK = 8
+
+
+def mask_bounding_box(mask_image, margin=0):
+    """掩膜非零区域的包围盒
+
+    Args:
+        mask_image: 掩膜图像 -> 'SimpleITK.Image'
+        margin: 包围盒向外扩展的体素个数, 每个坐标轴可以不同 -> 'int' 或 'tuple'
+
+    Returns:
+        lower: 包围盒起点, xyz -> 'tuple'
+        upper: 包围盒终点(不含), xyz; 掩膜为空时返回 None, None -> 'tuple'
+
+    Raises:
+        None
+    """
+
+    stats = sitk.LabelShapeStatisticsImageFilter()
+    stats.Execute(mask_image != 0)
+    if not stats.HasLabel(1):
+        return None, None
+
+    size = mask_image.GetSize()
+    margin = np.broadcast_to(margin, 3)
+    bbox = stats.GetBoundingBox(1)  # x, y, z, size_x, size_y, size_z
+    lower = tuple(max(bbox[i] - int(margin[i]), 0) for i in range(3))
+    upper = tuple(min(bbox[i] + bbox[i + 3] + int(margin[i]), size[i]) for i in range(3))
+
+    return lower, upper
+
+
+def hessian_objectness(array, spacing, sigma_minimum=2., sigma_maximum=2., number_sigma_steps=8):
+    """ITK 多尺度 Hessian 血管性测度(亮管状结构)
+
+    Args:
+        array: 灰度图像, zyx 顺序 -> 'numpy.ndarray'(float32)
+        spacing: 体素间距, xyz -> 'tuple'
+        sigma_minimum: 最小尺度(物理单位) -> 'float'
+        sigma_maximum: 最大尺度(物理单位) -> 'float'
+        number_sigma_steps: 尺度个数 -> 'int'
+
+    Returns:
+        objectness: 血管性测度, zyx 顺序 -> 'numpy.ndarray'(float32)
+
+    Raises:
+        None
+    """
+
+    # 最小和最大尺度相同时 ITK 会把同一个尺度重复计算 number_sigma_steps 次, 结果相同
+    if sigma_maximum <= sigma_minimum:
+        number_sigma_steps = 1
+
+    input_image = itk.image_view_from_array(np.ascontiguousarray(array, dtype=np.float32))
+    input_image.SetSpacing([float(s) for s in spacing])
+    image_type = type(input_image)
+    dimension = input_image.GetImageDimension()
+    hessian_pixel_type = itk.SymmetricSecondRankTensor[itk.D, dimension]
+    hessian_image_type = itk.Image[hessian_pixel_type, dimension]
+    objectness_filter = itk.HessianToObjectnessMeasureImageFilter[hessian_image_type, image_type].New()
+    objectness_filter.SetBrightObject(True)
+    objectness_filter.SetScaleObjectnessMeasure(True)
+    objectness_filter.SetAlpha(0.5)
+    objectness_filter.SetBeta(1.0)
+    objectness_filter.SetGamma(5.0)
+    multi_scale_filter = itk.MultiScaleHessianBasedMeasureImageFilter[image_type, hessian_image_type, image_type].New()
+    multi_scale_filter.SetInput(input_image)
+    multi_scale_filter.SetHessianToMeasureFilter(objectness_filter)
+    multi_scale_filter.SetSigmaStepMethodToLogarithmic()
+    multi_scale_filter.SetSigmaMinimum(sigma_minimum)
+    multi_scale_filter.SetSigmaMaximum(sigma_maximum)
+    multi_scale_filter.SetNumberOfSigmaSteps(number_sigma_steps)
+    multi_scale_filter.Update()
+
+    # 直接返回 ITK 输出图像的数组视图, 不复制
+    return itk.array_view_from_image(multi_scale_filter.GetOutput())
+
+
+def scale_values(sigma_minimum, sigma_maximum, number_sigma_steps):
+    """对数间隔的尺度, 与 MultiScaleHessianBasedMeasureImageFilter 相同, 去掉重复的尺度"""
+
+    if number_sigma_steps < 2 or sigma_maximum <= sigma_minimum:
+        return [float(sigma_minimum)]
+    return [float(s) for s in np.geomspace(sigma_minimum, sigma_maximum, number_sigma_steps)]
+
+
+def _symmetric_eigenvalues(a11, a22, a33, a12, a13, a23):
+    """3x3 实对称矩阵的特征值(解析解), 按绝对值从小到大排列"""
+
+    q = (a11 + a22 + a33) / 3
+    p1 = a12 * a12 + a13 * a13 + a23 * a23
+    p2 = (a11 - q) ** 2 + (a22 - q) ** 2 + (a33 - q) ** 2 + 2 * p1
+    p = np.sqrt(p2 / 6)
+    safe_p = np.where(p > 0, p, 1)
+
+    b11, b22, b33 = (a11 - q) / safe_p, (a22 - q) / safe_p, (a33 - q) / safe_p
+    b12, b13, b23 = a12 / safe_p, a13 / safe_p, a23 / safe_p
+    r = (b11 * (b22 * b33 - b23 * b23) - b12 * (b12 * b33 - b23 * b13) + b13 * (b12 * b23 - b22 * b13)) / 2
+    phi = np.arccos(np.clip(r, -1, 1)) / 3
+
+    e1 = q + 2 * p * np.cos(phi)
+    e3 = q + 2 * p * np.cos(phi + np.float32(2 * np.pi / 3))
+    e2 = 3 * q - e1 - e3
+
+    eigen = np.stack([e1, e2, e3])
+    order = np.argsort(np.abs(eigen), axis=0)
+    return np.take_along_axis(eigen, order, axis=0)
+
+
+def _frangi_measure(eigen, alpha, beta, gamma):
+    """HessianToObjectnessMeasureImageFilter 的测度(ObjectDimension=1, 亮目标, 按 |λ3| 缩放)"""
+
+    l1, l2, l3 = np.abs(eigen)
+    safe_l3 = np.where(l3 > 0, l3, 1)
+    ra = l2 / safe_l3
+    rb = l1 / np.sqrt(np.maximum(l2 * l3, np.finfo(np.float32).tiny))
+    s2 = l1 * l1 + l2 * l2 + l3 * l3
+
+    measure = (1 - np.exp(-ra * ra / (2 * alpha * alpha))) * np.exp(-rb * rb / (2 * beta * beta))
+    measure *= (1 - np.exp(-s2 / (2 * gamma * gamma))) * l3
+    # 亮目标: 两个较大的特征值必须为负
+    measure[(eigen[1] > 0) | (eigen[2] > 0) | (l3 == 0)] = 0
+    return measure
+
+
+def scale_space_objectness(array, spacing, sigma_minimum=2., sigma_maximum=2., number_sigma_steps=8,
+                           alpha=0.5, beta=1.0, gamma=5.0, report=None):
+    """基于增量高斯尺度空间的多尺度 Hessian 血管性测度
+
+    每个尺度由上一个尺度的平滑结果再做一次残差高斯平滑得到, 残差 sigma = sqrt(sigma^2 - 上一个sigma^2),
+    平滑核随尺度增大而变小. Hessian 由缓存的平滑结果用中心差分按块计算, 全部为 float32, 乘 sigma^2 做尺度归一化,
+    各尺度取最大值. 与 ITK 的递归高斯导数相比是近似实现, 同一尺度下阈值化后的掩膜与 hessian_objectness 的
+    Dice 约 0.97, 不能直接替换 'itk' 方法.
+
+    Args:
+        array: 灰度图像, zyx 顺序 -> 'numpy.ndarray'
+        spacing: 体素间距, xyz -> 'tuple'
+        sigma_minimum: 最小尺度(物理单位) -> 'float'
+        sigma_maximum: 最大尺度(物理单位) -> 'float'
+        number_sigma_steps: 尺度个数 -> 'int'
+        alpha: 区分片状和管状结构的参数 -> 'float'
+        beta: 区分球状结构的参数 -> 'float'
+        gamma: 区分背景噪声的参数 -> 'float'
+        report: 不为 None 时, 每个尺度追加一条 dict(sigma, residual_sigma, seconds, bytes) -> 'list'
+
+    Returns:
+        objectness: 血管性测度, zyx 顺序 -> 'numpy.ndarray'(float32)
+
+    Raises:
+        None
+    """
+
+    voxel_spacing = np.array(spacing[::-1], dtype=np.float64)  # zyx
+    smoothed = np.asarray(array, dtype=np.float32)
+    objectness = np.zeros(smoothed.shape, dtype=np.float32)
+    depth = smoothed.shape[0]
+    current_sigma = 0.0
+
+    for sigma in scale_values(sigma_minimum, sigma_maximum, number_sigma_steps):
+        start = time.perf_counter()
+        residual = math.sqrt(sigma * sigma - current_sigma * current_sigma)
+        smoothed = ndimage.gaussian_filter(smoothed, residual / voxel_spacing, output=np.float32)
+        current_sigma = sigma
+        peak_bytes = smoothed.nbytes + objectness.nbytes
+
+        # 按块计算 Hessian, 两次中心差分需要上下各2层
+        norm = np.float32(sigma * sigma)
+        for z0 in range(0, depth, HESSIAN_CHUNK):
+            z1 = min(z0 + HESSIAN_CHUNK, depth)
+            r0, r1 = max(z0 - 2, 0), min(z1 + 2, depth)
+            chunk = smoothed[r0:r1]
+            keep = slice(z0 - r0, z1 - r0)
+            if chunk.shape[0] < 3:  # 层数太少时不能做差分
+                continue
+            gz, gy, gx = np.gradient(chunk, *voxel_spacing)
+            hzz, hzy, hzx = (h[keep] * norm for h in np.gradient(gz, *voxel_spacing))
+            hyy, hyx = (h[keep] * norm for h in np.gradient(gy, voxel_spacing[1], voxel_spacing[2], axis=(1, 2)))
+            hxx = np.gradient(gx, voxel_spacing[2], axis=2)[keep] * norm
+            del gz, gy, gx
+
+            eigen = _symmetric_eigenvalues(hxx, hyy, hzz, hyx, hzx, hzy)
+            measure = _frangi_measure(eigen, alpha, beta, gamma)
+            np.maximum(objectness[z0:z1], measure, out=objectness[z0:z1])
+            peak_bytes = max(peak_bytes, smoothed.nbytes + objectness.nbytes + chunk.nbytes * 12)
+
+        if report is not None:
+            report.append(dict(sigma=sigma, residual_sigma=residual,
+                               seconds=time.perf_counter() - start, bytes=peak_bytes))
+
+    return objectness
+
+
+# 血管性测度的计算方法
+OBJECTNESS_METHODS = {
+    'itk': hessian_objectness,
+    'scale_space': scale_space_objectness,
+}
+
+
+def _slab_worker(in_volume, out_volume, z_read, z_write, method, sigma_kwargs):
+    """子进程: 计算一个分块(含重叠部分)的血管性测度, 只写回不含重叠部分的层, 返回各尺度的耗时和内存"""
+
+    try:
+        report = []
+        if method == 'scale_space':
+            sigma_kwargs = dict(sigma_kwargs, report=report)
+        objectness = OBJECTNESS_METHODS[method](in_volume.array[z_read[0]:z_read[1]], in_volume.spacing,
+                                                **sigma_kwargs)
+        start = z_write[0] - z_read[0]
+        out_volume.array[z_write[0]:z_write[1]] = objectness[start:start + z_write[1] - z_write[0]]
+        return report
+    finally:
+        in_volume.close()
+        out_volume.close()
+
+
+def _merge_reports(slab_reports, report):
+    """合并各分块的尺度报告: 耗时相加, 内存取最大值"""
+
+    for scale_reports in zip(*slab_reports):
+        report.append(dict(sigma=scale_reports[0]['sigma'],
+                           residual_sigma=scale_reports[0]['residual_sigma'],
+                           seconds=sum(r['seconds'] for r in scale_reports),
+                           bytes=max(r['bytes'] for r in scale_reports)))
+
+
+def tiled_objectness(array, spacing, sigma_minimum=2., sigma_maximum=2., number_sigma_steps=8,
+                     slab_size=SLAB_SIZE, workers=None, method='itk', report=None):
+    """沿 z 轴分块计算血管性测度, 相邻分块重叠约 3 sigma, 分块在进程池中并行
+
+    每个分块的峰值内存只与分块大小有关, 与层数无关. 高斯滤波在 3 sigma 之外的影响很小,
+    分块内部的结果与整幅图像计算的结果基本一致.
+
+    Args:
+        array: 灰度图像, zyx 顺序, 可以是视图, 复制到共享内存时转为 float32 -> 'numpy.ndarray'
+        spacing: 体素间距, xyz -> 'tuple'
+        sigma_minimum: 最小尺度(物理单位) -> 'float'
+        sigma_maximum: 最大尺度(物理单位) -> 'float'
+        number_sigma_steps: 尺度个数 -> 'int'
+        slab_size: 每个分块的层数(不含重叠部分) -> 'int'
+        workers: 进程数, 默认使用运行配置 process_workers -> 'int'
+        method: 计算方法, 'itk' 或 'scale_space', 见 OBJECTNESS_METHODS -> 'str'
+        report: 不为 None 且 method 为 'scale_space' 时, 追加各尺度的耗时和内存 -> 'list'
+
+    Returns:
+        objectness: 血管性测度, zyx 顺序 -> 'numpy.ndarray'(float32)
+
+    Raises:
+        ValueError: method 不在 OBJECTNESS_METHODS 中
+    """
+
+    if method not in OBJECTNESS_METHODS:
+        raise ValueError("unknown objectness method: {}".format(method))
+
+    sigma_kwargs = dict(sigma_minimum=sigma_minimum, sigma_maximum=sigma_maximum,
+                        number_sigma_steps=number_sigma_steps)
+    halo = int(math.ceil(3 * sigma_maximum / spacing[2])) + 2
+    depth = array.shape[0]
+
+    # 只有一个分块时不启动进程池
+    if depth <= slab_size:
+        if method == 'scale_space':
+            sigma_kwargs['report'] = report
+        return OBJECTNESS_METHODS[method](array, spacing, **sigma_kwargs)
+
+    if workers is None:
+        workers = pool_workers()
+
+    in_volume = SharedVolume.create(array.shape, np.float32, spacing=spacing)
+    in_volume.array[...] = array
+    out_volume = SharedVolume.create(array.shape, np.float32, spacing=spacing)
+
+    try:
+        ctx = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=workers, mp_context=ctx, initializer=init_pool_worker,
+                                 initargs=pool_initargs(workers)) as executor:
+            futures = []
+            for z0 in range(0, depth, slab_size):
+                z1 = min(z0 + slab_size, depth)
+                z_read = (max(z0 - halo, 0), min(z1 + halo, depth))
+                futures.append(executor.submit(_slab_worker, in_volume, out_volume, z_read, (z0, z1), method,
+                                               sigma_kwargs))
+            slab_reports = [future.result() for future in futures]
+        if report is not None:
+            _merge_reports(slab_reports, report)
+        objectness = out_volume.array.copy()
+    finally:
+        in_volume.unlink()
+        out_volume.unlink()
+
+    return objectness
+
+
+def _range_task(array, spacing, z_read, z_write, method, sigma_kwargs, roi, spill_path):
+    """计算一个分块(含重叠部分)的血管性测度, 返回不含重叠部分的最小值和最大值
+
+    分块与包围盒 roi 相交时, 把包围盒内的测度写入 spill_path 中的 float32 数组(磁盘文件), 分块的测度不保留.
+    """
+
+    objectness = OBJECTNESS_METHODS[method](array[z_read[0]:z_read[1]], spacing, **sigma_kwargs)
+    start = z_write[0] - z_read[0]
+    objectness = objectness[start:start + z_write[1] - z_write[0]]
+
+    z0, z1 = max(z_write[0], roi[0].start), min(z_write[1], roi[0].stop)
+    if z0 < z1:
+        spill = np.load(spill_path, mmap_mode='r+')
+        spill[z0 - roi[0].start:z1 - roi[0].start] = objectness[z0 - z_write[0]:z1 - z_write[0], roi[1], roi[2]]
+        spill.flush()
+        del spill
+
+    return float(objectness.min()), float(objectness.max())
+
+
+def _range_worker(in_volume, z_read, z_write, method, sigma_kwargs, roi, spill_path):
+    """子进程: 见 _range_task, 同时返回各尺度的耗时和内存"""
+
+    try:
+        report = []
+        if method == 'scale_space':
+            sigma_kwargs = dict(sigma_kwargs, report=report)
+        minimum, maximum = _range_task(in_volume.array, in_volume.spacing, z_read, z_write, method, sigma_kwargs,
+                                       roi, spill_path)
+        return minimum, maximum, report
+    finally:
+        in_volume.close()
+
+
+def streamed_objectness(array, spacing, roi, spill_path, sigma_minimum=2., sigma_maximum=2., number_sigma_steps=8,
+                        slab_size=SLAB_SIZE, workers=None, method='itk', report=None):
+    """沿 z 轴分块计算整幅图像的血管性测度, 只保留包围盒内的部分, 返回整幅图像测度的最小值和最大值
+
+    拉伸范围需要整幅图像的最值, 每个分块计算完只保留最值和包围盒内的测度, 包围盒内的测度写入磁盘上的
+    spill_path, 不占用内存. 每个分块的峰值内存只与分块大小有关, 与层数无关; 输入图像以原来的数据类型
+    (CT 一般为 int16)复制到共享内存中, 各进程读取自己的分块时再转为 float32.
+
+    Args:
+        array: 灰度图像, zyx 顺序, 可以是视图 -> 'numpy.ndarray'
+        spacing: 体素间距, xyz -> 'tuple'
+        roi: 包围盒, zyx 顺序的 slice -> 'tuple'
+        spill_path: 保存包围盒内测度的 .npy 文件路径 -> 'str'
+        sigma_minimum: 最小尺度(物理单位) -> 'float'
+        sigma_maximum: 最大尺度(物理单位) -> 'float'
+        number_sigma_steps: 尺度个数 -> 'int'
+        slab_size: 每个分块的层数(不含重叠部分) -> 'int'
+        workers: 进程数, 默认使用运行配置 process_workers -> 'int'
+        method: 计算方法, 'itk' 或 'scale_space', 见 OBJECTNESS_METHODS -> 'str'
+        report: 不为 None 且 method 为 'scale_space' 时, 追加各尺度的耗时和内存 -> 'list'
+
+    Returns:
+        minimum: 整幅图像测度的最小值 -> 'float'
+        maximum: 整幅图像测度的最大值 -> 'float'
+
+    Raises:
+        ValueError: method 不在 OBJECTNESS_METHODS 中
+    """
+
+    if method not in OBJECTNESS_METHODS:
+        raise ValueError("unknown objectness method: {}".format(method))
+
+    sigma_kwargs = dict(sigma_minimum=sigma_minimum, sigma_maximum=sigma_maximum,
+                        number_sigma_steps=number_sigma_steps)
+    halo = int(math.ceil(3 * sigma_maximum / spacing[2])) + 2
+    depth = array.shape[0]
+    np.lib.format.open_memmap(spill_path, mode='w+', dtype=np.float32,
+                              shape=tuple(s.stop - s.start for s in roi)).flush()
+
+    slabs = []
+    for z0 in range(0, depth, slab_size):
+        z1 = min(z0 + slab_size, depth)
+        slabs.append(((max(z0 - halo, 0), min(z1 + halo, depth)), (z0, z1)))
+
+    # 只有一个分块时不启动进程池
+    if len(slabs) == 1:
+        if method == 'scale_space':
+            sigma_kwargs['report'] = report
+        return _range_task(array, spacing, slabs[0][0], slabs[0][1], method, sigma_kwargs, roi, spill_path)
+
+    if workers is None:
+        workers = pool_workers()
+
+    in_volume = SharedVolume.create(array.shape, array.dtype, spacing=spacing)
+    in_volume.array[...] = array
+
+    try:
+        ctx = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=workers, mp_context=ctx, initializer=init_pool_worker,
+                                 initargs=pool_initargs(workers)) as executor:
+            futures = [executor.submit(_range_worker, in_volume, z_read, z_write, method, sigma_kwargs, roi,
+                                       spill_path)
+                       for z_read, z_write in slabs]
+            results = [future.result() for future in futures]
+    finally:
+        in_volume.unlink()
+
+    if report is not None:
+        _merge_reports([result[2] for result in results], report)
+    return min(result[0] for result in results), max(result[1] for result in results)
+
+
+def vesselness_mask(image, mask_image=None, sigma_minimum=2., sigma_maximum=2., number_sigma_steps=8,
+                    lower_threshold=40, slab_size=SLAB_SIZE, workers=None, method='itk', report=None):
+    """血管分割: 分块计算血管性测度, 线性拉伸到 [0, 255] 后在掩膜的包围盒内阈值化, 包围盒之外为0
+
+    包围盒向外扩展约 3 sigma. 拉伸范围是整幅图像血管性测度(不是CT值)的最小值和最大值, 与整幅图像的
+    RescaleIntensityImageFilter 相同, 因此仍要分块计算整幅图像的测度(见 streamed_objectness),
+    但只保留最值和包围盒内的测度, 包围盒内的结果与整幅图像计算的结果一致, 峰值内存与层数无关.
+
+    Args:
+        image: CT图像 -> 'SimpleITK.Image'
+        mask_image: 肺掩膜, 为 None 时计算整幅图像 -> 'SimpleITK.Image'
+        sigma_minimum: 最小尺度(物理单位) -> 'float'
+        sigma_maximum: 最大尺度(物理单位) -> 'float'
+        number_sigma_steps: 尺度个数 -> 'int'
+        lower_threshold: 拉伸到 [0, 255] 后的阈值 -> 'int'
+        slab_size: 每个分块的层数(不含重叠部分) -> 'int'
+        workers: 进程数 -> 'int'
+        method: 计算方法, 'itk' 或 'scale_space' -> 'str'
+        report: 不为 None 且 method 为 'scale_space' 时, 追加各尺度的耗时和内存 -> 'list'
+
+    Returns:
+        vessel_image: 取值为{0, 1}的血管掩膜, 与输入图像的几何信息相同 -> 'SimpleITK.Image'(uint8)
+
+    Raises:
+        None
+    """
+
+    spacing = image.GetSpacing()
+    array = sitk.GetArrayViewFromImage(image)  # zyx
+    out_array = np.zeros(array.shape, dtype=np.uint8)
+
+    lower, upper = (0, 0, 0), image.GetSize()
+    if mask_image is not None:
+        halo = [int(math.ceil(3 * sigma_maximum / s)) + 2 for s in spacing]
+        lower, upper = mask_bounding_box(mask_image, halo)
+
+    if lower is not None:
+        roi = (slice(lower[2], upper[2]), slice(lower[1], upper[1]), slice(lower[0], upper[0]))
+        spill_dir = tempfile.mkdtemp(prefix='vesselness_')
+        try:
+            spill_path = os.path.join(spill_dir, 'objectness.npy')
+            minimum, maximum = streamed_objectness(array, spacing, roi, spill_path, sigma_minimum, sigma_maximum,
+                                                   number_sigma_steps, slab_size, workers, method, report)
+
+            # 与 RescaleIntensityImageFilter + BinaryThresholdImageFilter 相同: 用 double 拉伸后截断为整数再比较,
+            # 测度非负, 截断后 >= 阈值 等价于拉伸后 >= 阈值
+            if maximum > minimum:
+                scale = 255.0 / (maximum - minimum)
+                objectness = np.load(spill_path, mmap_mode='r')
+                out_roi = out_array[roi]
+                for z0 in range(0, objectness.shape[0], slab_size):
+                    rescaled = (objectness[z0:z0 + slab_size].astype(np.float64) - minimum) * scale
+                    out_roi[z0:z0 + slab_size] = rescaled >= lower_threshold
+                del objectness
+        finally:
+            shutil.rmtree(spill_dir, ignore_errors=True)
+
+    vessel_image = sitk.GetImageFromArray(out_array)
+    vessel_image.CopyInformation(image)
+
+    return vessel_image
@@ -0,0 +1,244 @@
+import os
+import threading
+from collections import OrderedDict
+import numpy as np
+import SimpleITK as sitk
+from utils.runtime_config import runtime_config
+from utils.storage import read_array, read_image, write_image, image_array_view
+from utils.vtk_bridge import sitk_to_vtk_image, vtk_image_to_array
+
+
+class VolumeCache:
+    """进程内的体数据缓存, 同一文件在一次会话中只解码一次
+
+    按 (绝对路径, 修改时间, 大小) 缓存解码后的图像, 文件被重写或删除后自动失效并移出缓存. SimpleITK 图像以
+    浅拷贝的方式返回, 与缓存共用同一块内存, 修改像素时 SimpleITK 会先复制(写时复制), 不会改动缓存.
+    同一文件的各种解码结果(可能共用内存)作为一组使用和淘汰, 总大小超过上限时淘汰最久未使用的文件.
+    可以在多个 QThread 中同时使用.
+    """
+
+    def __init__(self, max_bytes=None):
+        self._max_bytes = max_bytes  # 为 None 时使用运行配置 volume_cache_mb
+        self._entries = OrderedDict()  # (kind, path) => (stamp, value, nbytes)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def max_bytes(self):
+        if self._max_bytes is not None:
+            return self._max_bytes
+        return runtime_config('volume_cache_mb') * 2 ** 20
+
+    def get(self, path, kind):
+        """读取缓存, 没有缓存或文件已修改时返回 None
+
+        Args:
+            path: 文件路径 -> 'str'
+            kind: 缓存类型, 同一文件可以缓存不同的解码结果, 例如 'sitk'、'vtk' -> 'str'
+
+        Returns:
+            value: 缓存的对象 -> 'object'
+        """
+
+        abspath = os.path.abspath(path)
+        stamp = _file_stamp(path)
+        with self._lock:
+            entry = self._entries.get((kind, abspath))
+            if stamp is None or entry is None or entry[0] != stamp:
+                if entry is not None:  # 文件已被重写或删除
+                    self._pop_path(abspath)
+                self.misses += 1
+                return None
+            for key in self._path_keys(abspath):  # 同一文件的各种解码结果一起更新使用时间
+                self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, path, kind, value, nbytes):
+        """加入缓存, 同一文件旧版本的缓存被替换
+
+        Args:
+            path: 文件路径 -> 'str'
+            kind: 缓存类型 -> 'str'
+            value: 要缓存的对象, 加入后不要再修改 -> 'object'
+            nbytes: 占用的内存, 与同一文件已缓存的结果共用内存时为 0 -> 'int'
+        """
+
+        abspath = os.path.abspath(path)
+        key = (kind, abspath)
+        stamp = _file_stamp(path)
+        with self._lock:
+            self._purge_stale()
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[2]
+            if any(self._entries[other][0] != stamp for other in self._path_keys(abspath)):
+                self._pop_path(abspath)  # 同一文件旧版本的其他解码结果
+            if stamp is None or nbytes > self.max_bytes:  # 比上限还大的图像不缓存
+                return
+            self._entries[key] = (stamp, value, nbytes)
+            self._bytes += nbytes
+            while self._bytes > self.max_bytes:
+                # 同一文件的结果一起淘汰, 共用内存(nbytes 为 0)的结果不会在其他结果淘汰后继续占用内存
+                (_, evicted_path), _ = next(iter(self._entries.items()))
+                self._pop_path(evicted_path)
+                self.evictions += 1
+
+    def _path_keys(self, abspath):
+        return [key for key in self._entries if key[1] == abspath]
+
+    def _pop_path(self, abspath):
+        for key in self._path_keys(abspath):
+            self._bytes -= self._entries.pop(key)[2]
+
+    def _purge_stale(self):
+        """移出文件已被重写或删除的结果"""
+
+        for abspath in {key[1] for key, entry in self._entries.items() if _file_stamp(key[1]) != entry[0]}:
+            self._pop_path(abspath)
+
+    def put_image(self, path, image):
+        """把刚写入 path 的图像放入缓存, 之后 read_image 和 vtk_nii_reader 直接使用内存中的图像, 不再解析文件.
+        vtkImageData 通过 vtk_bridge 与 SimpleITK 图像共用像素数据
+
+        Args:
+            path: 已写入的文件路径 -> 'str'
+            image: 图像 -> 'SimpleITK.Image'
+        """
+
+        image = sitk.Image(image)  # 浅拷贝, 调用者之后修改 image 时会先复制, 不影响缓存
+        nbytes = sitk.GetArrayViewFromImage(image).nbytes
+        image_data = sitk_to_vtk_image(image)
+        shared = np.shares_memory(vtk_image_to_array(image_data), sitk.GetArrayViewFromImage(image))
+        self.put(path, 'sitk', image, nbytes)
+        self.put(path, 'vtk', image_data, 0 if shared else nbytes)
+
+    def write_image(self, image, path):
+        """写图像文件(见 utils.storage.write_image), 并放入缓存"""
+
+        write_image(image, path)
+        self.put_image(path, image)
+
+    def read_image(self, path, pixel_type=None):
+        """读取 SimpleITK 图像, 返回与缓存共用内存的浅拷贝
+
+        Args:
+            path: 文件路径 -> 'str'
+            pixel_type: 像素类型, 为 None 时保持文件中的类型 -> 'int'
+
+        Returns:
+            image: 图像 -> 'SimpleITK.Image'
+
+        Raises:
+            RuntimeError: 文件读取失败
+        """
+
+        image = self.get(path, 'sitk')
+        if image is None:
+            image = read_image(path)
+            self.put(path, 'sitk', image, sitk.GetArrayViewFromImage(image).nbytes)
+        if pixel_type is not None and image.GetPixelID() != pixel_type:
+            return sitk.Cast(image, pixel_type)
+        return sitk.Image(image)
+
+    def read_vtk_image(self, path):
+        """读取 vtkImageData(nifti 约定, 与 vtkNIFTIImageReader 的输出一致), 返回缓存中的对象
+
+        没有 'vtk' 缓存时由同一文件的 SimpleITK 图像(见 read_image, 已缓存时不再解码)通过 vtk_bridge 转换,
+        两者共用像素数据, 作为一组缓存, 文件只解码一次, 内存只计一次.
+
+        Args:
+            path: 文件路径 -> 'str'
+
+        Returns:
+            image_data: 图像, 不要修改 -> 'vtkmodules.vtkCommonDataModel.vtkImageData'
+
+        Raises:
+            RuntimeError: 文件读取失败
+        """
+
+        image_data = self.get(path, 'vtk')
+        if image_data is None:
+            # 直接使用缓存中的图像: GetArrayViewFromImage 会对共用内存的浅拷贝先复制一份
+            image = self.get(path, 'sitk')
+            cached = image is not None
+            if image is None:
+                image = read_image(path)
+                nbytes = sitk.GetArrayViewFromImage(image).nbytes
+                self.put(path, 'sitk', image, nbytes)
+                with self._lock:
+                    # SimpleITK 图像比上限还大没有放入缓存时, 共用的内存也要计入
+                    cached = ('sitk', os.path.abspath(path)) in self._entries
+            image_data = sitk_to_vtk_image(image)
+            view = sitk.GetArrayViewFromImage(image)
+            shared = np.shares_memory(vtk_image_to_array(image_data), view)
+            self.put(path, 'vtk', image_data, 0 if shared and cached else view.nbytes)
+        return image_data
+
+    def read_array(self, path):
+        """读取图像数组的只读视图和几何信息, zyx 顺序
+
+        .npy 直接返回只读 memmap(见 utils.storage.read_array), 不经过 SimpleITK, 不复制也不放入缓存;
+        其他格式返回缓存中 SimpleITK 图像的视图, 视图保留对图像的引用, 图像被淘汰后仍可使用.
+
+        Args:
+            path: 文件路径 -> 'str'
+
+        Returns:
+            array: 只读数组 -> 'numpy.ndarray'
+            geometry: spacing, origin, direction -> 'dict'
+
+        Raises:
+            RuntimeError: 文件读取失败
+            OSError: npy 或几何信息文件不存在
+        """
+
+        if path.endswith('.npy'):
+            return read_array(path)
+
+        # 直接使用缓存中的图像: GetArrayViewFromImage 会对共用内存的浅拷贝先复制一份
+        image = self.get(path, 'sitk')
+        if image is None:
+            image = read_image(path)
+            self.put(path, 'sitk', image, sitk.GetArrayViewFromImage(image).nbytes)
+        geometry = dict(spacing=image.GetSpacing(), origin=image.GetOrigin(), direction=image.GetDirection())
+        return image_array_view(image), geometry
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        """命中/未命中统计
+
+        Returns:
+            stats: hits, misses, evictions, entries, bytes, max_bytes -> 'dict'
+        """
+
+        with self._lock:
+            return dict(hits=self.hits, misses=self.misses, evictions=self.evictions,
+                        entries=len(self._entries), bytes=self._bytes, max_bytes=self.max_bytes)
+
+    def report(self):
+        stats = self.stats()
+        total = stats['hits'] + stats['misses']
+        return ("体数据缓存: 命中 {hits}/{total} ({rate:.0%}), 淘汰 {evictions}, {entries} 个图像, "
+                "{mb:.1f}/{max_mb:.0f} MB".format(total=total, rate=stats['hits'] / total if total else 0,
+                                                  mb=stats['bytes'] / 2 ** 20, max_mb=stats['max_bytes'] / 2 ** 20,
+                                                  **stats))
+
+
+def _file_stamp(path):
+    try:
+        stat = os.stat(path)
+    except OSError:  # 文件不存在时不缓存, 由读取函数报错
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+# 进程内共用的缓存
+volume_cache = VolumeCache()
@@ -0,0 +1,121 @@
+import vtk
+import numpy as np
+import SimpleITK as sitk
+from vtkmodules.util.numpy_support import numpy_to_vtk, vtk_to_numpy
+
+
+# 几何约定
+# nifti: 与 vtkNIFTIImageReader 的输出一致, 原点为 0, 方向矩阵行列式为负时层的顺序是反的, 程序中的
+#        vtkImageData (显示、点集提取、路径规划)都使用这个约定
+# physical: 原点、间距、方向矩阵与 SimpleITK 图像相同, 体素坐标到世界坐标的变换一致
+GEOMETRIES = ('nifti', 'physical')
+
+
+def _flipped(direction):
+    return np.linalg.det(np.reshape(direction, (3, 3))) < 0
+
+
+def array_to_vtk_image(array, spacing, direction, owner=None, origin=None):
+    """zyx 顺序的数组转为 vtkImageData, 不需要翻转时直接使用 array 的内存, 不复制
+
+    Args:
+        array: zyx 顺序的数组 -> 'numpy.ndarray'
+        spacing: 体素间距, xyz -> 'tuple'
+        direction: 方向矩阵, 按行展开 -> 'tuple'
+        owner: array 内存的所有者, 与 vtkImageData 一起保留 -> 'object'
+        origin: 原点, 为 None 时使用 nifti 约定(原点为 0, 行列式为负时翻转层的顺序), 否则使用 physical 约定,
+                同时设置方向矩阵 -> 'tuple'
+
+    Returns:
+        image_data: 图像 -> 'vtkmodules.vtkCommonDataModel.vtkImageData'
+    """
+
+    if origin is None and _flipped(direction):
+        array = array[::-1]
+    array = np.ascontiguousarray(array)
+
+    image_data = vtk.vtkImageData()
+    image_data.SetDimensions(array.shape[::-1])
+    image_data.SetSpacing(spacing)
+    if origin is None:
+        image_data.SetOrigin(0, 0, 0)
+    else:
+        image_data.SetOrigin(origin)
+        image_data.SetDirectionMatrix(direction)
+    scalars = numpy_to_vtk(array.reshape(-1), deep=False)
+    scalars.SetName('NIFTI')
+    scalars._owner = owner
+    image_data.GetPointData().SetScalars(scalars)
+    return image_data
+
+
+def sitk_to_vtk_image(image, geometry='nifti'):
+    """SimpleITK 图像转为 vtkImageData, 不需要翻转时与 image 共用内存
+
+    nifti 约定下与 vtk_nii_reader 读取该图像的 .nii 文件的结果一致, 分割结果可以直接用于表面重建和路径规划,
+    不需要写文件再读取.
+
+    Args:
+        image: 图像, 转换后不要再修改像素 -> 'SimpleITK.Image'
+        geometry: 几何约定, 见 GEOMETRIES -> 'str'
+
+    Returns:
+        image_data: 图像 -> 'vtkmodules.vtkCommonDataModel.vtkImageData'
+
+    Raises:
+        ValueError: 未知的几何约定, 或者图像不是三维标量图像
+    """
+
+    if geometry not in GEOMETRIES:
+        raise ValueError("unknown geometry: {}".format(geometry))
+    if image.GetDimension() != 3 or image.GetNumberOfComponentsPerPixel() != 1:
+        raise ValueError("only 3D scalar images are supported")
+    origin = image.GetOrigin() if geometry == 'physical' else None
+    return array_to_vtk_image(sitk.GetArrayViewFromImage(image), image.GetSpacing(), image.GetDirection(), image,
+                              origin)
+
+
+def vtk_image_to_array(image_data):
+    """vtkImageData 的像素数组, zyx 顺序, 与 vtkImageData 共用内存, 不复制
+
+    Args:
+        image_data: 三维标量图像 -> 'vtkmodules.vtkCommonDataModel.vtkImageData'
+
+    Returns:
+        array: zyx 顺序的数组, 使用期间需要保留 image_data -> 'numpy.ndarray'
+    """
+
+    nx, ny, nz = image_data.GetDimensions()
+    return vtk_to_numpy(image_data.GetPointData().GetScalars()).reshape(nz, ny, nx)
+
+
+def vtk_to_sitk_image(image_data, reference=None):
+    """vtkImageData 转为 SimpleITK 图像, sitk_to_vtk_image 的逆变换
+
+    SimpleITK 不能直接使用外部内存, 像素数据复制一次.
+
+    Args:
+        image_data: 三维标量图像 -> 'vtkmodules.vtkCommonDataModel.vtkImageData'
+        reference: 参考图像, 给出时 image_data 按 nifti 约定处理, 原点和方向矩阵取自参考图像; 为 None 时
+                   按 physical 约定, 使用 image_data 的原点、间距和方向矩阵 -> 'SimpleITK.Image'
+
+    Returns:
+        image: 图像 -> 'SimpleITK.Image'
+    """
+
+    array = vtk_image_to_array(image_data)
+    if reference is not None:
+        if _flipped(reference.GetDirection()):
+            array = array[::-1]
+        image = sitk.GetImageFromArray(array)
+        image.SetSpacing(image_data.GetSpacing())
+        image.SetOrigin(reference.GetOrigin())
+        image.SetDirection(reference.GetDirection())
+        return image
+
+    matrix = image_data.GetDirectionMatrix()
+    image = sitk.GetImageFromArray(array)
+    image.SetSpacing(image_data.GetSpacing())
+    image.SetOrigin(image_data.GetOrigin())
+    image.SetDirection([matrix.GetElement(i, j) for i in range(3) for j in range(3)])
+    return image